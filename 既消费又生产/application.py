@@ -3,10 +3,13 @@ import copy
 import exceptions
 import logging
 import setproctitle
-from pika.exceptions import ConnectionClosed
+from pika.exceptions import AMQPConnectionError
 from config import rabbitmq_conf
-from common.rabbitmq.rabbitmq import MessageHandlerFactory, IMessageCallBack
-from common.public import load_json, dump_json
+from common.rabbitmq.rabbitmq import MessageHandlerFactory, ConnectionFactory, IMessageCallBack
+from common.public import dump_json
+from common.supervisor import WorkerSupervisor
+from common.metrics import start_http_server
+from common.sampledlog import SampledLogger
 from frame_choice import spider_run, status_statistics
 from config import app_conf
 logging.basicConfig(level=logging.WARNING)
@@ -20,6 +23,8 @@ class TaskHandler(IMessageCallBack):
         '''初始化RabbitMQ'''
         self.task_handler = None
         self.data_handler = None
+        # 不再逐条输出“收到任务”，按间隔输出收到的任务数；所有工作线程共用，SampledLogger内部加锁
+        self._log = SampledLogger(logger, level=logging.WARNING)
         self.create_task_handler()
         self.create_data_handler()
 
@@ -32,7 +37,7 @@ class TaskHandler(IMessageCallBack):
         def _(obj):
             try:
                 return MessageHandlerFactory.get_instance(message_class, connect_params, obj)
-            except ConnectionClosed:
+            except AMQPConnectionError:
                 raise exceptions.SpiderRabbitMQConnectionError
         message_class = rabbitmq_conf['message_class']
         connect_params = rabbitmq_conf['connect_params']
@@ -55,10 +60,18 @@ class TaskHandler(IMessageCallBack):
         logger.warning('爬虫启动！')
         self.task_handler.start_consuming(self)
 
+    def drain(self):
+        '''停止接收新任务，处理中的任务完成后start返回，可以在信号处理函数中调用'''
+        logger.warning('停止接收任务')
+        self.task_handler.stop_consuming()
+
     def stop(self):
         logger.warning("停止RabbitMQ")
+        self._log.flush()
         self.task_handler.close_channel()
         self.task_handler.close()
+        self.data_handler.close()
+        ConnectionFactory.close_all()
 
     def callback(self, ch, method, properties, body):
         '''从消息队列获取任务
@@ -68,8 +81,9 @@ class TaskHandler(IMessageCallBack):
         :param body:任务格式
         :return:None
         '''
-        logger.warning("收到任务")
-        task = load_json(body.decode())
+        self._log.count('task')
+        # 无法解码时抛出CodecError，消息被拒绝且不重新入队
+        task = self.task_handler.decode(properties, body)
         if not isinstance(task, dict) or not task:
             logger.error('任务格式解析错误！')
             logger.error(body)
@@ -79,8 +93,14 @@ class TaskHandler(IMessageCallBack):
 
 
 if __name__ == '__main__':
-    task = TaskHandler()
-    try:
-        task.start()
-    except KeyboardInterrupt:
-        task.stop()
+    workers = app_conf.get('workers', 1)
+    if workers > 1:
+        WorkerSupervisor(TaskHandler, workers).run()
+    else:
+        if app_conf.get('metrics_port'):
+            start_http_server(app_conf['metrics_port'])
+        task = TaskHandler()
+        try:
+            task.start()
+        except KeyboardInterrupt:
+            task.stop()
@@ -0,0 +1,312 @@
+'''基准测试套件：在进程内Broker上测试本仓库的每种收发方式
+每种方式分别测试发布吞吐量、消费吞吐量，以及按固定速率边发边收时的端到端延迟分位数；
+消息体中带有发布时间，消费时计算延迟
+运行：python -m benchmark bench [--mode pool --mode async ...]
+'''
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import threading
+import itertools
+from common.rabbitmq.memory import get_broker
+from common.rabbitmq.rabbitmq import MessageHandlerFactory, ConnectionFactory, IMessageCallBack
+
+# 只生产或者消费目录下的SelectConnection示例
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            os.pardir, '只生产或者消费')
+
+MESSAGE_PARAMS = {
+    "exchange": "bench",
+    "exchange_type": "topic",
+    "routing_key": "bench.task",
+    "task_queue": "bench_task",
+    "publish_data_queue": ["bench_task"],
+    "durable": True,
+    "delivery_mode": 2,
+    "prefetch_count": 16,
+}
+
+_brokers = itertools.count()
+
+
+def percentile(values, q):
+    '''
+    :param values: 已排序的数值
+    :param q: 0到100
+    :return: 最近秩分位数
+    '''
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * q / 100.0))]
+
+
+def paced(count, rate):
+    '''按固定速率产生消息，消息体中带有产生时间
+    :param count: 消息数
+    :param rate: 每秒消息数，0表示不限速
+    :return: 生成器
+    '''
+    started = time.perf_counter()
+    for number in range(count):
+        if rate:
+            delay = started + number / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield {'n': number, 'ts': time.perf_counter()}
+
+
+class Recorder(object):
+    # 记录消费到的消息数和延迟，收到count条后调用done
+    def __init__(self, count, done=None):
+        self.count = count
+        self.done = done
+        self.latencies = []
+        self.received = 0
+        self.finished = threading.Event()
+        self._lock = threading.Lock()
+
+    def record(self, message):
+        latency = time.perf_counter() - message['ts']
+        with self._lock:
+            self.latencies.append(latency)
+            self.received += 1
+            last = self.received == self.count
+        if last:
+            self.finished.set()
+            if self.done is not None:
+                self.done()
+
+
+class Mode(object):
+    # 一种收发方式，子类实现publish、consume，分别返回耗时
+    def __init__(self, args):
+        self.args = args
+        self.broker_name = 'bench-%i' % next(_brokers)
+        self.broker = get_broker(self.broker_name)
+        self.broker.rpc_latency = args.rpc_latency
+        self.broker.frame_latency = args.frame_latency
+        self.connect_params = {'transport': 'memory', 'memory_broker': self.broker_name}
+
+    def queue(self):
+        return self.broker.queues.get(MESSAGE_PARAMS['task_queue'], ())
+
+    def publish(self, messages):
+        raise NotImplementedError
+
+    def consume(self, recorder):
+        raise NotImplementedError
+
+    def e2e(self, count, rate):
+        '''消费在后台线程中运行，当前线程按速率发布
+        :return: 已排序的延迟
+        '''
+        recorder = Recorder(count)
+        consumer = threading.Thread(target=self.consume, args=(recorder,), daemon=True)
+        consumer.start()
+        self.publish(paced(count, rate))
+        consumer.join()
+        return sorted(recorder.latencies)
+
+
+class HandlerMode(Mode):
+    # RabbitMQMessageHandler，通过MessageHandlerFactory创建，连接参数transport为memory
+    def __init__(self, args, **params):
+        super(HandlerMode, self).__init__(args)
+        self.params = dict(MESSAGE_PARAMS, **params)
+
+    def handler(self):
+        return MessageHandlerFactory.get_instance('RabbitMQ', self.connect_params, self.params)
+
+    def publish(self, messages):
+        handler = self.handler()
+        handler.on_bind()
+        started = time.perf_counter()
+        for message in messages:
+            handler.publish_message(message)
+        elapsed = time.perf_counter() - started
+        handler.close()
+        return elapsed
+
+    def consume(self, recorder):
+        handler = self.handler()
+
+        class Task(IMessageCallBack):
+            def callback(self, ch, method, properties, body):
+                recorder.record(handler.decode(properties, body))
+                return True
+
+        recorder.done = handler.stop_consuming
+        started = time.perf_counter()
+        handler.start_consuming(Task())
+        elapsed = time.perf_counter() - started
+        handler.close()
+        return elapsed
+
+
+class AsyncMode(Mode):
+    # AsyncRabbitMQMessageHandler，发布确认在事件循环中并发等待
+    WINDOW = 1000
+
+    def handler(self, loop):
+        from common.rabbitmq.asyncrabbitmq import AsyncRabbitMQMessageHandler
+        return AsyncRabbitMQMessageHandler(self.connect_params, dict(MESSAGE_PARAMS, confirm_delivery=True),
+                                           loop=loop)
+
+    async def _publish(self, handler, messages):
+        await handler.on_bind()
+        pending = set()
+        for message in messages:
+            pending.add(asyncio.ensure_future(handler.publish(message)))
+            if len(pending) >= self.WINDOW:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            elif self.args.rate:
+                # 限速时让出事件循环，消费者才能及时处理
+                await asyncio.sleep(0)
+        if pending:
+            await asyncio.wait(pending)
+
+    def publish(self, messages):
+        loop = asyncio.new_event_loop()
+        handler = self.handler(loop)
+        started = time.perf_counter()
+        loop.run_until_complete(self._publish(handler, messages))
+        elapsed = time.perf_counter() - started
+        handler.close()
+        loop.close()
+        return elapsed
+
+    def consume(self, recorder):
+        loop = asyncio.new_event_loop()
+        handler = self.handler(loop)
+
+        async def callback(ch, method, properties, body):
+            recorder.record(handler.decode(properties, body))
+            return True
+
+        recorder.done = handler.stop_consuming
+        started = time.perf_counter()
+        handler.start_consuming(callback)
+        elapsed = time.perf_counter() - started
+        handler.close()
+        loop.close()
+        return elapsed
+
+
+class SelectMode(Mode):
+    # 只生产或者消费目录下的ExamplePublisher、ExampleConsumer，连接类换成进程内Broker的select_connection
+    def __init__(self, args):
+        super(SelectMode, self).__init__(args)
+        if EXAMPLES_DIR not in sys.path:
+            sys.path.append(EXAMPLES_DIR)
+        from publisher import ExamplePublisher
+        from consumer import ExampleConsumer
+
+        class Publisher(ExamplePublisher):
+            # 批量消息全部确认后停止
+            def on_delivery_confirmation(self, method_frame):
+                super(Publisher, self).on_delivery_confirmation(method_frame)
+                if self._batch is None and not self._deliveries and not self._stopping:
+                    self.stop()
+
+        class Consumer(ExampleConsumer):
+            # 消费发布者的队列
+            EXCHANGE = ExamplePublisher.EXCHANGE
+            EXCHANGE_TYPE = ExamplePublisher.EXCHANGE_TYPE
+            QUEUE = ExamplePublisher.QUEUE
+            ROUTING_KEY = ExamplePublisher.ROUTING_KEY
+
+        self.publisher_class = Publisher
+        self.consumer_class = Consumer
+
+    def queue(self):
+        return self.broker.queues.get(self.publisher_class.QUEUE, ())
+
+    def publish(self, messages):
+        publisher = self.publisher_class('amqp://memory/', connection_class=self.broker.select_connection)
+        publisher.publish_batch(messages)
+        started = time.perf_counter()
+        publisher.run()
+        return time.perf_counter() - started
+
+    def consume(self, recorder):
+        consumer = None
+
+        def handler(basic_deliver, properties, body):
+            recorder.record(codec.decode_message(properties, body))
+            return True
+
+        def done():
+            consumer._closing = True
+            consumer.stop_consuming()
+
+        from common.rabbitmq.codec import Codec
+        codec = Codec()
+        recorder.done = done
+        consumer = self.consumer_class('amqp://memory/', handler=handler,
+                                       connection_class=self.broker.select_connection)
+        started = time.perf_counter()
+        consumer.run()
+        return time.perf_counter() - started
+
+
+MODES = (
+    ('channel', lambda args: HandlerMode(args)),
+    ('pool', lambda args: HandlerMode(args, publish_mode='pool')),
+    ('pool+confirm', lambda args: HandlerMode(args, publish_mode='pool', confirm_delivery=True)),
+    ('batch-ack', lambda args: HandlerMode(args, publish_mode='pool', confirm_delivery=True,
+                                           ack_batch_size=16)),
+    ('async', lambda args: AsyncMode(args)),
+    ('select', lambda args: SelectMode(args)),
+)
+
+
+def bench(args):
+    # 关闭连接时示例程序会输出信道关闭的警告，这里只保留错误
+    logging.disable(logging.WARNING)
+    modes = dict(MODES)
+    names = args.mode or [name for name, _ in MODES]
+    print('%-14s %10s %10s %10s %10s %10s' % ('mode', 'pub msg/s', 'con msg/s',
+                                             'e2e p50ms', 'e2e p90ms', 'e2e p99ms'))
+    for name in names:
+        # 先发布count条，再消费同样的这些消息
+        mode = modes[name](args)
+        published = mode.publish(paced(args.count, 0))
+        backlog = len(mode.queue())
+        consumed = mode.consume(Recorder(backlog)) if backlog else float('nan')
+        # 每个阶段使用新的Broker，互不影响
+        latencies = modes[name](args).e2e(args.e2e_count, args.rate)
+        print('%-14s %10.0f %10.0f %10.2f %10.2f %10.2f' % (
+            name, args.count / published, backlog / consumed,
+            percentile(latencies, 50) * 1000, percentile(latencies, 90) * 1000,
+            percentile(latencies, 99) * 1000))
+    ConnectionFactory.close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser('bench', help='发布、消费吞吐量和端到端延迟')
+    command.add_argument('--mode', action='append', choices=[name for name, _ in MODES],
+                         help='只测试指定的方式，可以重复，默认全部')
+    command.add_argument('--count', type=int, default=5000, help='吞吐量测试的消息数')
+    command.add_argument('--e2e-count', type=int, default=2000, help='延迟测试的消息数')
+    command.add_argument('--rate', type=float, default=1000,
+                         help='延迟测试的发布速率（条/秒），0表示不限速')
+    command.add_argument('--rpc-latency', type=float, default=0.0002,
+                         help='模拟的RPC往返耗时（秒）')
+    command.add_argument('--frame-latency', type=float, default=0.0,
+                         help='模拟的单帧发送耗时（秒）')
+    args = parser.parse_args()
+    if 'bench' == args.command:
+        bench(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+'''批量确认基准：确认帧数与消费吞吐量
+handler并发处理、乱序完成，逐条确认与批量确认对比
+运行：python -m benchmark.ack
+'''
+
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from common.rabbitmq.memory import MemoryBroker, MemoryConnection
+from common.rabbitmq.rabbitmq import RabbitMQMessageHandler, IMessageCallBack
+
+MESSAGE_PARAMS = {
+    "exchange": "spider_data",
+    "exchange_type": "fanout",
+    "routing_key": "*queue",
+    "task_queue": "task_root_queue",
+    "publish_data_queue": ["source_queue", "data_queue"],
+    "durable": True,
+    "delivery_mode": 2,
+}
+
+
+class Task(IMessageCallBack):
+    # 处理耗时在0到max_time之间随机，处理完count条后停止消费
+    def __init__(self, count, max_time):
+        self.count = count
+        self.max_time = max_time
+        self.processed = 0
+        self.stop = None
+        self._lock = threading.Lock()
+
+    def callback(self, ch, method, properties, body):
+        if self.max_time:
+            time.sleep(random.random() * self.max_time)
+        with self._lock:
+            self.processed += 1
+            if self.processed == self.count:
+                self.stop()
+        return True
+
+
+def run(count, prefetch, batch, max_time, frame_latency):
+    '''
+    :return: (每秒消息数, 确认帧数, 剩余未确认消息数)
+    '''
+    broker = MemoryBroker(frame_latency=frame_latency)
+    broker.queues[MESSAGE_PARAMS['task_queue']] = deque(
+        [(None, b'{"url": "http://example.com/"}')] * count)
+    params = dict(MESSAGE_PARAMS, prefetch_count=prefetch, ack_batch_size=batch)
+    connection = MemoryConnection(broker)
+    handler = RabbitMQMessageHandler(None, params, connection=connection)
+    task = Task(count, max_time)
+    task.stop = handler.stop_consuming
+    start = time.perf_counter()
+    handler.start_consuming(task)
+    elapsed = time.perf_counter() - start
+    unacked = sum(len(channel._unacked) for channel in connection._channels)
+    return count / elapsed, broker.frames['basic.ack'], unacked
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=5000)
+    parser.add_argument('--prefetch', type=int, default=32)
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--max-time', type=float, default=0.0005,
+                        help='handler的最大处理耗时（秒）')
+    parser.add_argument('--frame-latency', type=float, default=0.00005,
+                        help='发送一个确认帧模拟的耗时（秒）')
+    args = parser.parse_args()
+    print('%-10s %10s %10s %8s' % ('mode', 'msg/s', 'ack frames', 'unacked'))
+    for name, batch in (('single', 0), ('batched', args.batch)):
+        rate, frames, unacked = run(args.count, args.prefetch, batch,
+                                    args.max_time, args.frame_latency)
+        print('%-10s %10.0f %10i %8i' % (name, rate, frames, unacked))
+
+
+if __name__ == '__main__':
+    main()
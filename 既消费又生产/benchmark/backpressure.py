@@ -0,0 +1,138 @@
+'''流控基准：Broker触发内存告警期间生产者按固定速率发布
+before为改造前的publish_message，直接发布，阻塞在basic_publish中直到告警解除；
+wait为没有spill时的publish_message，收到Connection.Blocked后在发布前等待，超过blocked_publish_timeout抛出异常；
+spill为配置了spill时的publish_message，阻塞期间的消息写入缓冲，解除后按顺序限速发布。
+统计送达的消息数、超时次数、生产者每次调用的耗时，以及rabbitmq_blocked_seconds_total记录的阻塞时间
+运行：python -m benchmark.backpressure
+'''
+
+import json
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import itertools
+from common.rabbitmq.memory import get_broker
+from common.rabbitmq.rabbitmq import MessageHandlerFactory, PublishBlockedTimeout
+from common.metrics import REGISTRY
+
+MESSAGE_PARAMS = {
+    "exchange": "bench_blocked",
+    "exchange_type": "direct",
+    "routing_key": "bench_blocked",
+    "task_queue": "bench_blocked",
+    "publish_data_queue": ["bench_blocked"],
+    "durable": True,
+    "delivery_mode": 2,
+    "publish_mode": "pool",
+    "confirm_delivery": True,
+}
+
+_brokers = itertools.count()
+
+
+def percentile(values, q):
+    '''
+    :param values: 已排序的数值
+    :param q: 0到100
+    :return: 最近秩分位数
+    '''
+    return values[min(len(values) - 1, int(len(values) * q / 100.0))]
+
+
+def alarm(broker, delay, duration):
+    # delay秒后触发告警，duration秒后解除
+    time.sleep(delay)
+    broker.block()
+    time.sleep(duration)
+    broker.unblock()
+
+
+def run(args, mode, directory):
+    '''
+    :param mode: before、wait或spill
+    :return: dict
+    '''
+    broker_name = 'bench-blocked-%i' % next(_brokers)
+    broker = get_broker(broker_name)
+    broker.rpc_latency = args.rpc_latency
+    params = dict(MESSAGE_PARAMS, blocked_publish_timeout=args.timeout)
+    if 'spill' == mode:
+        params['spill'] = {'path': directory, 'capacity': args.capacity, 'rate': args.drain_rate}
+    handler = MessageHandlerFactory.get_instance(
+        'RabbitMQ', {'transport': 'memory', 'memory_broker': broker_name}, params)
+    handler.on_bind()
+    blocked_seconds = REGISTRY.counter('rabbitmq_blocked_seconds_total',
+                                       labels={'exchange': MESSAGE_PARAMS['exchange']})
+    blocked_before = blocked_seconds.value
+
+    alarmer = threading.Thread(target=alarm, daemon=True,
+                               args=(broker, args.count / args.rate * args.alarm_at, args.blocked))
+    latencies = []
+    timeouts = 0
+    started = time.perf_counter()
+    alarmer.start()
+    for number in range(args.count):
+        delay = started + number / args.rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        body = json.dumps({'n': number})
+        called = time.perf_counter()
+        if 'before' == mode:
+            handler._publish_queues(body)
+        else:
+            try:
+                handler.publish_message(body)
+            except PublishBlockedTimeout:
+                timeouts += 1
+        latencies.append(time.perf_counter() - called)
+    alarmer.join()
+    if handler.spill is not None:
+        while len(handler.spill):
+            if not handler.drain_spill():
+                handler.connection.process_data_events(0.001)
+    # 处理Connection.Unblocked，累计阻塞时间
+    handler.connection.process_data_events(0)
+    handler.close()
+
+    numbers = [json.loads(body)['n'] for _, body in broker.queues[MESSAGE_PARAMS['task_queue']]]
+    latencies.sort()
+    return {
+        'delivered': len(numbers),
+        'timeouts': timeouts,
+        'ordered': numbers == sorted(numbers),
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1],
+        'stalls': sum(1 for latency in latencies if latency > 0.05),
+        'blocked': blocked_seconds.value - blocked_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=6000)
+    parser.add_argument('--rate', type=float, default=2000, help='生产者每秒发布的消息数')
+    parser.add_argument('--alarm-at', type=float, default=0.25, help='发布到这个比例时触发告警')
+    parser.add_argument('--blocked', type=float, default=1.0, help='告警持续的时间（秒）')
+    parser.add_argument('--timeout', type=float, default=0.1, help='wait模式的blocked_publish_timeout（秒）')
+    parser.add_argument('--capacity', type=int, default=1000, help='spill内存中最多缓冲的消息数')
+    parser.add_argument('--drain-rate', type=float, default=10000, help='spill解除阻塞后每秒重新发布的消息数')
+    parser.add_argument('--rpc-latency', type=float, default=0.0001, help='模拟的RPC往返耗时（秒）')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    print('%-7s %9s %8s %7s %9s %9s %9s %7s %9s' % (
+        'mode', 'delivered', 'timeouts', 'ordered', 'p50 ms', 'p99 ms', 'max ms', '>50ms', 'blocked s'))
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ('before', 'wait', 'spill'):
+            result = run(args, mode, directory)
+            print('%-7s %9i %8i %7s %9.3f %9.3f %9.1f %7i %9.2f' % (
+                mode, result['delivered'], result['timeouts'], result['ordered'],
+                result['p50'] * 1000, result['p99'] * 1000, result['max'] * 1000,
+                result['stalls'], result['blocked']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+'''大页面解析基准：几MB的GBK列表页，每种方式在单独的子进程中运行，统计解析加抽取的耗时和峰值RSS的增量
+before为改造前的做法，整页读入后按CHAR_SET解码成str，etree.HTML构建完整的DOM；
+tree为create_tree直接解析文件对象，增量解析、不解码；
+stream-head为Extractor.extract_stream只抽取页头的字段，找到后停止读取；
+stream-all为extract_stream抽取页头和页尾的字段，解析完的列表项随时删除
+运行：python -m benchmark.bigpage [--rows 40000]
+'''
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import subprocess
+import tempfile
+from lxml import etree
+from common.public import CHAR_SET, create_tree
+from common.extractor import Extractor
+
+HEAD_RULES = {
+    'title': ['//title/text()'],
+    'crumbs': ['//div[@class="crumbs"]/a/text()'],
+    'category': ['//h1[@class="category"]/text()'],
+}
+ALL_RULES = dict(HEAD_RULES, total=['//div[@class="pager"]/span[@class="total"]/text()'],
+                 next=['//div[@class="pager"]/a[@class="next"]/@href'])
+MODES = ('before', 'tree', 'stream-head', 'stream-all')
+
+
+def generate(path, rows):
+    # GBK编码的列表页，页头是面包屑和分类，中间是rows行列表，页尾是分页
+    with open(path, 'wb') as f:
+        f.write(('<html><head><meta http-equiv="Content-Type" content="text/html; charset=gbk">'
+                 '<title>企业名录</title></head><body><div class="crumbs"><a href="/">首页</a>'
+                 '<a href="/list/">企业名录</a></div><h1 class="category">制造业</h1><ul class="list">').encode('gbk'))
+        for number in range(rows):
+            f.write(('<li class="item"><a href="/company/%i.html">某某有限公司%i</a>'
+                     '<span class="addr">某省某市某区某路%i号</span><span class="tel">0571-%08i</span>'
+                     '<p class="desc">主营业务：机械设备、五金交电、电子产品的销售。</p></li>'
+                     % (number, number, number, number)).encode('gbk'))
+        f.write(('</ul><div class="pager"><span class="total">共%i条</span>'
+                 '<a class="next" href="/list/2.html">下一页</a></div></body></html>' % rows).encode('gbk'))
+
+
+def rss():
+    # 当前RSS（KB）
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() // 1024
+
+
+def child(mode, path):
+    baseline = rss()
+    started = time.perf_counter()
+    if 'before' == mode:
+        with open(path, 'rb') as f:
+            content = f.read()
+        html = content.decode(CHAR_SET.search(content[:1024].decode('ascii', 'ignore')).group(1))
+        result = Extractor(HEAD_RULES).extract(etree.ElementTree(etree.HTML(html)))
+    elif 'tree' == mode:
+        with open(path, 'rb') as f:
+            result = Extractor(HEAD_RULES).extract(create_tree(f))
+    else:
+        with open(path, 'rb') as f:
+            result = Extractor(HEAD_RULES if 'stream-head' == mode else ALL_RULES).extract_stream(f)
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'seconds': elapsed, 'peak': peak - baseline, 'result': result}, ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=40000, help='列表页的行数')
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    if args.child:
+        child(*args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'list.html')
+        generate(path, args.rows)
+        print('页面大小: %.1f MB' % (os.path.getsize(path) / 1024.0 / 1024))
+        print('%-12s %10s %14s  %s' % ('mode', 'ms', 'peak RSS MB', 'result'))
+        for mode in MODES:
+            output = subprocess.run([sys.executable, '-m', 'benchmark.bigpage', '--child', mode, path],
+                                    stdout=subprocess.PIPE, check=True,
+                                    cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+            result = json.loads(output.decode('utf-8'))
+            print('%-12s %10.1f %14.1f  %s' % (mode, result['seconds'] * 1000, result['peak'] / 1024.0,
+                                               json.dumps(result['result'], ensure_ascii=False)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+'''数据清洗基准：一组企业名录字段的清洗规则，清洗一批数据
+before为改造前的clean_item，每条数据的每个清洗器都要对clean_objects逐个eval查找类，再eval创建对象、setattr设置属性；
+compiled为common.cleaning编译后的流水线，逐条清洗；
+batch-stream为clean_batch按列清洗，每个清洗器对整列调用一次handle；
+batch为clean_batch，strip、replace、re_sub等清洗器实现了handle_batch，整列一次处理。
+清洗器在本模块中按DLQYSpider2.cleaner的约定实现，每个任务的数据按--batch条分批
+运行：python -m benchmark.cleaning
+'''
+
+import re
+import time
+import random
+import argparse
+from common.cleaning import CleanerRegistry, strip_all, sub_joined
+
+
+class Cleaner(object):
+    # 清洗器基类，子类实现process
+    name = None
+
+    def handle(self, stream):
+        for value in stream:
+            yield self.process(value)
+
+    def process(self, value):
+        return value
+
+
+class Strip(Cleaner):
+    name = 'strip'
+    chars = None
+
+    def process(self, value):
+        return value.strip(self.chars)
+
+    def handle_batch(self, values):
+        return strip_all(values, self.chars)
+
+
+class Replace(Cleaner):
+    name = 'replace'
+    old = ''
+    new = ''
+
+    def process(self, value):
+        return value.replace(self.old, self.new)
+
+    def handle_batch(self, values):
+        return sub_joined(re.escape(self.old), self.new.replace('\\', r'\\'), values)
+
+
+class RegexSub(Cleaner):
+    name = 're_sub'
+    pattern = ''
+    repl = ''
+
+    def process(self, value):
+        return re.sub(self.pattern, self.repl, value)
+
+    def handle_batch(self, values):
+        return sub_joined(self.pattern, self.repl, values)
+
+
+class RegexFirst(Cleaner):
+    name = 're_first'
+    pattern = ''
+    default = ''
+
+    def process(self, value):
+        match = re.search(self.pattern, value)
+        return match.group(1) if match else self.default
+
+
+class Join(Cleaner):
+    name = 'join'
+    sep = ''
+
+    def process(self, value):
+        return self.sep.join(value) if isinstance(value, list) else value
+
+    def handle_batch(self, values):
+        join = self.sep.join
+        return [join(value) if isinstance(value, list) else value for value in values]
+
+
+class Truncate(Cleaner):
+    name = 'truncate'
+    length = 200
+
+    def process(self, value):
+        return value[:self.length]
+
+    def handle_batch(self, values):
+        length = self.length
+        return [value[:length] for value in values]
+
+
+class ToInt(Cleaner):
+    name = 'to_int'
+    default = 0
+
+    def process(self, value):
+        try:
+            return int(value)
+        except ValueError:
+            return self.default
+
+
+clean_objects = ['Cleaner', 'Strip', 'Replace', 'RegexSub', 'RegexFirst', 'Join', 'Truncate', 'ToInt']
+
+CLEAN_ITEMS = [
+    ('max_num', 20),
+    ('name', {'cleaner': [{'join': {'sep': ''}}, {'strip': {}}, {'re_sub': {'pattern': r'\s+', 'repl': ''}}]}),
+    ('address', {'cleaner': [{'join': {'sep': ''}}, {'replace': {'old': '地址：', 'new': ''}}, {'strip': {}}]}),
+    ('tel', {'cleaner': [{'join': {'sep': ','}}, {'re_first': {'pattern': r'(\d{3,4}-?\d{7,8})'}}]}),
+    ('published', {'cleaner': [{'join': {'sep': ''}}, {'re_first': {'pattern': r'(\d{4}-\d{2}-\d{2})'}}]}),
+    ('desc', {'cleaner': [{'join': {'sep': ''}}, {'re_sub': {'pattern': r'<[^>]+>', 'repl': ''}},
+                          {'strip': {}}, {'truncate': {'length': 100}}]}),
+    ('employees', {'cleaner': [{'join': {'sep': ''}}, {'re_first': {'pattern': r'(\d+)', 'default': '0'}},
+                               {'to_int': {}}]}),
+]
+
+
+def clean_item_before(items, clean_items):
+    # 改造前的clean_item
+    def _(k):
+        yield items[k]
+
+    for k, v in clean_items:
+        if 'max_num' == k:
+            continue
+        stream = _(k)
+        for cleaner in v['cleaner']:
+            for name, attr in cleaner.items():
+                cls_name = [i for i in clean_objects[1:] if eval(i).name == name]
+                obj = eval(cls_name[0])()
+                [setattr(obj, k2, v2) for k2, v2 in attr.items()]
+                stream = obj.handle(stream)
+        items[k] = next(stream)
+    return items
+
+
+def generate(count, seed=0):
+    rng = random.Random(seed)
+    for number in range(count):
+        yield {
+            'name': ['  某某 机械有限公司%i ' % number],
+            'address': ['地址：某省某市某区某路%i号 ' % rng.randint(1, 999)],
+            'tel': ['电话', '0571-%08i' % rng.randint(0, 10 ** 8 - 1)],
+            'published': ['发布于 2018-%02i-%02i 10:00' % (rng.randint(1, 12), rng.randint(1, 28))],
+            'desc': ['<p>主营业务：<b>机械设备</b>、五金交电、电子产品的销售。%s</p>' % ('详情' * rng.randint(0, 50))],
+            'employees': ['员工%s人' % rng.choice(('', str(rng.randint(10, 5000))))],
+        }
+
+
+def batches(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=20000, help='数据条数')
+    parser.add_argument('--batch', type=int, default=1000, help='每个任务的数据条数')
+    args = parser.parse_args()
+
+    registry = CleanerRegistry(globals()[name] for name in clean_objects[1:])
+    # 同样的清洗器，去掉handle_batch
+    streaming = CleanerRegistry(type(name, (globals()[name],), {'handle_batch': None})
+                                for name in clean_objects[1:])
+    modes = (
+        ('before', lambda rows: [clean_item_before(items, CLEAN_ITEMS) for items in rows]),
+        ('compiled', lambda rows: [registry.compile(CLEAN_ITEMS).clean(items) for items in rows]),
+        ('batch-stream', lambda rows: streaming.compile(CLEAN_ITEMS).clean_batch(rows)),
+        ('batch', lambda rows: registry.compile(CLEAN_ITEMS).clean_batch(rows)),
+    )
+    results = {}
+    print('%-13s %10s %12s %10s' % ('mode', 'ms', 'items/s', 'us/item'))
+    for name, clean in modes:
+        rows = list(generate(args.count))
+        started = time.perf_counter()
+        results[name] = [items for batch in batches(rows, args.batch) for items in clean(batch)]
+        elapsed = time.perf_counter() - started
+        print('%-13s %10.1f %12.0f %10.2f' % (name, elapsed * 1000, args.count / elapsed,
+                                             elapsed / args.count * 1e6))
+    print('结果一致: %s' % all(results['before'] == result for result in results.values()))
+
+
+if __name__ == '__main__':
+    main()
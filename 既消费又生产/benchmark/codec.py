@@ -0,0 +1,77 @@
+'''消息体编解码基准：不同序列化和压缩方式的编码、解码耗时与消息体大小
+旧方式为json.dumps发送、body.decode()后json.loads解析
+运行：python -m benchmark.codec
+'''
+
+import json
+import random
+import argparse
+import timeit
+from common.rabbitmq.codec import Codec, SERIALIZERS, COMPRESSORS
+
+
+def task_payload(rand):
+    # 爬虫任务：入口URL和请求参数
+    return {'url': 'http://www.example.com/list/%i.html?page=%i' % (rand.randint(1, 10 ** 6),
+                                                                    rand.randint(1, 100)),
+            'method': 'GET',
+            'headers': {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36',
+                        'Referer': 'http://www.example.com/'},
+            'meta': {'depth': rand.randint(0, 5), 'retry': 0, 'source': '新闻', 'rule_id': 12},
+            'callback': 'parse_list'}
+
+
+def data_payload(rand):
+    # 解析结果：含正文和页面源码
+    paragraphs = ''.join('<p>%s</p>' % ('段落内容%i ' % rand.randint(0, 1000) * 20)
+                         for _ in range(60))
+    return {'url': 'http://www.example.com/detail/%i.html' % rand.randint(1, 10 ** 6),
+            'title': '标题%i' % rand.randint(1, 10 ** 6),
+            'publish_time': '2018-01-06 10:21:00',
+            'tags': ['tag%i' % i for i in range(10)],
+            'content': paragraphs,
+            'html': '<html><body>%s</body></html>' % paragraphs}
+
+
+def legacy(payload, number):
+    encode = timeit.timeit(lambda: json.dumps(payload), number=number)
+    body = json.dumps(payload).encode()
+    decode = timeit.timeit(lambda: json.loads(body.decode()), number=number)
+    return encode, decode, len(body)
+
+
+def measure(codec, payload, number):
+    encode = timeit.timeit(lambda: codec.encode(payload), number=number)
+    body, content_type, content_encoding = codec.encode(payload)
+    view = memoryview(body)
+    decode = timeit.timeit(lambda: codec.decode(view, content_type, content_encoding),
+                           number=number)
+    return encode, decode, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=2000)
+    parser.add_argument('--threshold', type=int, default=1024)
+    args = parser.parse_args()
+    rand = random.Random(1)
+    payloads = (('task', task_payload(rand)), ('data', data_payload(rand)))
+    codecs = []
+    for serializer in sorted(SERIALIZERS):
+        for compression in [None] + sorted(COMPRESSORS):
+            codecs.append(Codec(serializer, compression, args.threshold))
+    print('%-6s %-16s %12s %12s %10s' % ('body', 'codec', 'encode us', 'decode us', 'bytes'))
+    for name, payload in payloads:
+        number = args.number if name == 'task' else max(1, args.number // 20)
+        encode, decode, size = legacy(payload, number)
+        print('%-6s %-16s %12.2f %12.2f %10i' % (name, 'legacy', encode / number * 1e6,
+                                                 decode / number * 1e6, size))
+        for codec in codecs:
+            encode, decode, size = measure(codec, payload, number)
+            label = '%s+%s' % (codec.serializer, codec.compression or 'none')
+            print('%-6s %-16s %12.2f %12.2f %10i' % (name, label, encode / number * 1e6,
+                                                     decode / number * 1e6, size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+'''消费去重基准：消费者崩溃后重新投递的任务
+第一个消费者批量确认，处理到一半时Broker断开连接，已经处理完但还没有确认的任务回到队列；
+第二个消费者接着消费。none为不去重，dedup为两个消费者共用同一个DedupCache（代替Redis，进程重启后仍然有效）。
+统计回调执行次数、重复执行的任务数、去重命中数、回调的总耗时，以及每条消息去重检查的开销
+运行：python -m benchmark.dedup
+'''
+
+import json
+import time
+import logging
+import argparse
+import threading
+from collections import deque, Counter
+from pika.exceptions import AMQPError
+from common.rabbitmq.memory import MemoryBroker, MemoryConnection
+from common.rabbitmq.rabbitmq import RabbitMQMessageHandler, IMessageCallBack
+from common.rabbitmq.dedup import DedupCache
+
+MESSAGE_PARAMS = {
+    "exchange": "bench_dedup",
+    "exchange_type": "direct",
+    "routing_key": "bench_dedup",
+    "task_queue": "bench_dedup",
+    "publish_data_queue": ["bench_dedup"],
+    "durable": True,
+    "delivery_mode": 2,
+}
+
+
+class Task(IMessageCallBack):
+    # 每个任务耗时work秒，处理到crash_at条时调用crash
+    def __init__(self, work, crash_at=None, crash=None):
+        self.work = work
+        self.crash_at = crash_at
+        self.crash = crash
+        self.executed = Counter()
+        self._lock = threading.Lock()
+
+    def callback(self, ch, method, properties, body):
+        time.sleep(self.work)
+        with self._lock:
+            self.executed[json.loads(body)['n']] += 1
+            crash = self.crash is not None and sum(self.executed.values()) == self.crash_at
+        if crash:
+            self.crash()
+        return True
+
+
+def run(args, dedup):
+    '''
+    :param dedup: DedupCache或None
+    :return: dict
+    '''
+    broker = MemoryBroker()
+    queue = broker.queues[MESSAGE_PARAMS['task_queue']] = deque(
+        (None, json.dumps({'n': number, 'url': 'http://example.com/%i' % number}).encode())
+        for number in range(args.count))
+    params = dict(MESSAGE_PARAMS, prefetch_count=args.prefetch, ack_batch_size=args.batch)
+
+    # 第一个消费者处理到crash_at条时Broker断开连接
+    first = RabbitMQMessageHandler(None, params, connection=MemoryConnection(broker))
+    first.dedup = dedup
+    task = Task(args.work, args.count // 2, broker.stop)
+    try:
+        first.start_consuming(task)
+    except AMQPError:
+        pass
+    broker.start()
+    redelivered = len(queue) - (args.count - sum(task.executed.values()))
+
+    second = RabbitMQMessageHandler(None, params, connection=MemoryConnection(broker))
+    second.dedup = dedup
+    task.crash = None
+    consumer = threading.Thread(target=second.start_consuming, args=(task,), daemon=True)
+    consumer.start()
+    while queue or any(channel._unacked for channel in second.connection._channels):
+        time.sleep(0.005)
+    second.stop_consuming()
+    consumer.join()
+
+    executed = sum(task.executed.values())
+    return {
+        'executed': executed,
+        'duplicates': executed - len(task.executed),
+        'redelivered': redelivered,
+        'hits': 0 if dedup is None else dedup.hits,
+        'missing': args.count - len(task.executed),
+    }
+
+
+def overhead(count):
+    '''
+    :return: 每条消息计算去重键、检查并记录的耗时（秒）
+    '''
+    dedup = DedupCache(capacity=count // 2, labels={'queue': 'bench_dedup_overhead'})
+    bodies = [json.dumps({'n': number, 'url': 'http://example.com/%i' % number}).encode()
+              for number in range(count)]
+    started = time.perf_counter()
+    for body in bodies:
+        key = dedup.key(None, body)
+        if not dedup.seen(key):
+            dedup.add(key)
+    return (time.perf_counter() - started) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=4000)
+    parser.add_argument('--prefetch', type=int, default=64)
+    parser.add_argument('--batch', type=int, default=64, help='ack_batch_size')
+    parser.add_argument('--work', type=float, default=0.002, help='每个任务的耗时（秒）')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    print('%-6s %9s %11s %11s %6s %8s %8s' % (
+        'mode', 'executed', 'duplicates', 'redelivered', 'hits', 'missing', 'work s'))
+    for name, dedup in (('none', None), ('dedup', DedupCache(labels={'queue': 'bench_dedup'}))):
+        result = run(args, dedup)
+        print('%-6s %9i %11i %11i %6i %8i %8.2f' % (
+            name, result['executed'], result['duplicates'], result['redelivered'], result['hits'],
+            result['missing'], result['executed'] * args.work))
+    print('去重检查开销: %.2f us/条' % (overhead(args.count * 25) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
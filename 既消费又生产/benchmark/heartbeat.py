@@ -0,0 +1,96 @@
+'''心跳压力测试：持续投递耗时长的任务，统计连接被Broker断开的次数
+inline为改造前在连接线程中直接执行回调的方式，threaded为RabbitMQMessageHandler现在的方式
+运行：python -m benchmark.heartbeat
+'''
+
+import time
+import argparse
+import threading
+from collections import deque
+from pika.exceptions import ConnectionClosed
+from common.rabbitmq.memory import MemoryBroker, MemoryConnection
+from common.rabbitmq.rabbitmq import RabbitMQMessageHandler, IMessageCallBack
+
+MESSAGE_PARAMS = {
+    "exchange": "spider_data",
+    "exchange_type": "fanout",
+    "routing_key": "*queue",
+    "task_queue": "task_root_queue",
+    "publish_data_queue": ["source_queue", "data_queue"],
+    "durable": True,
+    "delivery_mode": 2,
+}
+
+
+class SlowTask(IMessageCallBack):
+    # 每条消息耗时task_time秒，处理完count条后停止消费
+    def __init__(self, count, task_time):
+        self.count = count
+        self.task_time = task_time
+        self.processed = 0
+        self.stop = None
+        self._lock = threading.Lock()
+
+    def callback(self, ch, method, properties, body):
+        time.sleep(self.task_time)
+        with self._lock:
+            self.processed += 1
+            if self.processed == self.count:
+                self.stop()
+        return True
+
+
+def run_inline(broker, task, heartbeat, prefetch):
+    drops = 0
+    while task.processed < task.count:
+        connection = MemoryConnection(broker, heartbeat=heartbeat)
+        channel = connection.channel()
+
+        def callback(ch, method, properties, body):
+            if task.callback(ch, method, properties, body):
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+
+        task.stop = channel.stop_consuming
+        channel.basic_qos(prefetch_count=prefetch)
+        channel.basic_consume(callback, queue=MESSAGE_PARAMS['task_queue'])
+        try:
+            channel.start_consuming()
+        except ConnectionClosed:
+            drops += 1
+    return drops
+
+
+def run_threaded(broker, task, heartbeat, prefetch):
+    drops = 0
+    while task.processed < task.count:
+        params = dict(MESSAGE_PARAMS, prefetch_count=prefetch)
+        handler = RabbitMQMessageHandler(None, params,
+                                         connection=MemoryConnection(broker, heartbeat=heartbeat))
+        task.stop = handler.stop_consuming
+        try:
+            handler.start_consuming(task)
+        except ConnectionClosed:
+            drops += 1
+    return drops
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=40)
+    parser.add_argument('--task-time', type=float, default=0.05)
+    parser.add_argument('--heartbeat', type=float, default=0.01)
+    parser.add_argument('--prefetch', type=int, default=4)
+    args = parser.parse_args()
+    print('%-10s %8s %10s %10s' % ('mode', 'drops', 'processed', 'seconds'))
+    for name, run in (('inline', run_inline), ('threaded', run_threaded)):
+        broker = MemoryBroker()
+        broker.queues[MESSAGE_PARAMS['task_queue']] = deque(
+            [(None, b'{"url": "http://example.com/"}')] * args.count)
+        task = SlowTask(args.count, args.task_time)
+        start = time.perf_counter()
+        drops = run(broker, task, args.heartbeat, args.prefetch)
+        print('%-10s %8i %10i %10.2f' % (name, drops, task.processed, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+'''日志开销基准：每10万条消息的CPU时间
+before为改造前发布、确认、消费路径上逐条输出日志的写法，after为SampledLogger采样和汇总；
+日志输出到/dev/null，分别测试INFO开启和关闭两种级别
+运行：python -m benchmark.logcost
+'''
+
+import os
+import time
+import logging
+import argparse
+import pika
+from common.sampledlog import SampledLogger
+
+LOG_FORMAT = ('%(levelname) -10s %(asctime)s'
+              '%(message)s')
+CONFIRMATION_TYPES = {pika.spec.Basic.Ack: 'ack', pika.spec.Basic.Nack: 'nack'}
+
+
+def before(logger, count):
+    method = pika.spec.Basic.Ack(delivery_tag=1)
+    body = b'{"url": "http://www.example.com/"}'
+    acked = 0
+    for number in range(1, count + 1):
+        # 发布
+        logger.info('发布消息 # %i', number)
+        logger.info('计划下一个消息的%0.1f秒', 10.0)
+        # 确认
+        confirmation_type = method.NAME.split('.')[1].lower()
+        logger.info('已收到投放代码的%s：%i', confirmation_type, number)
+        acked += 1
+        logger.info('已发布%i条消息，%i还没有被确认，“%i被查出，%i被扣留', number, 0, acked, 0)
+        # 消费
+        logger.info('收到消息 # %s 从这儿来的: %s: %s', number, None, body.decode())
+        logger.info('确认消息 %s', number)
+
+
+def after(logger, count):
+    method = pika.spec.Basic.Ack(delivery_tag=1)
+    body = b'{"url": "http://www.example.com/"}'
+    log = SampledLogger(logger)
+    acked = 0
+    for number in range(1, count + 1):
+        log.count('publish')
+        log.sample('schedule', '计划下一个消息的%0.1f秒', 10.0)
+        confirmation_type = CONFIRMATION_TYPES.get(type(method))
+        acked += 1
+        log.count(confirmation_type)
+        log.sample('confirm', '已发布%i条消息，%i还没有被确认，%i被确认，%i被拒绝', number, 0, acked, 0)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('收到消息 # %s 从这儿来的: %s: %s', number, None, body.decode())
+        log.count('ack')
+    log.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args()
+    logger = logging.getLogger('benchmark.logcost')
+    logger.propagate = False
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(handler)
+    print('%-8s %-8s %14s' % ('level', 'mode', 'cpu s/100k'))
+    for level in (logging.INFO, logging.WARNING):
+        logger.setLevel(level)
+        for name, run in (('before', before), ('after', after)):
+            start = time.process_time()
+            run(logger, args.count)
+            elapsed = time.process_time() - start
+            print('%-8s %-8s %14.3f' % (logging.getLevelName(level), name,
+                                        elapsed / args.count * 100000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+'''指标开销基准：每条消息的埋点耗时
+一条消息在消费路径上的埋点为：处理中+1、两次计时、处理耗时直方图、确认计数、处理中-1，
+发布路径为：两次计时、发布耗时直方图、发布计数
+运行：python -m benchmark.metrics
+'''
+
+import time
+import argparse
+import timeit
+import urllib.request
+from common.metrics import Registry, start_http_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=1000000)
+    args = parser.parse_args()
+    registry = Registry()
+    labels = {'queue': 'task_root_queue'}
+    handler_seconds = registry.histogram('rabbitmq_handler_seconds', '消息处理耗时（秒）', labels)
+    acks = registry.counter('rabbitmq_acks_total', '确认的消息数', labels)
+    inflight = registry.gauge('rabbitmq_inflight_messages', '处理中的消息数', labels)
+    publish_seconds = registry.histogram('rabbitmq_publish_seconds', '发布耗时（秒）',
+                                         {'exchange': 'spider_data'})
+    published = registry.counter('rabbitmq_published_total', '发布的消息数',
+                                 {'exchange': 'spider_data'})
+    perf_counter = time.perf_counter
+
+    def baseline():
+        pass
+
+    def consume():
+        inflight.inc()
+        started = perf_counter()
+        handler_seconds.observe(perf_counter() - started)
+        acks.inc()
+        inflight.dec()
+
+    def publish():
+        started = perf_counter()
+        publish_seconds.observe(perf_counter() - started)
+        published.inc()
+
+    empty = timeit.timeit(baseline, number=args.number)
+    print('%-10s %12s' % ('path', 'ns/message'))
+    for name, function in (('consume', consume), ('publish', publish)):
+        elapsed = timeit.timeit(function, number=args.number) - empty
+        print('%-10s %12.0f' % (name, elapsed / args.number * 1e9))
+
+    server = start_http_server(0, registry=registry)
+    url = 'http://127.0.0.1:%i/metrics' % server.server_address[1]
+    body = urllib.request.urlopen(url).read().decode('utf-8')
+    server.shutdown()
+    print('\n抓取%s，%i行，例如：' % (url, len(body.splitlines())))
+    print('\n'.join(line for line in body.splitlines() if line.startswith('rabbitmq_acks_total')
+                    or line.startswith('rabbitmq_handler_seconds_count')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+'''自适应prefetch模拟：多个竞争消费者处理耗时从毫秒到秒不等的混合任务
+离散事件模拟，不实际sleep；比较固定prefetch与AdaptivePrefetch的总耗时和消息在本地缓冲中的等待时间
+运行：python -m benchmark.prefetch
+'''
+
+import heapq
+import random
+import argparse
+import itertools
+from collections import deque
+from common.rabbitmq.prefetch import AdaptivePrefetch
+
+
+class SimConsumer(object):
+    # 单线程消费者
+    def __init__(self, name, prefetch, adaptive=None):
+        self.name = name
+        self.prefetch = prefetch
+        self.adaptive = adaptive
+        self.buffer = deque()
+        self.busy = False
+        self.unacked = 0
+        self.processed = 0
+
+
+def simulate(tasks, consumers, rtt, now):
+    '''
+    :param tasks: 每个任务的处理耗时列表，按入队顺序
+    :param consumers: SimConsumer列表
+    :param rtt: 网络往返时间（秒），投递和确认各需要半个rtt
+    :param now: 模拟时钟，单元素列表，AdaptivePrefetch通过它读取模拟时间
+    :return: (总耗时, 平均等待时间, 最大等待时间)
+    '''
+    queue = deque(tasks)
+    events = []
+    counter = itertools.count()
+    waits = []
+
+    def schedule(delay, action, *args):
+        heapq.heappush(events, (now[0] + delay, next(counter), action, args))
+
+    def dispatch():
+        # Broker轮询有空闲额度的消费者
+        progress = True
+        while queue and progress:
+            progress = False
+            for consumer in consumers:
+                if queue and consumer.unacked < consumer.prefetch:
+                    consumer.unacked += 1
+                    schedule(rtt / 2, arrive, consumer, queue.popleft())
+                    progress = True
+
+    def arrive(consumer, duration):
+        consumer.buffer.append((now[0], duration))
+        if not consumer.busy:
+            start(consumer)
+
+    def start(consumer):
+        delivered_at, duration = consumer.buffer.popleft()
+        waits.append(now[0] - delivered_at)
+        consumer.busy = True
+        schedule(duration, finish, consumer, duration)
+
+    def finish(consumer, duration):
+        consumer.busy = False
+        consumer.processed += 1
+        if consumer.adaptive is not None:
+            consumer.adaptive.record(duration)
+            prefetch = consumer.adaptive.update()
+            if prefetch is not None:
+                consumer.prefetch = prefetch
+        schedule(rtt / 2, acked, consumer)
+        if consumer.buffer:
+            start(consumer)
+
+    def acked(consumer):
+        consumer.unacked -= 1
+        dispatch()
+
+    dispatch()
+    while events:
+        now[0], _, action, args = heapq.heappop(events)
+        action(*args)
+    return now[0], sum(waits) / len(waits), max(waits)
+
+
+def workload(count, slow_ratio, seed):
+    rand = random.Random(seed)
+    return [rand.uniform(1.0, 5.0) if rand.random() < slow_ratio else rand.uniform(0.002, 0.02)
+            for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tasks', type=int, default=5000)
+    parser.add_argument('--consumers', type=int, default=4)
+    parser.add_argument('--slow-ratio', type=float, default=0.02)
+    parser.add_argument('--rtt', type=float, default=0.005)
+    parser.add_argument('--target', type=float, default=0.5, help='目标停留时间（秒）')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    tasks = workload(args.tasks, args.slow_ratio, args.seed)
+
+    print('%-10s %10s %10s %10s %12s %s' % ('mode', 'makespan', 'avg wait', 'max wait',
+                                            'adjustments', 'final prefetch'))
+    for name, prefetch, adaptive in (('fixed-1', 1, False), ('fixed-50', 50, False),
+                                     ('adaptive', 10, True)):
+        now = [0.0]
+        consumers = []
+        for i in range(args.consumers):
+            consumer = SimConsumer(i, prefetch)
+            if adaptive:
+                consumer.adaptive = AdaptivePrefetch(prefetch=prefetch, max_prefetch=200,
+                                                     target_time=args.target, interval=0.1,
+                                                     clock=lambda: now[0])
+            consumers.append(consumer)
+        makespan, avg_wait, max_wait = simulate(tasks, consumers, args.rtt, now)
+        adjustments = sum(len(c.adaptive.decisions) for c in consumers if c.adaptive)
+        print('%-10s %10.2f %10.3f %10.2f %12i %s' % (name, makespan, avg_wait, max_wait,
+                                                      adjustments, [c.prefetch for c in consumers]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+'''发布吞吐量基准：每条消息新建信道 vs 长连接信道池
+运行：python -m benchmark.publish
+'''
+
+import time
+import argparse
+from common.rabbitmq.memory import MemoryBroker, MemoryConnection
+from common.rabbitmq.rabbitmq import RabbitMQMessageHandler
+
+MESSAGE_PARAMS = {
+    "exchange": "spider_data",
+    "exchange_type": "fanout",
+    "routing_key": "*queue",
+    "publish_data_queue": ["source_queue", "data_queue"],
+    "durable": True,
+    "delivery_mode": 2,
+}
+
+MODES = (
+    ('channel', {}),
+    ('pool', {'publish_mode': 'pool'}),
+    ('pool+confirm', {'publish_mode': 'pool', 'confirm_delivery': True}),
+)
+
+
+def run(mode_params, count, rpc_latency):
+    '''
+    :param mode_params: 发布模式相关的配置
+    :param count: 发布的消息数
+    :param rpc_latency: 模拟的RPC往返耗时
+    :return: (每秒消息数, Broker收到的帧统计)
+    '''
+    broker = MemoryBroker(rpc_latency=rpc_latency)
+    params = dict(MESSAGE_PARAMS, **mode_params)
+    handler = RabbitMQMessageHandler(None, params, connection=MemoryConnection(broker))
+    handler.on_bind()
+    broker.frames.clear()
+    body = b'{"url": "http://example.com/", "page": 1}'
+    start = time.perf_counter()
+    for _ in range(count):
+        handler.publish_message(body)
+    elapsed = time.perf_counter() - start
+    return count / elapsed, broker.frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--rpc-latency', type=float, default=0.0002,
+                        help='模拟的RPC往返耗时（秒）')
+    args = parser.parse_args()
+    print('%-14s %12s %10s' % ('mode', 'msg/s', 'rpc/msg'))
+    for name, mode_params in MODES:
+        rate, frames = run(mode_params, args.count, args.rpc_latency)
+        rpcs = sum(frames.values()) - frames['basic.publish']
+        print('%-14s %12.0f %10.2f' % (name, rate, rpcs / args.count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+'''重连恢复基准：Broker重启后所有消费者恢复消费的时间
+一组ExampleConsumer连接到进程内Broker，Broker断开所有连接并停止downtime秒后恢复；
+统计从Broker恢复到每个消费者重新开始消费的时间、恢复后每100毫秒内最多的连接尝试次数，以及每个消费者恢复时等待的往返次数
+运行：python -m benchmark.recovery
+'''
+
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+from common.rabbitmq.memory import MemoryBroker
+from common.rabbitmq.reconnect import ReconnectPolicy
+from common.rabbitmq.topology import TopologyCache
+
+# 只生产或者消费目录下的SelectConnection示例
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             os.pardir, '只生产或者消费'))
+from consumer import ExampleConsumer
+
+
+class NoCache(TopologyCache):
+    # 改造前的行为：每次重连都逐个声明
+    def mark_complete(self):
+        pass
+
+
+class Consumer(ExampleConsumer):
+    # 记录每次开始消费的时间
+    def __init__(self, *args, **kwargs):
+        super(Consumer, self).__init__(*args, **kwargs)
+        self.started = []
+        self.consuming = threading.Event()
+
+    def start_consuming(self):
+        self.started.append(time.monotonic())
+        self.consuming.set()
+        super(Consumer, self).start_consuming()
+
+    def shutdown(self):
+        self._closing = True
+        self._connection.add_callback_threadsafe(self.stop_consuming)
+
+
+def peak(times, window):
+    '''
+    :param times: 已排序的时间点
+    :param window: 窗口长度（秒）
+    :return: 任意window秒内最多的时间点数
+    '''
+    best = start = 0
+    for end, value in enumerate(times):
+        while value - times[start] > window:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+
+def run(args, policy, topology):
+    '''
+    :param policy: 返回ReconnectPolicy的函数
+    :param topology: 返回TopologyCache的函数
+    :return: (恢复时间列表, 每100毫秒最多的连接尝试, 每个消费者的往返次数)
+    '''
+    broker = MemoryBroker(rpc_latency=args.rpc_latency)
+    consumers = [Consumer('amqp://memory/', handler=lambda *unused: True,
+                          connection_class=broker.select_connection,
+                          reconnect_policy=policy(), topology=topology())
+                 for _ in range(args.consumers)]
+    threads = [threading.Thread(target=consumer.run, daemon=True) for consumer in consumers]
+    for thread in threads:
+        thread.start()
+    for consumer in consumers:
+        consumer.consuming.wait()
+        consumer.consuming.clear()
+
+    broker.stop()
+    del broker.attempts[:]
+    time.sleep(args.downtime)
+    round_trips = broker.round_trips
+    up = time.monotonic()
+    broker.start()
+    for consumer in consumers:
+        consumer.consuming.wait(args.timeout)
+    recovery = sorted(consumer.started[-1] - up for consumer in consumers
+                      if consumer.consuming.is_set())
+    round_trips = (broker.round_trips - round_trips) / max(len(recovery), 1)
+    # 只统计Broker恢复后到达的连接尝试，停止期间被拒绝的尝试不消耗Broker资源
+    attempts = peak(sorted(t for t in broker.attempts if t >= up), 0.1)
+
+    for consumer in consumers:
+        consumer.shutdown()
+    for thread in threads:
+        thread.join(1.0)
+    return recovery, attempts, round_trips
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--consumers', type=int, default=50)
+    parser.add_argument('--downtime', type=float, default=2.0, help='Broker停止的时间（秒）')
+    parser.add_argument('--rpc-latency', type=float, default=0.005, help='模拟的RPC往返耗时（秒）')
+    parser.add_argument('--initial', type=float, default=0.1, help='第一次重连的最大等待时间（秒）')
+    parser.add_argument('--maximum', type=float, default=5.0, help='重连等待时间的上限（秒）')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    modes = (
+        ('fixed-5s', lambda: ReconnectPolicy(initial=5.0, multiplier=1.0, jitter=False), NoCache),
+        ('backoff', lambda: ReconnectPolicy(args.initial, args.maximum), NoCache),
+        ('backoff+cache', lambda: ReconnectPolicy(args.initial, args.maximum), TopologyCache),
+        ('backoff+passive', lambda: ReconnectPolicy(args.initial, args.maximum),
+         lambda: TopologyCache(passive=True)),
+    )
+    print('%-16s %9s %9s %9s %10s %9s %8s' % ('mode', 'recovered', 'p50 s', 'p99 s', 'max s',
+                                              'peak/100ms', 'rtt'))
+    for name, policy, topology in modes:
+        recovery, attempts, round_trips = run(args, policy, topology)
+        print('%-16s %9i %9.2f %9.2f %10.2f %9i %8.1f' % (
+            name, len(recovery), recovery[len(recovery) // 2], recovery[int(len(recovery) * 0.99)],
+            recovery[-1], attempts, round_trips))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+'''真实URL解析基准：本地HTTP替身模拟搜索引擎的跳转页，每个请求在服务端耗时latency秒
+搜狗、好搜的链接返回带URL='...'的200页面，百度的链接返回302。
+before为改造前的Sougou.process，每个URL一次requests.get，不复用连接；
+session为改造后的Sougou.process，逐个解析，复用连接池；
+resolve_many为RealUrlResolver并发解析，每个主机最多per-host个请求同时进行；
+baidu为百度的RealUrlResolver.resolve_many。统计耗时、吞吐量、服务端收到的TCP连接数和解析正确的URL数
+运行：python -m benchmark.resolver
+'''
+
+import time
+import logging
+import argparse
+import threading
+import requests
+from urllib.parse import quote, unquote, urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from common.get_real_url import Sougou, RealUrlResolver
+
+
+class RedirectServer(object):
+    # 在后台线程中运行，start返回监听的端口
+    def __init__(self, latency=0.0):
+        '''
+        :param latency: 每个请求在服务端的耗时（秒）
+        '''
+        self.latency = latency
+        self.connections = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # 响应头和响应体分两次发送，关闭Nagle算法，避免keep-alive连接上的延迟确认等待
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super(Handler, self).setup()
+                with stand_in._lock:
+                    stand_in.connections += 1
+
+            def do_GET(self):
+                with stand_in._lock:
+                    stand_in.requests += 1
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                path = urlparse(self.path)
+                target = parse_qs(path.query).get('url', [''])[0]
+                if path.path.startswith('/baidu/'):
+                    self.send_response(302)
+                    self.send_header('Location', target)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = ("<meta content=\"always\" name=\"referrer\"><script>window.location.replace(\"%s\")"
+                        "</script><noscript><META http-equiv=\"refresh\" content=\"0;URL='%s'\"></noscript>"
+                        % (target, quote(target, safe=':/'))).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address[1]
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def process_before(url, pattern1=Sougou.pattern1, pattern2=Sougou.pattern2):
+    # 改造前的Sougou.process
+    m1 = pattern1.search(url)
+    if m1:
+        response = requests.get(m1.group())
+        if response.status_code == 200:
+            m2 = pattern2.search(response.text)
+            if m2:
+                return unquote(m2.group(1))
+            return url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=400, help='URL数')
+    parser.add_argument('--latency', type=float, default=0.02, help='服务端每个请求的耗时（秒）')
+    parser.add_argument('--workers', type=int, default=16, help='RealUrlResolver的线程数')
+    parser.add_argument('--per-host', type=int, default=8, help='每个主机同时进行的请求数')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    server = RedirectServer(args.latency)
+    base = 'http://127.0.0.1:%i' % server.start()
+    targets = ['http://www.example.com/news/%i.html?from=search&id=%i' % (number, number)
+               for number in range(args.count)]
+    sougou = ['%s/link?url=%s' % (base, quote(target, safe='')) for target in targets]
+    baidu = ['%s/baidu/link?url=%s' % (base, quote(target, safe='')) for target in targets]
+
+    def sequential(urls):
+        engine = Sougou('搜狗')
+        try:
+            return [engine.process(url) for url in urls]
+        finally:
+            engine.close()
+
+    def concurrent(name):
+        def resolve_many(urls):
+            resolver = RealUrlResolver(name, max_workers=args.workers, per_host=args.per_host)
+            try:
+                return resolver.resolve_many(urls)
+            finally:
+                resolver.close()
+        return resolve_many
+
+    modes = (
+        ('before', sougou, lambda urls: [process_before(url) for url in urls]),
+        ('session', sougou, sequential),
+        ('resolve_many', sougou, concurrent('搜狗')),
+        ('baidu', baidu, concurrent('百度')),
+    )
+    print('%-13s %10s %10s %12s %8s' % ('mode', 'ms', 'urls/s', 'connections', 'correct'))
+    for name, urls, resolve in modes:
+        connections = server.connections
+        started = time.perf_counter()
+        resolved = resolve(urls)
+        elapsed = time.perf_counter() - started
+        correct = sum(1 for url, target in zip(resolved, targets) if url == target)
+        print('%-13s %10.1f %10.0f %12i %8i' % (name, elapsed * 1000, len(urls) / elapsed,
+                                                server.connections - connections, correct))
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
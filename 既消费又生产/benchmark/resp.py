@@ -0,0 +1,130 @@
+'''本地Redis替身
+在本机端口上按RESP协议应答，支持集合和字符串的几个常用命令，供基准测试用真实的redis客户端连接；
+latency模拟每次网络往返的耗时：一次读到的请求（包括pipeline中的多个命令）只等待一次，较大的请求可能分几次读到
+'''
+
+import time
+import socket
+import threading
+import socketserver
+
+
+def parse(buffer):
+    '''从缓冲区中解析完整的命令
+    :param buffer: 收到的字节
+    :return: (命令列表, 剩余的字节)
+    '''
+    commands = []
+    position = 0
+    while True:
+        command, end = _parse_command(buffer, position)
+        if command is None:
+            return commands, buffer[position:]
+        commands.append(command)
+        position = end
+
+
+def _parse_command(buffer, position):
+    line_end = buffer.find(b'\r\n', position)
+    if line_end < 0:
+        return None, position
+    if buffer[position:position + 1] != b'*':
+        # 内联命令，如redis-cli的PING
+        return buffer[position:line_end].split(), line_end + 2
+    count = int(buffer[position + 1:line_end])
+    position = line_end + 2
+    arguments = []
+    for _ in range(count):
+        line_end = buffer.find(b'\r\n', position)
+        if line_end < 0:
+            return None, position
+        length = int(buffer[position + 1:line_end])
+        start = line_end + 2
+        if len(buffer) < start + length + 2:
+            return None, position
+        arguments.append(buffer[start:start + length])
+        position = start + length + 2
+    return arguments, position
+
+
+class RespServer(object):
+    # 在后台线程中运行，start返回监听的端口
+    def __init__(self, latency=0.0):
+        '''
+        :param latency: 每次往返的耗时（秒）
+        '''
+        self.latency = latency
+        self.round_trips = 0
+        self.commands = 0
+        self.sets = {}
+        self.strings = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        '''
+        :return: 端口
+        '''
+        stand_in = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                pending = b''
+                while True:
+                    data = self.request.recv(65536)
+                    if not data:
+                        return
+                    commands, pending = parse(pending + data)
+                    if commands:
+                        self.request.sendall(stand_in.round_trip(commands))
+
+        self._server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address[1]
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def round_trip(self, commands):
+        '''执行一次读到的全部命令
+        :return: 全部回复
+        '''
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.round_trips += 1
+            self.commands += len(commands)
+            return b''.join(self._execute(command) for command in commands)
+
+    def _execute(self, command):
+        name = command[0].upper()
+        arguments = command[1:]
+        if b'SADD' == name:
+            members = self.sets.setdefault(arguments[0], set())
+            before = len(members)
+            members.update(arguments[1:])
+            return b':%i\r\n' % (len(members) - before)
+        if b'SCARD' == name:
+            return b':%i\r\n' % len(self.sets.get(arguments[0], ()))
+        if b'DEL' == name:
+            removed = sum(1 for key in arguments
+                          if self.sets.pop(key, None) is not None or self.strings.pop(key, None) is not None)
+            return b':%i\r\n' % removed
+        if b'EXISTS' == name:
+            return b':%i\r\n' % sum(1 for key in arguments if key in self.sets or key in self.strings)
+        if b'SET' == name:
+            # 不处理过期时间，只支持NX
+            if b'NX' in (argument.upper() for argument in arguments[2:]) and arguments[0] in self.strings:
+                return b'$-1\r\n'
+            self.strings[arguments[0]] = arguments[1]
+            return b'+OK\r\n'
+        if b'HELLO' == name:
+            # 新版客户端连接时协商协议版本，回复只带proto
+            protocol = int(arguments[0]) if arguments else 2
+            return (b'%%1\r\n$5\r\nproto\r\n:%i\r\n' if 3 == protocol else b'*2\r\n$5\r\nproto\r\n:%i\r\n') % protocol
+        if name in (b'PING', b'SELECT', b'CLIENT'):
+            return b'+OK\r\n' if b'PING' != name else b'+PONG\r\n'
+        return b'-ERR unknown command\r\n'
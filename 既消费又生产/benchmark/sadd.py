@@ -0,0 +1,50 @@
+'''批量SADD基准：RedisClient.pusub写入一个任务的用户ID
+loop为改造前的写法，每个ID一个SADD；variadic为一个SADD带全部ID；chunked为按CHUNK_SIZE分块、用pipeline发送；
+generator与chunked相同，输入是生成器。Redis为benchmark.resp中的本地替身，latency模拟网络往返。
+统计耗时、往返次数和返回的新成员数（一半ID已经存在）
+运行：python -m benchmark.sadd
+'''
+
+import time
+import argparse
+from common.redis_connection import RedisClient
+from benchmark.resp import RespServer
+
+
+def pusub_loop(client, key, message):
+    # 改造前的pusub
+    for user_id in message:
+        client.r_con.sadd(key, user_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=10000, help='每个任务的用户ID数')
+    parser.add_argument('--latency', type=float, default=0.0002, help='模拟的网络往返耗时（秒）')
+    args = parser.parse_args()
+
+    server = RespServer(latency=args.latency)
+    client = RedisClient(port=server.start())
+    ids = ['user_%i' % number for number in range(args.count)]
+    modes = (
+        ('loop', lambda key: pusub_loop(client, key, ids)),
+        ('variadic', lambda key: client.pusub(key, ids, chunk_size=len(ids) + 1)),
+        ('chunked', lambda key: client.pusub(key, ids)),
+        ('generator', lambda key: client.pusub(key, ('user_%i' % number for number in range(args.count)))),
+    )
+    print('%-10s %10s %8s %8s' % ('mode', 'ms', 'rtt', 'added'))
+    for name, pusub in modes:
+        key = 'users:' + name
+        # 一半的ID已经存在
+        client.pusub(key, ids[::2])
+        round_trips = server.round_trips
+        started = time.perf_counter()
+        added = pusub(key)
+        elapsed = time.perf_counter() - started
+        print('%-10s %10.1f %8i %8s' % (name, elapsed * 1000, server.round_trips - round_trips,
+                                         '-' if added is None else added))
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
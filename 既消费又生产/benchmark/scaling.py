@@ -0,0 +1,88 @@
+'''多进程消费扩展性基准：1到N个工作进程的总吞吐量
+每个工作进程使用自己的内存Broker，回调中用lxml解析页面模拟爬虫的CPU开销
+运行：python -m benchmark.scaling --workers 4
+'''
+
+import os
+import time
+import argparse
+from lxml import etree
+from common.rabbitmq.memory import MemoryBroker, MemoryConnection
+from common.rabbitmq.rabbitmq import RabbitMQMessageHandler, IMessageCallBack
+from common.supervisor import WorkerSupervisor
+
+MESSAGE_PARAMS = {
+    "exchange": "spider_data",
+    "exchange_type": "fanout",
+    "routing_key": "*queue",
+    "task_queue": "task_root_queue",
+    "publish_data_queue": ["source_queue", "data_queue"],
+    "durable": True,
+    "delivery_mode": 2,
+    "prefetch_count": 1,
+}
+
+PAGE = ('<html><head><meta charset="utf-8"><title>列表页</title></head><body><ul>%s</ul></body></html>' %
+        ''.join('<li class="item"><a href="/article/%i.html">第%i条新闻标题</a>'
+                '<span class="date">2018-01-%02i</span></li>' % (i, i, i % 28 + 1)
+                for i in range(200))).encode('utf-8')
+
+
+class ParseWorker(IMessageCallBack):
+    # 基准用的任务处理实例，接口与TaskHandler一致
+    def __init__(self, backlog):
+        broker = MemoryBroker()
+        self.handler = RabbitMQMessageHandler(None, MESSAGE_PARAMS,
+                                              connection=MemoryConnection(broker))
+        channel = self.handler._get_channel()
+        channel.queue_declare(queue=MESSAGE_PARAMS['task_queue'], durable=True)
+        broker.queues[MESSAGE_PARAMS['task_queue']].extend([(None, PAGE)] * backlog)
+
+    def start(self):
+        self.handler.start_consuming(self)
+
+    def drain(self):
+        self.handler.stop_consuming()
+
+    def stop(self):
+        self.handler.close()
+
+    def callback(self, ch, method, properties, body):
+        tree = etree.HTML(body)
+        return bool(tree.xpath('//li[@class="item"]/a/@href'))
+
+
+def measure(workers, duration, backlog):
+    '''
+    :param workers: 工作进程数
+    :param duration: 统计时长（秒）
+    :param backlog: 每个工作进程预先积压的消息数
+    :return: 总吞吐量（条/秒）
+    '''
+    supervisor = WorkerSupervisor(lambda: ParseWorker(backlog), workers,
+                                  drain_timeout=5.0)
+    supervisor.start()
+    time.sleep(1.0)  # 预热
+    supervisor.report()
+    time.sleep(duration)
+    rates = supervisor.report()
+    supervisor.stop()
+    return sum(rates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--backlog', type=int, default=200000)
+    args = parser.parse_args()
+    print('%-8s %12s %8s' % ('workers', 'msg/s', 'speedup'))
+    base = None
+    for workers in range(1, args.workers + 1):
+        rate = measure(workers, args.duration, args.backlog)
+        base = base or rate
+        print('%-8i %12.0f %8.2f' % (workers, rate, rate / base))
+
+
+if __name__ == '__main__':
+    main()
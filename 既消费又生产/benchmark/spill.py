@@ -0,0 +1,154 @@
+'''发布缓冲基准：Broker停止期间生产者按固定速率发布
+drop为改造前的做法，发布失败的消息丢弃，之后每次发布前尝试重连；spill为失败或积压的消息写入SpillBuffer（内存满后写磁盘），
+恢复后按顺序重新发布；spill+rate限制恢复后重新发布的速率，避免一次补发阻塞生产者。
+统计丢失的消息数、生产者每次调用publish_message的耗时、恢复后清空积压的速率，以及队列中消息的顺序
+运行：python -m benchmark.spill
+'''
+
+import json
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import itertools
+from pika.exceptions import AMQPError
+from common.rabbitmq.memory import get_broker
+from common.rabbitmq.rabbitmq import MessageHandlerFactory
+from common.rabbitmq.reconnect import ReconnectPolicy
+
+MESSAGE_PARAMS = {
+    "exchange": "bench_spill",
+    "exchange_type": "direct",
+    "routing_key": "bench_spill",
+    "task_queue": "bench_spill",
+    "publish_data_queue": ["bench_spill"],
+    "durable": True,
+    "delivery_mode": 2,
+    "publish_mode": "pool",
+    "confirm_delivery": True,
+}
+
+_brokers = itertools.count()
+
+
+def percentile(values, q):
+    '''
+    :param values: 已排序的数值
+    :param q: 0到100
+    :return: 最近秩分位数
+    '''
+    return values[min(len(values) - 1, int(len(values) * q / 100.0))]
+
+
+def outage(broker, delay, downtime, marks):
+    # delay秒后停止Broker，downtime秒后恢复
+    time.sleep(delay)
+    broker.stop()
+    marks['down'] = time.monotonic()
+    time.sleep(downtime)
+    marks['up'] = time.monotonic()
+    broker.start()
+
+
+def run(args, spill):
+    '''
+    :param spill: None表示不使用缓冲，否则为message_params中的spill配置
+    :return: dict
+    '''
+    broker_name = 'bench-spill-%i' % next(_brokers)
+    broker = get_broker(broker_name)
+    broker.rpc_latency = args.rpc_latency
+    params = dict(MESSAGE_PARAMS, spill=spill)
+    handler = MessageHandlerFactory.get_instance(
+        'RabbitMQ', {'transport': 'memory', 'memory_broker': broker_name}, params)
+    handler.reconnect_policy = ReconnectPolicy(args.initial, args.maximum)
+    handler.on_bind()
+
+    marks = {}
+    stopper = threading.Thread(target=outage, daemon=True,
+                               args=(broker, args.count / args.rate * args.outage_at, args.downtime, marks))
+    latencies = []
+    lost = 0
+    backlog = {}
+    started = time.perf_counter()
+    stopper.start()
+    for number in range(args.count):
+        delay = started + number / args.rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        called = time.perf_counter()
+        if spill is None:
+            try:
+                handler.publish_message({'n': number})
+            except AMQPError:
+                lost += 1
+                try:
+                    handler._reopen()
+                except AMQPError:
+                    pass
+        else:
+            handler.publish_message({'n': number})
+            if 'up' in marks and 'size' not in backlog:
+                backlog['size'] = len(handler.spill)
+            if 'size' in backlog and not len(handler.spill) and 'empty' not in backlog:
+                backlog['empty'] = time.monotonic()
+        latencies.append(time.perf_counter() - called)
+    stopper.join()
+    if spill is not None:
+        while len(handler.spill):
+            if not handler.drain_spill():
+                time.sleep(0.001)
+        backlog.setdefault('empty', time.monotonic())
+    handler.close()
+
+    numbers = [json.loads(body)['n'] for _, body in broker.queues[MESSAGE_PARAMS['task_queue']]]
+    latencies.sort()
+    drain = None
+    if spill is not None:
+        drain = backlog.get('size', 0) / max(backlog['empty'] - marks['up'], 1e-9)
+    return {
+        'delivered': len(set(numbers)),
+        'lost': lost or args.count - len(set(numbers)),
+        'duplicates': len(numbers) - len(set(numbers)),
+        'ordered': numbers == sorted(numbers),
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1],
+        'drain': drain,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--rate', type=float, default=5000, help='生产者每秒发布的消息数')
+    parser.add_argument('--outage-at', type=float, default=0.25, help='发布到这个比例时停止Broker')
+    parser.add_argument('--downtime', type=float, default=1.0, help='Broker停止的时间（秒）')
+    parser.add_argument('--capacity', type=int, default=1000, help='spill内存中最多缓冲的消息数')
+    parser.add_argument('--drain-rate', type=float, default=10000, help='spill+rate恢复后每秒重新发布的消息数')
+    parser.add_argument('--rpc-latency', type=float, default=0.00005, help='模拟的RPC往返耗时（秒）')
+    parser.add_argument('--initial', type=float, default=0.05, help='第一次重连的最大等待时间（秒）')
+    parser.add_argument('--maximum', type=float, default=0.2, help='重连等待时间的上限（秒）')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    print('%-11s %9s %6s %5s %7s %9s %9s %9s %10s' % (
+        'mode', 'delivered', 'lost', 'dup', 'ordered', 'p50 ms', 'p99 ms', 'max ms', 'drain/s'))
+    with tempfile.TemporaryDirectory() as directory:
+        modes = (
+            ('drop', None),
+            ('spill', {'path': directory + '/spill', 'capacity': args.capacity}),
+            ('spill+rate', {'path': directory + '/rate', 'capacity': args.capacity,
+                            'rate': args.drain_rate}),
+        )
+        for name, spill in modes:
+            result = run(args, spill)
+            print('%-11s %9i %6i %5i %7s %9.3f %9.3f %9.1f %10s' % (
+                name, result['delivered'], result['lost'], result['duplicates'], result['ordered'],
+                result['p50'] * 1000, result['p99'] * 1000, result['max'] * 1000,
+                '-' if result['drain'] is None else '%.0f' % result['drain']))
+
+
+if __name__ == '__main__':
+    main()
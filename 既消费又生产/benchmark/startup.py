@@ -0,0 +1,74 @@
+'''启动耗时基准：RabbitMQMessageHandler声明拓扑的耗时与往返次数
+sequential为改造前的写法，每个声明都是一次阻塞RPC；pipelined为on_bind以nowait连续发出、只等待一次往返；
+warm为同一连接上的第二个handler，拓扑已经声明过
+运行：python -m benchmark.startup
+'''
+
+import time
+import argparse
+from common.rabbitmq.memory import MemoryBroker, MemoryConnection
+from common.rabbitmq.rabbitmq import RabbitMQMessageHandler
+from common.rabbitmq.topology import declared, declare_pipelined
+
+
+def message_params(queues):
+    return {
+        "exchange": "spider_data",
+        "exchange_type": "fanout",
+        "routing_key": "*queue",
+        "task_queue": "task_root_queue",
+        "publish_data_queue": ['data_queue_%i' % number for number in range(queues)],
+        "durable": True,
+        "delivery_mode": 2,
+    }
+
+
+def sequential(handler):
+    # 改造前的on_bind和_consuming_queues中的声明
+    handler._get_channel()
+    handler.setup_exchange()
+    handler.setup_queue()
+    for queue_name in handler.params.get("publish_data_queue"):
+        handler.channel.queue_bind(queue=queue_name,
+                                   exchange=handler.params.get("exchange"),
+                                   routing_key=handler.params.get("routing_key"))
+    handler._get_channel().queue_declare(queue=handler.params.get('task_queue'),
+                                         durable=handler.params.get('durable'))
+
+
+def pipelined(handler):
+    handler.on_bind()
+    declare_pipelined(handler._get_channel(), declared(handler.connection),
+                      queues=[(handler.params.get('task_queue'), handler.params.get('durable'))])
+
+
+def measure(broker, connection, params, declare):
+    '''
+    :return: (耗时秒, 往返次数)
+    '''
+    handler = RabbitMQMessageHandler(None, params, connection=connection)
+    round_trips = broker.round_trips
+    started = time.perf_counter()
+    declare(handler)
+    return time.perf_counter() - started, broker.round_trips - round_trips
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--queues', type=int, default=30, help='publish_data_queue中的队列数')
+    parser.add_argument('--rpc-latency', type=float, default=0.001, help='模拟的RPC往返耗时（秒）')
+    args = parser.parse_args()
+    params = message_params(args.queues)
+    print('%-12s %10s %8s' % ('mode', 'ms', 'rtt'))
+    for name, declare in (('sequential', sequential), ('pipelined', pipelined)):
+        broker = MemoryBroker(rpc_latency=args.rpc_latency)
+        connection = MemoryConnection(broker)
+        elapsed, round_trips = measure(broker, connection, params, declare)
+        print('%-12s %10.1f %8i' % (name, elapsed * 1000, round_trips))
+        if declare is pipelined:
+            elapsed, round_trips = measure(broker, connection, params, declare)
+            print('%-12s %10.1f %8i' % ('warm', elapsed * 1000, round_trips))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+'''XPath抽取基准：一组字段规则在一批已保存的HTML页面上抽取
+before为改造前的get_data_by_xpath，每个页面对每条备选XPath调用tree.xpath(字符串)，每次都重新编译；
+compiled为common.extractor.Extractor，规则编译一次，同一棵树上抽取所有字段。
+页面在计时前解析好，只统计抽取的耗时；--corpus指定保存HTML页面的目录，默认生成一批新闻页面
+运行：python -m benchmark.xpath [--corpus DIR]
+'''
+
+import os
+import time
+import random
+import logging
+import argparse
+import tempfile
+from lxml import etree
+from common.public import create_tree, read_file
+from common.extractor import Extractor, to_strings, compile_xpath
+
+# 每个字段的第一条XPath对应改版前的页面，多数页面要尝试到后面的备选
+RULES = {
+    'title': ['//h1[@class="headline"]/text()', '//div[@class="article"]/h1/text()', '//title/text()'],
+    'author': ['//span[@class="byline"]/a/text()', '//div[@class="meta"]/span[@class="author"]/text()'],
+    'published': ['//time/@datetime', '//div[@class="meta"]/span[@class="date"]/text()'],
+    'content': ['//div[@id="content"]//p/text()', '//div[@class="article"]//p//text()'],
+    'tags': ['//ul[@class="tags"]/li/a/text()', '//meta[@name="keywords"]/@content'],
+    'images': ['//div[@class="article"]//img/@src'],
+    'links': ['//div[@class="related"]//a/@href', '//aside//a/@href'],
+    'comments': ['count(//div[@class="comment"])'],
+}
+
+
+def generate(directory, count, seed=0):
+    '''生成新闻页面，写入directory
+    :return: 文件路径列表
+    '''
+    rng = random.Random(seed)
+    paths = []
+    for number in range(count):
+        paragraphs = ''.join('<p>段落%i的内容，<b>加粗</b>的文字%s。</p>' % (i, 'x' * rng.randint(20, 200))
+                             for i in range(rng.randint(5, 30)))
+        images = ''.join('<img src="/img/%i_%i.jpg">' % (number, i) for i in range(rng.randint(0, 5)))
+        related = ''.join('<li><a href="/news/%i.html">相关新闻%i</a></li>' % (rng.randint(1, 10 ** 6), i)
+                          for i in range(rng.randint(3, 10)))
+        comments = ''.join('<div class="comment">评论%i</div>' % i for i in range(rng.randint(0, 20)))
+        html = ('<html><head><meta charset="utf-8"><title>新闻%i</title>'
+                '<meta name="keywords" content="新闻,科技,%i"></head><body>'
+                '<div class="nav">%s</div><div class="article"><h1>标题%i</h1>'
+                '<div class="meta"><span class="author">作者%i</span><span class="date">2018-06-%02i</span></div>'
+                '%s%s</div><aside><ul>%s</ul></aside>%s</body></html>') % (
+            number, number, '<a href="/">首页</a>' * 20, number, number % 97, 1 + number % 28,
+            paragraphs, images, related, comments)
+        path = os.path.join(directory, '%i.html' % number)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(html)
+        paths.append(path)
+    return paths
+
+
+def extract_before(tree, rules):
+    # 改造前的写法（修正了不存在的.extract()）
+    result = {}
+    for field, xpaths in rules.items():
+        result[field] = ''
+        for xpath in xpaths:
+            try:
+                values = to_strings(tree.xpath(xpath))
+            except (etree.XPathEvalError, ValueError):
+                continue
+            if values:
+                result[field] = values
+                break
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--corpus', help='保存HTML页面的目录')
+    parser.add_argument('--count', type=int, default=500, help='没有指定corpus时生成的页面数')
+    parser.add_argument('--rounds', type=int, default=5, help='每种方式抽取整批页面的次数')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.corpus:
+            paths = [os.path.join(args.corpus, name) for name in sorted(os.listdir(args.corpus))
+                     if name.endswith(('.html', '.htm'))]
+        else:
+            paths = generate(directory, args.count)
+        trees = [tree for tree in (create_tree(read_file(path)) for path in paths) if tree is not None]
+
+    extractor = Extractor(RULES)
+    modes = (
+        ('before', lambda tree: extract_before(tree, RULES)),
+        ('compiled', extractor.extract),
+    )
+    results = {}
+    print('%-9s %8s %10s %12s' % ('mode', 'pages', 'ms', 'us/page'))
+    for name, extract in modes:
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            results[name] = [extract(tree) for tree in trees]
+        elapsed = time.perf_counter() - started
+        pages = len(trees) * args.rounds
+        print('%-9s %8i %10.1f %12.1f' % (name, pages, elapsed * 1000, elapsed / pages * 1e6))
+    print('结果一致: %s' % (results['before'] == results['compiled']))
+    print('XPath缓存: %s' % (compile_xpath.cache_info(),))
+
+
+if __name__ == '__main__':
+    main()
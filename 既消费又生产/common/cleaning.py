@@ -0,0 +1,232 @@
+'''数据清洗流水线
+清洗规则（clean_items）编译一次：按名称从注册表中找到清洗器类，创建实例并设置好属性，
+得到每个字段的清洗器列表，按规则缓存；之后每条数据直接依次经过这些清洗器，不再eval查找、创建对象。
+清洗器约定：类属性name为规则中的名称，handle(stream)接收值的生成器，产出清洗后的值；
+实例会被多条数据复用，handle不能在实例上保存某一条数据的状态；规则对象用过之后不要原地修改。
+批量清洗时把多条数据按字段转成列，每个清洗器对整列调用一次：清洗器有handle_batch(values)时调用它，
+可以整列一次处理（如sub_joined把整列拼接后只执行一次正则），否则整列作为一个流交给handle
+'''
+
+import re
+import json
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+
+# 最多缓存的编译后的规则数
+PIPELINE_CACHE_SIZE = 256
+# sub_joined拼接整列时使用的分隔符
+JOIN_SEPARATOR = '\x00'
+# 匹配位置与前后内容有关的零宽断言，拼接后结果会不同
+ASSERTION_ESCAPES = frozenset('AZbB')
+LOOKAROUNDS = ('(?=', '(?!', '(?<=', '(?<!')
+
+
+def strip_all(values, chars=None):
+    '''整列去掉首尾的字符
+    :param values: 字符串列表
+    :param chars: 同str.strip
+    :return: list
+    '''
+    return [value.strip(chars) for value in values]
+
+
+@lru_cache(maxsize=256)
+def joinable(pattern):
+    '''正则是否可以在拼接后的整列上执行：不含^、$、\\A、\\Z、\\b、\\B和前后断言
+    这些断言在拼接后可能匹配不到（如^只匹配第一个值的开头），分隔符的个数不变，拆开后检查不出来
+    :param pattern: 正则表达式字符串
+    :return: bool
+    '''
+    if not isinstance(pattern, str):
+        return False
+    index = 0
+    in_class = False
+    while index < len(pattern):
+        char = pattern[index]
+        if '\\' == char:
+            if not in_class and pattern[index + 1:index + 2] in ASSERTION_ESCAPES:
+                return False
+            index += 2
+            continue
+        if in_class:
+            if ']' == char:
+                in_class = False
+        elif '[' == char:
+            in_class = True
+            index += 1
+            # 开头的^表示取反，紧跟的]是普通字符
+            if '^' == pattern[index:index + 1]:
+                index += 1
+            if ']' == pattern[index:index + 1]:
+                index += 1
+            continue
+        elif char in '^$' or pattern.startswith(LOOKAROUNDS, index):
+            return False
+        index += 1
+    return True
+
+
+def sub_joined(pattern, repl, values, separator=JOIN_SEPARATOR):
+    '''整列只执行一次正则替换：用分隔符拼接后替换，再按分隔符拆开
+    正则含有锚点或者前后断言（见joinable）、有值不是字符串、含有分隔符，
+    或者替换改变了分隔符（匹配跨过了两个值）时，退回逐个替换
+    :param pattern: 正则表达式或者编译好的正则
+    :param repl: 替换的内容，同re.sub
+    :param values: 字符串列表
+    :param separator: 分隔符
+    :return: list
+    '''
+    pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
+    if joinable(pattern.pattern) and all(isinstance(value, str) and separator not in value for value in values):
+        result = pattern.sub(repl, separator.join(values)).split(separator)
+        if len(result) == len(values):
+            return result
+    return [pattern.sub(repl, value) for value in values]
+
+
+class CleanerRegistry(object):
+    # 清洗器名称到类的映射，compile编译规则并缓存
+    def __init__(self, classes=(), cache_size=PIPELINE_CACHE_SIZE):
+        '''
+        :param classes: 清洗器类
+        :param cache_size: 最多缓存的编译后的规则数
+        '''
+        self.cache_size = cache_size
+        self._classes = {}
+        self._pipelines = OrderedDict()
+        # 规则对象的id到(规则对象, CleaningPipeline)，同一个规则对象不用每次序列化
+        self._recent = {}
+        self._lock = threading.Lock()
+        for cls in classes:
+            self.register(cls)
+
+    def register(self, cls):
+        '''注册清洗器类，可以用作装饰器
+        :param cls: 清洗器类
+        :return: cls
+        '''
+        self._classes[cls.name] = cls
+        with self._lock:
+            # 已经编译的规则可能用到了同名的旧类
+            self._pipelines.clear()
+            self._recent.clear()
+        return cls
+
+    def get(self, name):
+        '''
+        :param name: 清洗器名称
+        :return: 清洗器类
+        '''
+        try:
+            return self._classes[name]
+        except KeyError:
+            raise KeyError('未知的清洗器: %s' % name)
+
+    def compile(self, clean_items):
+        '''编译清洗规则，同样的规则返回同一个CleaningPipeline
+        :param clean_items: [(字段, {"cleaner": [{清洗器名称: {属性: 值}}, ...]}), ...]或者dict
+        :return: CleaningPipeline
+        '''
+        recent = self._recent.get(id(clean_items))
+        if recent is not None and recent[0] is clean_items:
+            return recent[1]
+        source = clean_items
+        if isinstance(clean_items, dict):
+            clean_items = clean_items.items()
+        rules = list(clean_items)
+        try:
+            key = json.dumps(rules, sort_keys=True, ensure_ascii=False)
+        except (TypeError, ValueError):
+            # 规则中有不能序列化的值，不缓存
+            return CleaningPipeline(rules, self)
+        with self._lock:
+            pipeline = self._pipelines.get(key)
+            if pipeline is not None:
+                self._pipelines.move_to_end(key)
+        if pipeline is None:
+            pipeline = CleaningPipeline(rules, self)
+        with self._lock:
+            self._pipelines[key] = pipeline
+            while len(self._pipelines) > self.cache_size:
+                self._pipelines.popitem(last=False)
+            if isinstance(source, (list, tuple, dict)):
+                # 生成器等一次性的对象不记录
+                if len(self._recent) >= self.cache_size:
+                    self._recent.clear()
+                self._recent[id(source)] = (source, pipeline)
+        return pipeline
+
+    def __contains__(self, name):
+        return name in self._classes
+
+    def __len__(self):
+        return len(self._classes)
+
+
+class CleaningPipeline(object):
+    # 编译后的清洗规则，每个字段一组配置好的清洗器实例
+    def __init__(self, clean_items, registry):
+        '''
+        :param clean_items: 见CleanerRegistry.compile
+        :param registry: CleanerRegistry
+        '''
+        self.fields = []
+        for field, rule in clean_items:
+            if 'max_num' == field:
+                continue
+            cleaners = []
+            for cleaner in rule['cleaner']:
+                for name, attrs in cleaner.items():
+                    obj = registry.get(name)()
+                    for attr, value in attrs.items():
+                        setattr(obj, attr, value)
+                    cleaners.append(obj)
+            self.fields.append((field, cleaners))
+
+    def clean(self, items):
+        '''清洗一条数据
+        :param items: 需要清洗的字典数据，原地修改
+        :return: items
+        '''
+        for field, cleaners in self.fields:
+            items[field] = self._clean_value(cleaners, items[field])
+        return items
+
+    def clean_batch(self, rows):
+        '''按列清洗多条数据，每个清洗器对每个字段只调用一次
+        清洗器要对每个值产出一个结果；产出的个数不对时，这个字段退回逐条清洗
+        :param rows: 需要清洗的字典数据列表，原地修改
+        :return: rows
+        '''
+        if not isinstance(rows, list):
+            rows = list(rows)
+        for field, cleaners in self.fields:
+            column = [items[field] for items in rows]
+            for cleaner in cleaners:
+                column = self._clean_column(cleaner, column)
+                if column is None:
+                    break
+            if column is None:
+                for items in rows:
+                    items[field] = self._clean_value(cleaners, items[field])
+            else:
+                for items, value in zip(rows, column):
+                    items[field] = value
+        return rows
+
+    @staticmethod
+    def _clean_value(cleaners, value):
+        stream = iter((value,))
+        for cleaner in cleaners:
+            stream = cleaner.handle(stream)
+        return next(stream)
+
+    @staticmethod
+    def _clean_column(cleaner, column):
+        handle_batch = getattr(cleaner, 'handle_batch', None)
+        if handle_batch is not None:
+            values = handle_batch(column)
+        else:
+            values = list(cleaner.handle(iter(column)))
+        return values if len(values) == len(column) else None
@@ -0,0 +1,360 @@
+'''XPath抽取
+同一条XPath在每个页面上都会用到，预先编译成etree.XPath并按表达式缓存（有上限的LRU），
+规则集创建时编译一次，每个页面按字段依次尝试各条备选XPath，返回字段到结果的字典。
+大页面可以增量解析：按块读入bytes或者文件对象，不需要先解码成str，所有字段都找到后不再读取剩下的内容
+'''
+
+import re
+import codecs
+import logging
+import itertools
+from functools import lru_cache
+from collections.abc import Iterable
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# 最多缓存的编译后的XPath数
+XPATH_CACHE_SIZE = 4096
+# 增量解析每次读入的字节数，每读入一块检查一次字段是否都已经找到
+CHUNK_SIZE = 64 * 1024
+# 只构建文档树时每次读入的字节数，块越大解析越快
+TREE_CHUNK_SIZE = 1024 * 1024
+# 与common.public.CHAR_SET相同，用于未解码的字节
+CHAR_SET_BYTES = re.compile(rb"<meta.+?charset=[^\w]?([-\w]+)")
+# 以<?xml开头的内容的第一个元素名，或者声明了html的DOCTYPE
+ROOT_TAG = re.compile(r'<!DOCTYPE\s+(html)\b|<([A-Za-z_][-\w.:]*)', re.I)
+ROOT_TAG_BYTES = re.compile(ROOT_TAG.pattern.encode('ascii'), re.I)
+# 删除已经解析完的元素后结果会变的XPath：位置谓词、position()和last()、兄弟和前后轴、count()和sum()
+UNCLEARABLE = re.compile(r'\[\s*[\d(.+-]|\b(?:position|last|count|sum)\s*\(|\b(?:preceding|following)(?:-sibling)?\s*::')
+
+
+@lru_cache(maxsize=XPATH_CACHE_SIZE)
+def compile_xpath(expression, smart_strings=False):
+    '''编译XPath，结果按表达式缓存
+    :param expression: XPath字符串
+    :param smart_strings: 字符串结果是否可以取到所在的元素，增量解析时用来判断元素是否已经解析完
+    :return: etree.XPath，语法错误时为None（同样缓存，不会重复编译）
+    '''
+    try:
+        # 默认不使用smart string，结果不再引用文档树
+        return etree.XPath(expression, smart_strings=smart_strings)
+    except etree.XPathSyntaxError as e:
+        logger.warning('XPath语法错误 %r: %s', expression, e)
+        return None
+
+
+def to_strings(result):
+    '''把XPath的结果转换为去掉首尾空白的非空字符串列表
+    :param result: 元素、字符串、数字或者它们的列表
+    :return: list
+    '''
+    if not isinstance(result, list):
+        result = [result]
+    strings = []
+    for value in result:
+        if isinstance(value, bool):
+            # boolean()等表达式的结果，False视为没有匹配到
+            value = 'true' if value else ''
+        elif isinstance(value, float):
+            value = '%g' % value
+        elif not isinstance(value, str):
+            value = ''.join(value.itertext()) if hasattr(value, 'itertext') else str(value)
+        value = value.strip()
+        if value:
+            strings.append(value)
+    return strings
+
+
+def evaluate(tree, xpaths):
+    '''依次尝试备选XPath，返回第一个有结果的
+    :param tree: DOM文档树
+    :param xpaths: 编译后的XPath列表
+    :return: 字符串列表，都没有匹配到时为空字符串
+    '''
+    for xpath in xpaths:
+        try:
+            result = to_strings(xpath(tree))
+        except (etree.XPathEvalError, ValueError):
+            continue
+        if result:
+            return result
+    return ''
+
+
+def compile_rule(xpaths, smart_strings=False):
+    '''
+    :param xpaths: XPath字符串或者备选XPath列表
+    :param smart_strings: 见compile_xpath
+    :return: 编译后的XPath元组，不是XPath的规则原样返回
+    '''
+    if isinstance(xpaths, str):
+        xpaths = (xpaths,)
+    elif not isinstance(xpaths, Iterable):
+        return xpaths
+    compiled = (compile_xpath(xpath, smart_strings) for xpath in xpaths)
+    return tuple(xpath for xpath in compiled if xpath is not None)
+
+
+def clearable(xpaths):
+    '''增量解析时结果是否只取决于已经解析完的元素，XPath都不依赖位置和前后的兄弟元素时才可以提前确定结果、删除已经解析完的子树
+    :param xpaths: XPath或者备选XPath列表
+    :return: bool
+    '''
+    if isinstance(xpaths, str):
+        xpaths = (xpaths,)
+    elif not isinstance(xpaths, Iterable):
+        return True
+    return not any(UNCLEARABLE.search(xpath) for xpath in xpaths if isinstance(xpath, str))
+
+
+def detect_charset(head):
+    '''从页面开头的meta中取编码
+    :param head: 页面开头的bytes
+    :return: 编码名称，没有声明或者不认识时为None
+    '''
+    match = CHAR_SET_BYTES.search(head)
+    if match is None:
+        return None
+    try:
+        return codecs.lookup(match.group(1).decode('ascii')).name
+    except LookupError:
+        return None
+
+
+def read_chunks(source, chunk_size=CHUNK_SIZE):
+    '''
+    :param source: str、bytes或者有read方法的文件对象
+    :param chunk_size: 每块的大小
+    :return: 生成器
+    '''
+    if hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        for start in range(0, len(source), chunk_size):
+            yield source[start:start + chunk_size]
+
+
+def is_xml(head):
+    '''以<?xml开头、根元素不是html的内容按XML解析；XHTML与其他页面一样按HTML解析，结果不带命名空间
+    :param head: 内容开头的str或者bytes
+    :return: bool
+    '''
+    is_bytes = isinstance(head, bytes)
+    if head.lstrip()[:5] != (b'<?xml' if is_bytes else '<?xml'):
+        return False
+    match = (ROOT_TAG_BYTES if is_bytes else ROOT_TAG).search(head)
+    if match is None:
+        # 开头没有读到根元素，与改造前一样按HTML解析
+        return False
+    if match.group(1):
+        return False
+    name = match.group(2).lower()
+    if is_bytes:
+        name = name.decode('ascii', 'ignore')
+    return 'html' != name and not name.endswith(':html')
+
+
+def _open(source, chunk_size, events, html=False):
+    '''读入第一块，按内容选择解析器
+    is_xml判断为XML的按XML解析，其他按HTML解析；bytes的编码取自meta中声明的charset，直接交给解析器
+    :param events: 解析器产生的事件，为None时只构建文档树，使用更快的feed接口
+    :param html: 为True时总是按HTML解析
+    :return: (解析器, 全部的块)，内容为空时解析器为None
+    '''
+    chunks = read_chunks(source, chunk_size)
+    head = next(chunks, None)
+    if not head:
+        return None, ()
+    is_bytes = isinstance(head, bytes)
+    if not html and is_xml(head):
+        parser_class = etree.XMLParser if events is None else etree.XMLPullParser
+        encoding = None
+        if not is_bytes:
+            # str不能带编码声明，交给解析器前重新编码
+            chunks = (chunk.encode('utf-8') for chunk in chunks)
+            head = head.encode('utf-8')
+            encoding = 'utf-8'
+    else:
+        parser_class = etree.HTMLParser if events is None else etree.HTMLPullParser
+        encoding = detect_charset(head) if is_bytes else None
+    parser = parser_class(encoding=encoding) if events is None else parser_class(events=events, encoding=encoding)
+    return parser, itertools.chain((head,), chunks)
+
+
+def parse(source, chunk_size=TREE_CHUNK_SIZE):
+    '''按块增量构建完整的文档树，按XML解析失败时改按HTML解析（文件对象除外）
+    :param source: str、bytes或者有read方法的文件对象
+    :param chunk_size: 每次读入的大小
+    :return: 根元素，内容为空时为None
+    '''
+    parser, chunks = _open(source, chunk_size, None)
+    if parser is None:
+        return None
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+        return parser.close()
+    except etree.XMLSyntaxError:
+        if hasattr(source, 'read'):
+            # 文件对象已经读过，不能重新解析
+            raise
+        # 不是格式良好的XML，与etree.HTML一样尽量解析
+        parser, chunks = _open(source, chunk_size, None, html=True)
+        for chunk in chunks:
+            parser.feed(chunk)
+        return parser.close()
+
+
+def iterparse(source, chunk_size=CHUNK_SIZE):
+    '''增量解析，每读入一块产出一次当前解析到的部分
+    :param source: str、bytes或者有read方法的文件对象
+    :param chunk_size: 每次读入的大小
+    :return: 生成器，产出(根元素, 还没有解析完的元素的id集合)，最后一次产出时文档已经解析完，集合为空；
+             根元素在读到第一个标签之前为None
+    '''
+    parser, chunks = _open(source, chunk_size, ('start', 'end'))
+    if parser is None:
+        return
+    root = None
+    opened = []
+    open_ids = set()
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if 'start' == event:
+                if root is None:
+                    root = element
+                opened.append(element)
+                open_ids.add(id(element))
+            else:
+                open_ids.discard(id(opened.pop()))
+        yield root, open_ids
+    root = parser.close()
+    opened.clear()
+    open_ids.clear()
+    yield root, open_ids
+
+
+def _finished(result, open_ids):
+    '''结果所在的元素是否都已经解析完，数字、布尔值等要到文档结束才能确定'''
+    if not isinstance(result, list):
+        return False
+    for value in result:
+        node = value if hasattr(value, 'tag') else getattr(value, 'getparent', lambda: None)()
+        if node is not None and getattr(value, 'is_tail', False):
+            node = node.getparent()
+        if node is None or id(node) in open_ids:
+            return False
+    return True
+
+
+def _clear(root, open_ids):
+    # 删除已经解析完的子树，只保留还没有解析完的元素这条链
+    parents = [root] if id(root) in open_ids else []
+    for parent in parents:
+        for child in list(parent):
+            if id(child) in open_ids:
+                parents.append(child)
+            else:
+                parent.remove(child)
+
+
+class Extractor(object):
+    # 一组字段的抽取规则，创建时编译全部XPath，extract在同一棵树上抽取所有字段
+    def __init__(self, rules):
+        '''
+        :param rules: {字段: XPath或者备选XPath列表}，值不是XPath时作为该字段的固定结果
+        '''
+        self.rules = rules
+        self._compiled = [(field, compile_rule(xpaths)) for field, xpaths in rules.items()]
+        # extract_stream用到的XPath，第一次调用时编译
+        self._streaming = None
+
+    def extract(self, tree):
+        '''
+        :param tree: DOM文档树，为None时所有字段都是空字符串
+        :return: {字段: 字符串列表或者空字符串}
+        '''
+        result = {}
+        for field, xpaths in self._compiled:
+            if not isinstance(xpaths, tuple):
+                result[field] = xpaths
+            elif tree is None:
+                result[field] = ''
+            else:
+                result[field] = evaluate(tree, xpaths)
+        return result
+
+    def extract_stream(self, source, chunk_size=CHUNK_SIZE, clear=True):
+        '''增量解析并抽取，所有字段都找到后停止读取
+        每读入一块，在已经解析的部分中按顺序尝试还没有找到的字段的XPath，第一条XPath的结果所在的元素都解析完时
+        该字段就确定了，不再考虑后面的内容；后面的备选XPath匹配到时，第一条仍可能出现在后面的内容中，
+        要到文档结束才确定，与extract的优先顺序一致；数字、布尔值等结果，以及有位置谓词、兄弟和前后轴或者count()等函数
+        （见clearable）的字段也要到文档结束才确定
+        :param source: str、bytes或者有read方法的文件对象，大页面用bytes或者文件对象，不需要解码
+        :param chunk_size: 每次读入的大小
+        :param clear: 没有字段匹配到内容时删除已经解析完的子树，降低大页面的内存占用；
+                      有字段要到文档结束才确定时不删除
+        :return: {字段: 字符串列表或者空字符串}
+        '''
+        if self._streaming is None:
+            self._streaming = [(field, compile_rule(xpaths, smart_strings=True), clearable(xpaths))
+                               for field, xpaths in self.rules.items()]
+        result = {}
+        pending = []
+        for field, xpaths, safe in self._streaming:
+            if isinstance(xpaths, tuple):
+                result[field] = ''
+                pending.append((field, xpaths, safe))
+                clear = clear and safe
+            else:
+                result[field] = xpaths
+        root = None
+        for root, open_ids in iterparse(source, chunk_size):
+            if root is None:
+                continue
+            matched = False
+            for field, xpaths, safe in list(pending):
+                for index, xpath in enumerate(xpaths):
+                    try:
+                        values = xpath(root)
+                    except (etree.XPathEvalError, ValueError):
+                        continue
+                    strings = to_strings(values)
+                    if not strings:
+                        continue
+                    if not open_ids or (safe and 0 == index and _finished(values, open_ids)):
+                        result[field] = strings
+                        pending.remove((field, xpaths, safe))
+                    else:
+                        matched = True
+                    break
+            if not pending:
+                break
+            if clear and not matched:
+                _clear(root, open_ids)
+        return result
+
+
+@lru_cache(maxsize=256)
+def _extractor(rules):
+    return Extractor(dict(rules))
+
+
+def get_extractor(rules):
+    '''同样的规则复用同一个Extractor
+    :param rules: {字段: 备选XPath列表}
+    :return: Extractor
+    '''
+    try:
+        key = tuple((field, xpaths if isinstance(xpaths, str) else tuple(xpaths))
+                    for field, xpaths in rules.items())
+        return _extractor(key)
+    except TypeError:
+        # 规则中有不可哈希的值
+        return Extractor(rules)
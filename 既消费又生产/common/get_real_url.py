@@ -1,27 +1,60 @@
 
 '''
 获得搜索引擎搜出来的结果的真实URL
+每个搜索引擎一个requests.Session，复用连接并设置超时；RealUrlResolver在线程池中并发解析一批URL，
+同一个主机同时进行的请求数有上限
 '''
 
 import re
+import logging
+import threading
 import requests
-from urllib.parse import unquote
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
 from abc import ABCMeta, abstractmethod
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
 class_name_list = []
 
+# (连接超时, 读取超时)，单位秒
+TIMEOUT = (3.05, 5)
+# 每个搜索引擎的连接池大小
+POOL_SIZE = 16
+
 
 def set_class_name_list(cls_name):
     class_name_list.append(cls_name)
-    return class_name_list
+    return cls_name
+
+
+def create_session(pool_size=POOL_SIZE):
+    '''
+    :param pool_size: 每个主机最多保持的连接数
+    :return: requests.Session
+    '''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
 class SearchResultBase(metaclass=ABCMeta):
 
-    def __init__(self, name):
+    def __init__(self, name, session=None, timeout=TIMEOUT):
         '''
         :param name:搜索引擎的名字
+        :param session:requests.Session，为空时新建一个带连接池的
+        :param timeout:请求超时，同requests的timeout
         '''
         self.name = name
+        self.session = session if session is not None else create_session()
+        self.timeout = timeout
+
+    def close(self):
+        self.session.close()
 
     @abstractmethod
     def process(self, url):
@@ -42,7 +75,7 @@ class Sougou(SearchResultBase):
 
         m1 = self.pattern1.search(url)
         if m1:
-            response = requests.get(m1.group())
+            response = self.session.get(m1.group(), timeout=self.timeout)
             if response.status_code == 200:
                 m2 = self.pattern2.search(response.text)
                 if m2:
@@ -71,7 +104,7 @@ class Baidu(SearchResultBase):
     def process(self, url):
         if not url:
             return ''
-        response = requests.get(url, allow_redirects=False, headers=self.headers)
+        response = self.session.get(url, allow_redirects=False, headers=self.headers, timeout=self.timeout)
         if response.status_code == 200:
             m = self.pattern.search(response.text)
             return m.group(1) if m else url
@@ -96,7 +129,7 @@ class Haosou(SearchResultBase):
 
         m1 = self.pattern1.search(url)
         if m1:
-            response = requests.get(m1.group())
+            response = self.session.get(m1.group(), timeout=self.timeout)
             if response.status_code == 200:
                 m2 = self.pattern2.search(response.text)
                 if m2:
@@ -107,8 +140,59 @@ class Haosou(SearchResultBase):
                     return url
 
 
-def search_init(name):
-    '''搜索引擎初始化'''
+def search_init(name, **kwargs):
+    '''搜索引擎初始化
+    :param kwargs: session、timeout，见SearchResultBase
+    '''
     for i in class_name_list:
         if name == i.NAME:
-            return i(name)
+            return i(name, **kwargs)
+
+
+class RealUrlResolver(object):
+    # 在线程池中并发解析，不阻塞消费者线程；同一个主机同时进行的请求数不超过per_host
+    def __init__(self, name, max_workers=16, per_host=8, timeout=TIMEOUT):
+        '''
+        :param name: 搜索引擎的名字
+        :param max_workers: 线程数
+        :param per_host: 每个主机同时进行的请求数
+        :param timeout: 请求超时，同requests的timeout
+        '''
+        self.engine = search_init(name, session=create_session(max(max_workers, per_host)), timeout=timeout)
+        if self.engine is None:
+            raise ValueError('未知的搜索引擎: %s' % name)
+        self.per_host = per_host
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._hosts = defaultdict(lambda: threading.BoundedSemaphore(self.per_host))
+        self._lock = threading.Lock()
+
+    def resolve(self, url):
+        '''解析一个URL，出错时返回None
+        :param url: 搜索结果的URL
+        :return: 真实URL
+        '''
+        with self._lock:
+            limit = self._hosts[urlparse(url or '').netloc]
+        with limit:
+            try:
+                return self.engine.process(url)
+            except requests.RequestException as e:
+                logger.warning('解析%s失败: %r', url, e)
+                return None
+
+    def submit(self, url):
+        '''
+        :return: concurrent.futures.Future
+        '''
+        return self._executor.submit(self.resolve, url)
+
+    def resolve_many(self, urls):
+        '''并发解析一批URL
+        :param urls: 搜索结果的URL
+        :return: 与urls顺序对应的真实URL列表，出错的为None
+        '''
+        return [future.result() for future in [self.submit(url) for url in urls]]
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.engine.close()
@@ -0,0 +1,276 @@
+'''进程内指标
+Counter、Gauge、Histogram三种指标，按Prometheus文本格式输出，可以通过本地HTTP端口抓取
+热路径上每个线程只累加自己的计数单元，不加锁，汇总和格式化在抓取时进行
+'''
+
+import bisect
+import logging
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+logger = logging.getLogger(__name__)
+
+# 默认的直方图分桶（秒），覆盖从发布确认的毫秒级到任务处理的分钟级
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _format_labels(labels, extra=None):
+    items = sorted(labels.items())
+    if extra is not None:
+        items.append(extra)
+    if not items:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, value in items)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(object):
+    # 每个线程累加自己的单元，不需要加锁；抓取时汇总所有线程的单元，已经退出的线程的单元并入_retired
+    kind = None
+
+    def __init__(self, name, documentation='', labels=None):
+        '''
+        :param name: 指标名
+        :param documentation: 说明
+        :param labels: 固定标签
+        '''
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels or {}
+        self._local = threading.local()
+        # [(线程, 单元)]
+        self._cells = []
+        self._retired = self._new_cell()
+        self._lock = threading.Lock()
+
+    def _new_cell(self):
+        return [0]
+
+    @staticmethod
+    def _merge(into, cell):
+        into[0] += cell[0]
+
+    def _cell(self):
+        cell = self._local.cell = self._new_cell()
+        with self._lock:
+            self._retire()
+            self._cells.append((threading.current_thread(), cell))
+        return cell
+
+    def _retire(self):
+        # 已经退出的线程不会再写自己的单元，并入_retired后删除，线程池重建时单元数不会一直增长；调用时持有_lock
+        alive = []
+        for thread, cell in self._cells:
+            if thread.is_alive():
+                alive.append((thread, cell))
+            else:
+                self._merge(self._retired, cell)
+        self._cells[:] = alive
+
+    def _snapshot(self):
+        '''
+        :return: 所有单元，第一个是已经退出的线程的合计
+        '''
+        with self._lock:
+            self._retire()
+            return [self._retired] + [cell for _, cell in self._cells]
+
+    def _total(self):
+        return sum(cell[0] for cell in self._snapshot())
+
+
+class Counter(_Metric):
+    # 只增不减的计数
+    kind = 'counter'
+
+    def inc(self, amount=1):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._cell()
+        cell[0] += amount
+
+    @property
+    def value(self):
+        return self._total()
+
+    def samples(self):
+        return [(self.name, _format_labels(self.labels), self.value)]
+
+
+class Gauge(_Metric):
+    # 可增可减的当前值，也可以绑定一个函数在抓取时取值
+    kind = 'gauge'
+
+    def __init__(self, name, documentation='', labels=None):
+        super(Gauge, self).__init__(name, documentation, labels)
+        self._base = 0
+        self._function = None
+
+    def inc(self, amount=1):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._cell()
+        cell[0] += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        self._base = value - self._total()
+
+    def set_function(self, function):
+        '''同名同标签的指标只有一个，后绑定的函数替换之前的
+        :param function: 无参可调用对象，抓取时调用取值
+        :return:
+        '''
+        self._function = function
+
+    def clear_function(self, function):
+        '''解除绑定，函数引用的对象不再被指标持有；已经被其他函数替换时不做处理
+        :param function: set_function绑定的函数
+        :return:
+        '''
+        if self._function is function:
+            self._function = None
+
+    @property
+    def value(self):
+        if self._function is not None:
+            return self._function()
+        return self._base + self._total()
+
+    def samples(self):
+        return [(self.name, _format_labels(self.labels), self.value)]
+
+
+class Histogram(_Metric):
+    # 分桶统计，用于耗时
+    kind = 'histogram'
+
+    def __init__(self, name, documentation='', labels=None, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, documentation, labels)
+
+    def _new_cell(self):
+        # [各桶计数（最后一个桶为+Inf）, 总和]
+        return [[0] * (len(self.buckets) + 1), 0.0]
+
+    @staticmethod
+    def _merge(into, cell):
+        for index, bucket in enumerate(cell[0]):
+            into[0][index] += bucket
+        into[1] += cell[1]
+
+    def observe(self, value):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._cell()
+        cell[0][bisect.bisect_left(self.buckets, value)] += 1
+        cell[1] += value
+
+    def samples(self):
+        cells = self._snapshot()
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        for cell in cells:
+            for index, bucket in enumerate(cell[0]):
+                counts[index] += bucket
+            total += cell[1]
+        samples = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket
+            samples.append((self.name + '_bucket',
+                            _format_labels(self.labels, ('le', _format_value(bound))),
+                            cumulative))
+        labels = _format_labels(self.labels)
+        samples.append((self.name + '_sum', labels, total))
+        samples.append((self.name + '_count', labels, cumulative))
+        return samples
+
+
+class Registry(object):
+    # 指标注册表，同名同标签的指标只创建一次
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, documentation, labels, **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = cls(name, documentation, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError('指标%s已注册为%s' % (name, metric.kind))
+            return metric
+
+    def counter(self, name, documentation='', labels=None):
+        return self._get(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation='', labels=None):
+        return self._get(Gauge, name, documentation, labels)
+
+    def histogram(self, name, documentation='', labels=None, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, documentation, labels, buckets=buckets)
+
+    def exposition(self):
+        '''
+        :return: Prometheus文本格式
+        '''
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        last_name = None
+        for (name, _), metric in metrics:
+            if name != last_name:
+                lines.append('# HELP %s %s' % (name, metric.documentation))
+                lines.append('# TYPE %s %s' % (name, metric.kind))
+                last_name = name
+            for sample_name, labels, value in metric.samples():
+                lines.append('%s%s %s' % (sample_name, labels, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_http_server(port=9100, host='127.0.0.1', registry=REGISTRY):
+    '''在后台线程中启动HTTP服务，GET任意路径返回指标
+    :param port: 端口，为0时随机分配
+    :param host: 监听地址，默认只监听本机
+    :param registry: 指标注册表
+    :return: HTTPServer，调用shutdown()停止
+    '''
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.exposition().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = _ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    logger.warning('指标服务启动: http://%s:%i/metrics', host, server.server_address[1])
+    return server
@@ -5,29 +5,34 @@ import re
 import time
 import json
 from datetime import date, datetime
-from collections import Iterable
 from json.decoder import JSONDecodeError
 from urllib.parse import urljoin, urlparse, urlunparse
 from posixpath import normpath
 from lxml import etree
-from lxml.etree import XPathEvalError
+from common.extractor import TREE_CHUNK_SIZE, compile_rule, evaluate, parse
 
 
 CHAR_SET = re.compile(r"<meta.+?charset=[^\w]?([-\w]+)")
 DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 
 
-def create_tree(html):
+def create_tree(html, chunk_size=TREE_CHUNK_SIZE):
     '''
-    :param html:HTML或者XML字符串
+    :param html:HTML或者XML字符串；大页面直接传bytes或者文件对象，按块增量解析，不需要先解码，
+                编码取自meta中声明的charset
+    :param chunk_size:增量解析每次读入的大小
     :return:tree树形结构对象
     '''
     try:
-        root = etree.HTML(html)
-    except ValueError:
-        root = etree.XML(html)
+        if isinstance(html, str) and not html[:1024].lstrip().startswith('<?xml'):
+            root = etree.HTML(html)
+        else:
+            # 带编码声明的XML字符串不能交给etree.HTML，不再先按HTML解析失败后再解析一遍
+            root = parse(html, chunk_size)
     except Exception:
         return None
+    if root is None:
+        return None
     tree = etree.ElementTree(root)
     return tree
 
@@ -128,22 +133,12 @@ def timestamp_format(time_stamp, template=DATE_FORMAT):
 
 
 def get_data_by_xpath(tree, xpaths):
-    '''
+    '''XPath预先编译并缓存，多个字段一起抽取时使用common.extractor.Extractor
     :param tree:DOM文档树
-    :param xpaths:xpath列表
-    :return:字符串结果或者空字符串
+    :param xpaths:xpath或者xpath列表
+    :return:第一个有结果的xpath匹配到的字符串列表，都没有匹配到时为空字符串
     '''
-    if not isinstance(xpaths, Iterable):
-        return xpaths
-    for xpath in xpaths:
-        try:
-            result = tree.xpath(xpath)
-        except (XPathEvalError, ValueError):
-            continue
-        result = result.extract()
-        test = [i.strip() for i in result]
-        test = [i for i in test if i]
-        if test:
-            return result
-    else:
-        return ''
+    compiled = compile_rule(xpaths)
+    if not isinstance(compiled, tuple):
+        return compiled
+    return evaluate(tree, compiled)
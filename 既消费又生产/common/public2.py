@@ -5,26 +5,26 @@
 '''
 
 from DLQYSpider2.cleaner import *
+from common.cleaning import CleanerRegistry
+
+# 清洗器名称到类的映射，代替每次对clean_objects逐个eval查找
+CLEANERS = CleanerRegistry(globals()[name] for name in clean_objects[1:])
 
 
 def clean_item(items, clean_items):
     '''清理接口
+    规则第一次用到时编译成配置好的清洗器实例并缓存，之后直接复用
     :param items: 需要清洗的字典数据
     :param clean_items: 规则
     :return: items
     '''
-    def _(k):
-        yield items[k]
+    return CLEANERS.compile(clean_items).clean(items)
+
 
-    for k, v in clean_items:
-        if 'max_num' == k:
-            continue
-        stream = _(k)
-        for cleaner in v['cleaner']:
-            for name, attr in cleaner.items():
-                cls_name = [i for i in clean_objects[1:] if eval(i).name == name]
-                obj = eval(cls_name[0])()
-                [setattr(obj, k2, v2) for k2, v2 in attr.items()]
-                stream = obj.handle(stream)
-        items[k] = next(stream)
-    return items
\ No newline at end of file
+def clean_items_batch(rows, clean_items):
+    '''批量清理接口，按字段整列清洗，适合一个任务产生很多条数据的情况
+    :param rows: 需要清洗的字典数据列表
+    :param clean_items: 规则
+    :return: rows
+    '''
+    return CLEANERS.compile(clean_items).clean_batch(rows)
@@ -0,0 +1,96 @@
+'''批量确认
+收集处理成功的delivery_tag，用basic_ack(multiple=True)一次确认一段连续完成的消息
+'''
+
+from collections import OrderedDict
+
+
+class AckBatcher(object):
+    # 只能在连接线程中使用，每个信道一个实例
+    def __init__(self, channel, schedule, cancel=None, max_batch=100, max_delay=0.05,
+                 requeue=True):
+        '''
+        :param channel: 收到消息的信道
+        :param schedule: schedule(delay, callback)在连接线程中延时执行并返回定时器，如connection.add_timeout
+        :param cancel: cancel(timer)取消定时器，如connection.remove_timeout
+        :param max_batch: 已完成的消息达到该数量时立即确认
+        :param max_delay: 第一条消息完成后最多等待多少秒确认
+        :param requeue: 处理失败的消息是否重新入队
+        '''
+        self.channel = channel
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.requeue = requeue
+        self.frames = 0
+        self._schedule = schedule
+        self._cancel = cancel
+        self._pending = OrderedDict()
+        self._done = 0
+        self._timer = None
+
+    def delivered(self, delivery_tag):
+        '''记录投递顺序，收到消息时调用
+        :param delivery_tag: The delivery tag from the Basic.Deliver frame
+        '''
+        self._pending[delivery_tag] = False
+
+    def ack(self, delivery_tag):
+        '''消息处理成功，可以乱序调用
+        :param delivery_tag: The delivery tag from the Basic.Deliver frame
+        '''
+        if delivery_tag not in self._pending:
+            return
+        self._pending[delivery_tag] = True
+        self._done += 1
+        if self._done >= self.max_batch:
+            self.flush()
+        elif self._timer is None:
+            self._timer = self._schedule(self.max_delay, self._on_timer)
+
+    def nack(self, delivery_tag, requeue=None):
+        '''消息处理失败，立即单独拒绝
+        失败的消息不能一直不确认，否则之后的basic_ack(multiple=True)会把它一起确认
+        :param delivery_tag: The delivery tag from the Basic.Deliver frame
+        :param requeue: 是否重新入队，为None时使用self.requeue
+        '''
+        if self._pending.pop(delivery_tag, None) is None:
+            return
+        self.frames += 1
+        self.channel.basic_nack(delivery_tag=delivery_tag,
+                                requeue=self.requeue if requeue is None else requeue)
+
+    def _on_timer(self):
+        self._timer = None
+        self.flush(force=True)
+
+    def flush(self, force=False):
+        '''确认从最早投递的消息开始连续完成的一段
+        :param force: 为True时，排在处理中消息之后已完成的消息逐条确认，避免长时间占用prefetch
+        :return:
+        '''
+        if self._timer is not None and self._cancel is not None:
+            self._cancel(self._timer)
+            self._timer = None
+        if not self.channel.is_open:
+            self._pending.clear()
+            self._done = 0
+            return
+        last = None
+        while self._pending:
+            delivery_tag, done = next(iter(self._pending.items()))
+            if not done:
+                break
+            self._pending.popitem(last=False)
+            self._done -= 1
+            last = delivery_tag
+        if last is not None:
+            self.frames += 1
+            self.channel.basic_ack(delivery_tag=last, multiple=True)
+        if force and self._done:
+            for delivery_tag in [tag for tag, done in self._pending.items() if done]:
+                del self._pending[delivery_tag]
+                self.frames += 1
+                self.channel.basic_ack(delivery_tag=delivery_tag)
+            self._done = 0
+        if self._done and self._timer is None:
+            self._timer = self._schedule(self.max_delay, self._on_timer)
@@ -0,0 +1,344 @@
+'''基于asyncio的RabbitMQ消息处理
+回调可以是async def协程，I/O密集的任务处理与消息收发在同一个事件循环中重叠进行
+'''
+
+import asyncio
+import logging
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+from pika.exceptions import ChannelClosed, ConnectionClosed
+from common.rabbitmq.rabbitmq import IMessageHandler, IMessageCallBack, RabbitMQConnection, \
+    PublishBlockedTimeout
+from common.rabbitmq.codec import Codec, CodecError
+from common.rabbitmq.flowcontrol import FlowControl
+
+logger = logging.getLogger(__name__)
+
+_loop = None
+
+
+def get_event_loop():
+    '''所有异步消息处理实例共用的事件循环，TaskHandler的task_handler与data_handler因此可以共用一个线程
+    :return:asyncio.AbstractEventLoop
+    '''
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    return _loop
+
+
+class AsyncRabbitMQMessageHandler(IMessageHandler):
+    # asyncio版本的RabbitMQ消息处理程序，配置与RabbitMQMessageHandler相同
+    def __init__(self, connect_params, message_params, loop=None):
+        '''
+        :param connect_params:连接参数
+        :param message_params:消息处理参数，concurrency为同时处理的消息数，默认等于prefetch_count
+        :param loop:事件循环，默认使用get_event_loop()
+        '''
+        self.params = message_params
+        self.codec = Codec.from_params(message_params)
+        self.loop = loop or get_event_loop()
+        self.connect_params = connect_params or {}
+        # transport为memory时连接进程内Broker，不需要pika的连接参数
+        self.parameters = None
+        if 'memory' != self.connect_params.get('transport'):
+            self.parameters = RabbitMQConnection(connect_params).parameters()
+        self.connection = None
+        self.channel = None
+        self.concurrency = self.params.get('concurrency') or self.params.get('prefetch_count') or 1
+        # 与RabbitMQMessageHandler一致，默认不开启发布确认
+        self.confirm_delivery = self.params.get('confirm_delivery', False)
+        self._opening = None
+        self._closed = None
+        self._waiters = set()
+        self._deliveries = OrderedDict()
+        self._delivery_tag = 0
+        self._consumer_tag = None
+        self._consuming = None
+        self._tasks = set()
+        self._semaphore = None
+        self._executor = None
+        self.flow = FlowControl({'exchange': self.params.get('exchange')})
+        self._unblocked_waiters = set()
+
+    async def connect(self):
+        '''建立连接并打开信道，多次调用只会建立一次连接
+        :return:信道
+        '''
+        if self._opening is None:
+            self._opening = self.loop.create_future()
+            self._closed = self.loop.create_future()
+            connection_class = AsyncioConnection
+            if self.parameters is None:
+                from common.rabbitmq.memory import get_broker
+                connection_class = get_broker(self.connect_params.get('memory_broker', 'default')).select_connection
+            self.connection = connection_class(self.parameters,
+                                               on_open_callback=self._on_connection_open,
+                                               on_open_error_callback=self._on_connection_open_error,
+                                               on_close_callback=self._on_connection_closed,
+                                               custom_ioloop=self.loop)
+        return await asyncio.shield(self._opening)
+
+    def _on_connection_open(self, connection):
+        self.flow.watch(connection)
+        connection.add_on_connection_unblocked_callback(self._on_connection_unblocked)
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_unblocked(self, method_frame):
+        for future in list(self._unblocked_waiters):
+            if not future.done():
+                future.set_result(None)
+
+    def _on_connection_open_error(self, connection, error):
+        self._fail(self._opening, ConnectionClosed(-1, str(error)))
+        self._opening = None
+
+    def _on_channel_open(self, channel):
+        self.channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        if self.confirm_delivery:
+            channel.confirm_delivery(self._on_delivery_confirmation)
+        self._opening.set_result(channel)
+
+    def _on_channel_closed(self, channel, reply_code, reply_text):
+        logger.warning('信道已关闭: (%s) %s', reply_code, reply_text)
+        self.channel = None
+        self._opening = None
+        error = ChannelClosed(reply_code, reply_text)
+        for future in list(self._waiters) + list(self._deliveries.values()):
+            self._fail(future, error)
+        self._waiters.clear()
+        self._deliveries.clear()
+        self._delivery_tag = 0
+        if self._consuming is not None and not self._consuming.done():
+            self._consuming.set_exception(error)
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
+
+    def _on_connection_closed(self, connection, reply_code, reply_text):
+        self.connection = None
+        self.channel = None
+        self._opening = None
+        self.flow.reset()
+        for future in list(self._unblocked_waiters):
+            self._fail(future, ConnectionClosed(reply_code, reply_text))
+        if self._consuming is not None and not self._consuming.done():
+            self._consuming.set_exception(ConnectionClosed(reply_code, reply_text))
+        if self._closed is not None and not self._closed.done():
+            self._closed.set_result(None)
+
+    @staticmethod
+    def _fail(future, error):
+        if future is not None and not future.done():
+            future.set_exception(error)
+
+    def _rpc(self, method, *args, **kwargs):
+        '''调用pika带回调的RPC方法，返回在收到回复时完成的future
+        :param method: 信道的RPC方法
+        :return: asyncio.Future
+        '''
+        future = self.loop.create_future()
+        self._waiters.add(future)
+        future.add_done_callback(self._waiters.discard)
+
+        def callback(frame):
+            if not future.done():
+                future.set_result(frame)
+
+        method(callback, *args, **kwargs)
+        return future
+
+    async def on_bind(self):
+        '''申明交换机、队列并绑定
+        :return:
+        '''
+        channel = await self.connect()
+        # pika同一时间只发出一个等待回复的RPC，这里以nowait连续发出，最后一个被动声明作为屏障，只等待一次往返
+        exchange = self.params.get("exchange")
+        durable = self.params.get("durable")
+        queues = self.params.get("publish_data_queue")
+        channel.exchange_declare(None, exchange=exchange,
+                                 exchange_type=self.params.get("exchange_type"),
+                                 durable=durable, nowait=True)
+        for queue_name in queues:
+            channel.queue_declare(None, queue=queue_name, durable=durable, nowait=True)
+            channel.queue_bind(None, queue=queue_name, exchange=exchange,
+                               routing_key=self.params.get("routing_key"), nowait=True)
+        if queues:
+            await self._rpc(channel.queue_declare, queue=queues[-1], passive=True)
+        else:
+            await self._rpc(channel.exchange_declare, exchange=exchange, passive=True)
+
+    def start_consuming(self, callback):
+        '''阻塞运行事件循环直到停止消费，与RabbitMQMessageHandler.start_consuming用法一致
+        :param callback:回调对象或函数，callback可以是async def
+        :return:None
+        '''
+        self.loop.run_until_complete(self.consume(callback))
+
+    async def consume(self, callback):
+        '''竞争消费模式，最多同时处理concurrency条消息
+        :param callback:回调对象或函数
+        :return:None
+        '''
+        await self.on_bind()
+        channel = self.channel
+        queue_name = self.params.get('task_queue')
+        await self._rpc(channel.queue_declare, queue=queue_name,
+                        durable=self.params.get('durable'))
+        await self._rpc(channel.basic_qos, prefetch_count=self.concurrency)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._consuming = self.loop.create_future()
+        channel.add_on_cancel_callback(self._on_cancelok)
+        self._consumer_tag = channel.basic_consume(functools.partial(self._on_message, callback),
+                                                   queue_name)
+        try:
+            await self._consuming
+        finally:
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _on_message(self, callback, ch, method, properties, body):
+        task = self.loop.create_task(self._handle(callback, ch, method, properties, body))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, callback, ch, method, properties, body):
+        async with self._semaphore:
+            try:
+                success = await self._call(callback, ch, method, properties, body)
+            except CodecError as e:
+                # 重新投递也无法解码，拒绝且不重新入队，队列配置了死信交换机时转入死信队列
+                logger.error('消息无法解码，拒绝: %s', e)
+                if ch.is_open:
+                    ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                return
+            except Exception:
+                logger.exception('消息处理失败')
+                success = False
+        if success and ch.is_open:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    async def _call(self, callback, *args):
+        '''async def回调直接await，普通函数放到线程池中执行，避免阻塞事件循环
+        普通函数运行在其他线程中，不能直接操作ch
+        '''
+        if isinstance(callback, IMessageCallBack):
+            callback = callback.callback
+        if asyncio.iscoroutinefunction(callback):
+            return await callback(*args)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        return await self.loop.run_in_executor(self._executor, functools.partial(callback, *args))
+
+    def stop_consuming(self):
+        '''停止消费，可以在其他线程或信号处理函数中调用，处理中的消息完成后start_consuming返回
+        :return:None
+        '''
+        self.loop.call_soon_threadsafe(self._cancel)
+
+    def _cancel(self):
+        if self.channel is None or self._consumer_tag is None:
+            return
+        self.channel.basic_cancel(self._on_cancelok, self._consumer_tag)
+
+    def _on_cancelok(self, unused_frame):
+        if self._consuming is not None and not self._consuming.done():
+            self._consuming.set_result(None)
+
+    async def publish(self, data):
+        '''发布消息，开启发布确认（confirm_delivery）时等待Broker确认
+        :param data:消息内容，bytes或str原样发送，其他对象用codec编码
+        :return:Broker确认返回True，拒绝返回False；没有开启发布确认时返回True
+        '''
+        channel = await self.connect()
+        if self.flow.blocked:
+            await self.wait_unblocked()
+            channel = await self.connect()
+        content_type = content_encoding = None
+        if not isinstance(data, (bytes, str)):
+            data, content_type, content_encoding = self.codec.encode(data)
+        channel.basic_publish(exchange=self.params.get("exchange"),
+                              routing_key=self.params.get('routing_key'),
+                              body=data,
+                              properties=pika.BasicProperties(
+                                  delivery_mode=self.params.get("delivery_mode"),
+                                  content_type=content_type,
+                                  content_encoding=content_encoding))
+        if not self.confirm_delivery:
+            return True
+        self._delivery_tag += 1
+        future = self._deliveries[self._delivery_tag] = self.loop.create_future()
+        return await future
+
+    async def wait_unblocked(self):
+        '''连接被流控阻塞时等待解除，发布方因此慢下来，而不是把消息堆在输出缓冲区中；
+        超过blocked_publish_timeout秒抛出PublishBlockedTimeout，为空时一直等待
+        :return:
+        '''
+        if not self.flow.blocked:
+            return
+        future = self.loop.create_future()
+        self._unblocked_waiters.add(future)
+        future.add_done_callback(self._unblocked_waiters.discard)
+        try:
+            await asyncio.wait_for(future, self.params.get('blocked_publish_timeout'))
+        except asyncio.TimeoutError:
+            raise PublishBlockedTimeout()
+
+    def _on_delivery_confirmation(self, method_frame):
+        '''收到Basic.Ack或Basic.Nack，multiple为True时确认所有小于等于delivery_tag的消息'''
+        success = isinstance(method_frame.method, pika.spec.Basic.Ack)
+        delivery_tag = method_frame.method.delivery_tag
+        if method_frame.method.multiple:
+            while self._deliveries:
+                tag = next(iter(self._deliveries))
+                if delivery_tag and tag > delivery_tag:
+                    break
+                self._deliveries.popitem(last=False)[1].set_result(success)
+        elif delivery_tag in self._deliveries:
+            self._deliveries.pop(delivery_tag).set_result(success)
+
+    def decode(self, properties, body):
+        '''按消息属性解码消息体，与RabbitMQMessageHandler.decode一致'''
+        return self.codec.decode_message(properties, body)
+
+    def publish_message(self, data):
+        '''发布消息，与RabbitMQMessageHandler.publish_message用法一致
+        在事件循环内调用时返回可await的Task；事件循环在其他线程运行时等待其完成；否则直接运行事件循环
+        :param data:消息内容
+        :return:Broker是否确认，或者可await的Task
+        '''
+        coroutine = self.publish(data)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            return self.loop.create_task(coroutine)
+        if self.loop.is_running():
+            return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+        return self.loop.run_until_complete(coroutine)
+
+    def close_channel(self):
+        '''关闭信道
+        :return:
+        '''
+        if self.channel is not None and self.channel.is_open:
+            self.channel.close()
+
+    def close(self):
+        '''关闭连接，等待连接关闭完成
+        :return:
+        '''
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        if self.connection is None or self.connection.is_closed:
+            return
+        if not self.connection.is_closing:
+            self.connection.close()
+        if not self.loop.is_running():
+            self.loop.run_until_complete(self._closed)
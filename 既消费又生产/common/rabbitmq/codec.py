@@ -0,0 +1,161 @@
+'''消息体编解码
+序列化方式和压缩方式通过AMQP的content_type、content_encoding属性告知消费者，消费者按属性选择解码方式；
+其他客户端常把字符集（如utf-8）放在content_encoding中，不是压缩方式的content_encoding按字符集处理
+orjson、msgpack、lz4为可选依赖，没有安装时对应的编解码器不可用
+'''
+
+import json
+import zlib
+import codecs
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+
+
+class CodecError(ValueError):
+    # 消息体无法解码或者编解码器不可用
+    pass
+
+
+# 复用编码器，json.dumps传入非默认参数时每次都会新建JSONEncoder
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def _json_dumps(obj):
+    return _json_encoder.encode(obj).encode('utf-8')
+
+
+def _json_loads(body):
+    # json.loads不接受memoryview
+    if isinstance(body, memoryview):
+        body = body.tobytes()
+    return json.loads(body)
+
+
+def _msgpack_dumps(obj):
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def _msgpack_loads(body):
+    return msgpack.unpackb(body, raw=False)
+
+
+# 名称: (content_type, 编码函数, 解码函数)
+SERIALIZERS = {'json': (JSON, _json_dumps, _json_loads)}
+if orjson is not None:
+    SERIALIZERS['orjson'] = (JSON, orjson.dumps, orjson.loads)
+if msgpack is not None:
+    SERIALIZERS['msgpack'] = (MSGPACK, _msgpack_dumps, _msgpack_loads)
+
+# content_encoding: (压缩函数, 解压函数)
+COMPRESSORS = {'zlib': (zlib.compress, zlib.decompress)}
+if lz4 is not None:
+    COMPRESSORS['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+# 支持的压缩方式，库没有安装时无法解码
+COMPRESSION_NAMES = ('zlib', 'lz4')
+
+
+def _transcode(body, charset):
+    '''按字符集解码文本消息体，UTF-8和不认识的字符集原样返回
+    :param body: 消息体
+    :param charset: 字符集名称
+    :return: bytes或str
+    '''
+    try:
+        name = codecs.lookup(charset).name
+    except LookupError:
+        return body
+    if 'utf-8' == name:
+        return body
+    return bytes(body).decode(name)
+
+
+class Codec(object):
+    # 编码使用配置的序列化方式，解码按消息属性选择，同一个JSON消息可以由json或orjson解码
+    def __init__(self, serializer='json', compression=None, threshold=1024):
+        '''
+        :param serializer: 序列化方式，json、orjson或msgpack，orjson没有安装时退回json
+        :param compression: 压缩方式，zlib或lz4，为空时不压缩
+        :param threshold: 序列化后超过该字节数才压缩
+        '''
+        if serializer == 'orjson' and serializer not in SERIALIZERS:
+            serializer = 'json'
+        if serializer not in SERIALIZERS:
+            raise CodecError('不支持的序列化方式: %s' % serializer)
+        if compression and compression not in COMPRESSORS:
+            raise CodecError('不支持的压缩方式: %s' % compression)
+        self.serializer = serializer
+        self.compression = compression
+        self.threshold = threshold
+        self.content_type, self._dumps, _ = SERIALIZERS[serializer]
+        # 解码时同一content_type优先使用更快的实现
+        self._loads = {JSON: SERIALIZERS.get('orjson', SERIALIZERS['json'])[2]}
+        if 'msgpack' in SERIALIZERS:
+            self._loads[MSGPACK] = SERIALIZERS['msgpack'][2]
+
+    @classmethod
+    def from_params(cls, params):
+        '''根据消息配置参数创建
+        :param params: 包含codec、compression、compress_threshold的配置
+        :return: Codec
+        '''
+        return cls(serializer=params.get('codec', 'json'),
+                   compression=params.get('compression'),
+                   threshold=params.get('compress_threshold', 1024))
+
+    def encode(self, obj):
+        '''
+        :param obj: 可序列化的对象
+        :return: (消息体, content_type, content_encoding)，没有压缩时content_encoding为None
+        '''
+        body = self._dumps(obj)
+        if self.compression and len(body) > self.threshold:
+            return COMPRESSORS[self.compression][0](body), self.content_type, self.compression
+        return body, self.content_type, None
+
+    def decode(self, body, content_type=None, content_encoding=None):
+        '''直接从bytes或memoryview解码，不经过str
+        :param body: 消息体
+        :param content_type: 消息属性content_type，为空时按JSON处理
+        :param content_encoding: 消息属性content_encoding，为空时不解压；是字符集时按该字符集解码JSON，
+                                 其他不认识的值按未压缩处理
+        :return: 反序列化后的对象，压缩方式的库没有安装或者消息体无法解码时抛出CodecError
+        '''
+        try:
+            if content_encoding in COMPRESSORS:
+                body = COMPRESSORS[content_encoding][1](body)
+            elif content_encoding in COMPRESSION_NAMES:
+                raise CodecError('压缩方式%s的库没有安装' % content_encoding)
+            elif content_encoding and (content_type or JSON) == JSON:
+                body = _transcode(body, content_encoding)
+            loads = self._loads.get(content_type or JSON)
+            if loads is None:
+                raise CodecError('不支持的content_type: %s' % content_type)
+            return loads(body)
+        except CodecError:
+            raise
+        except Exception as e:
+            raise CodecError(e)
+
+    def decode_message(self, properties, body):
+        '''
+        :param properties: pika.BasicProperties
+        :param body: 消息体
+        :return: 反序列化后的对象
+        '''
+        return self.decode(body, properties.content_type, properties.content_encoding)
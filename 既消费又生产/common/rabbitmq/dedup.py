@@ -0,0 +1,108 @@
+'''消费去重
+消费者崩溃或者连接断开时，已经处理完但还没有确认的消息会被重新投递；发布方的至少一次重发也会产生重复消息。
+处理成功的消息按message_id（没有时用消息体的哈希）记录下来，再次收到时直接确认，不再执行回调。
+进程内用LRU加TTL缓存，可选写入Redis（SET NX EX），进程重启或者多个消费者之间也能去重
+'''
+
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from common.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+class DedupCache(object):
+    # 线程安全，在工作线程中调用，Redis的读写不占用连接线程
+    def __init__(self, capacity=100000, ttl=3600, redis=None, prefix='dedup:', labels=None):
+        '''
+        :param capacity: 进程内最多记录的消息数，超出后淘汰最久没有用到的
+        :param ttl: 记录的有效时间（秒），同样用作Redis键的过期时间
+        :param redis: common.redis_connection.RedisClient，为空时只在进程内去重
+        :param prefix: Redis键的前缀
+        :param labels: 指标标签
+        '''
+        self.capacity = capacity
+        self.ttl = ttl
+        self.redis = redis
+        self.prefix = prefix
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = REGISTRY.counter('rabbitmq_dedup_hits_total', '去重命中、直接确认的消息数', labels)
+        self._misses = REGISTRY.counter('rabbitmq_dedup_misses_total', '去重未命中、执行回调的消息数', labels)
+
+    @staticmethod
+    def key(properties, body):
+        '''消息的去重键
+        :param properties: pika.BasicProperties
+        :param body: 消息体
+        :return: str
+        '''
+        message_id = getattr(properties, 'message_id', None)
+        if message_id:
+            return 'id:' + message_id
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+    def seen(self, key):
+        '''消息是否已经处理成功过
+        :param key: key()返回的去重键
+        :return: bool
+        '''
+        now = time.monotonic()
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is not None:
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self._hits.inc()
+                    return True
+                del self._entries[key]
+        if self.redis is not None and self.redis.exists(self.prefix + key):
+            self._remember(key, now)
+            self._hits.inc()
+            return True
+        self._misses.inc()
+        return False
+
+    def add(self, key):
+        '''记录处理成功的消息
+        :param key: key()返回的去重键
+        :return:
+        '''
+        self._remember(key, time.monotonic())
+        if self.redis is not None:
+            self.redis.set_once(self.prefix + key, self.ttl)
+
+    def _remember(self, key, now):
+        with self._lock:
+            self._entries[key] = now + self.ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    @property
+    def hits(self):
+        return self._hits.value
+
+    @property
+    def misses(self):
+        return self._misses.value
+
+    @classmethod
+    def from_params(cls, params, labels=None):
+        '''根据message_params中的dedup配置创建
+        :param params: {"capacity": 100000, "ttl": 3600, "redis": {"host": ..., "port": ..., "db": ...}}
+        :param labels: 指标标签
+        :return: DedupCache
+        '''
+        redis = None
+        if params.get('redis'):
+            # redis是可选依赖，只在配置了时导入
+            from common.redis_connection import RedisClient
+            redis = RedisClient(**params['redis'])
+        return cls(capacity=params.get('capacity', 100000), ttl=params.get('ttl', 3600), redis=redis,
+                   prefix=params.get('prefix', 'dedup:'), labels=labels)
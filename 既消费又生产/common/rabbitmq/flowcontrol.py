@@ -0,0 +1,108 @@
+'''流控
+Broker触发内存或磁盘告警时向发布消息的连接发送Connection.Blocked，之后不再读取这些连接上的数据，
+继续发布只会写满socket缓冲区，最终阻塞在basic_publish中。
+FlowControl记录连接是否被阻塞以及累计阻塞时间，发布方据此暂停发布、把消息转入缓冲，或者让调用方等待
+'''
+
+import time
+import logging
+import weakref
+import threading
+from common.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+_flows = weakref.WeakKeyDictionary()
+_flows_lock = threading.Lock()
+
+
+def flow_control(connection, labels=None):
+    '''连接上的流控状态，同一个连接被多个handler借用时只注册一次回调
+    :param connection: pika.BlockingConnection
+    :param labels: 第一次创建时使用的指标标签
+    :return: FlowControl
+    '''
+    with _flows_lock:
+        flow = _flows.get(connection)
+        if flow is None:
+            flow = _flows[connection] = FlowControl(labels)
+            flow.watch(connection)
+        return flow
+
+
+class FlowControl(object):
+    # 回调在连接线程中执行，blocked和wait可以在其他线程中使用
+    def __init__(self, labels=None):
+        '''
+        :param labels: 指标标签
+        '''
+        self.reason = None
+        self._blocked_since = None
+        self._unblocked = threading.Event()
+        self._unblocked.set()
+        self._blocks = REGISTRY.counter('rabbitmq_blocked_total', '收到Connection.Blocked的次数', labels)
+        self._blocked_seconds = REGISTRY.counter('rabbitmq_blocked_seconds_total',
+                                                 '连接被Broker流控阻塞的累计时间（秒）', labels)
+        REGISTRY.gauge('rabbitmq_connection_blocked', '连接当前是否被Broker流控阻塞',
+                       labels).set_function(lambda: 1 if self.blocked else 0)
+
+    @property
+    def blocked(self):
+        return self._blocked_since is not None
+
+    def watch(self, connection):
+        '''注册连接的Connection.Blocked和Connection.Unblocked回调，新连接总是从未阻塞开始
+        :param connection: pika.BlockingConnection或pika.SelectConnection
+        :return:
+        '''
+        self.reset()
+        connection.add_on_connection_blocked_callback(self.on_blocked)
+        connection.add_on_connection_unblocked_callback(self.on_unblocked)
+
+    def on_blocked(self, method_frame):
+        '''收到Connection.Blocked
+        :param pika.frame.Method method_frame: method为pika.spec.Connection.Blocked
+        :return:
+        '''
+        if self._blocked_since is not None:
+            return
+        self.reason = method_frame.method.reason
+        self._blocked_since = time.monotonic()
+        self._unblocked.clear()
+        self._blocks.inc()
+        logger.warning('连接被Broker流控阻塞: %s', self.reason)
+
+    def on_unblocked(self, method_frame=None):
+        '''收到Connection.Unblocked，连接断开时也应调用
+        :param pika.frame.Method method_frame: method为pika.spec.Connection.Unblocked
+        :return:
+        '''
+        if self._blocked_since is None:
+            return
+        elapsed = time.monotonic() - self._blocked_since
+        self._blocked_since = None
+        self.reason = None
+        self._blocked_seconds.inc(elapsed)
+        self._unblocked.set()
+        logger.warning('连接解除阻塞，阻塞了%.1f秒', elapsed)
+
+    def reset(self):
+        '''连接断开后调用，新连接从未阻塞开始
+        :return:
+        '''
+        self.on_unblocked()
+
+    def blocked_for(self):
+        '''
+        :return: 当前这次阻塞已经持续的时间（秒），未阻塞时为0
+        '''
+        since = self._blocked_since
+        return 0.0 if since is None else time.monotonic() - since
+
+    def wait(self, timeout=None):
+        '''在其他线程中等待解除阻塞
+        :param timeout: 秒，None表示一直等待
+        :return: 是否已解除阻塞
+        '''
+        return self._unblocked.wait(timeout)
@@ -0,0 +1,930 @@
+'''进程内的RabbitMQ替身
+不需要真实的Broker，用于离线基准测试；支持direct、fanout、topic交换机，队列、绑定、prefetch、确认和发布确认。
+MemoryConnection的接口与pika.BlockingConnection保持一致，MemorySelectConnection与pika.SelectConnection
+（以及传入asyncio事件循环时的AsyncioConnection）保持一致，rpc_latency模拟每次同步RPC的往返耗时
+'''
+
+import time
+import heapq
+import weakref
+import functools
+import itertools
+import threading
+from collections import deque, Counter, OrderedDict
+from pika import frame, spec, exceptions
+
+_brokers = {}
+
+
+def get_broker(name='default'):
+    '''按名称获取进程内共享的Broker，连接参数transport为memory时使用
+    :param name: Broker名称，对应连接参数memory_broker
+    :return: MemoryBroker
+    '''
+    broker = _brokers.get(name)
+    if broker is None:
+        broker = _brokers.setdefault(name, MemoryBroker())
+    return broker
+
+
+def topic_match(pattern, routing_key):
+    '''topic交换机的绑定键匹配，*匹配一个单词，#匹配零个或多个单词
+    :param pattern: 绑定键
+    :param routing_key: 路由键
+    :return: bool
+    '''
+    return _match(pattern.split('.'), routing_key.split('.') if routing_key else [])
+
+
+def _match(words, keys):
+    if not words:
+        return not keys
+    if '#' == words[0]:
+        return any(_match(words[1:], keys[i:]) for i in range(len(keys) + 1))
+    if not keys:
+        return False
+    return words[0] in ('*', keys[0]) and _match(words[1:], keys[1:])
+
+
+class MemoryBroker(object):
+    # 内存Broker，保存交换机、队列和绑定关系
+    def __init__(self, rpc_latency=0.0, frame_latency=0.0):
+        '''
+        :param rpc_latency: 每次同步RPC模拟的往返耗时（秒）
+        :param frame_latency: 每个不需要回复的帧（发布、确认）模拟的发送耗时（秒）
+        '''
+        self.rpc_latency = rpc_latency
+        self.frame_latency = frame_latency
+        self.exchanges = {'': 'direct'}
+        self.queues = {}
+        self.arguments = {}
+        self.bindings = {}
+        self.frames = Counter()
+        self.round_trips = 0
+        self.running = True
+        self.attempts = []
+        self.blocked = None
+        self._unblocked = threading.Event()
+        self._unblocked.set()
+        self._routes = {}
+        self._connections = weakref.WeakSet()
+
+    def rpc(self, name):
+        '''记录一次需要等待Broker回复的RPC
+        :param name: AMQP方法名
+        :return:
+        '''
+        self.frames[name] += 1
+        self.round_trips += 1
+        if self.rpc_latency:
+            time.sleep(self.rpc_latency)
+
+    def frame(self, name):
+        '''记录一个不需要等待回复的帧
+        :param name: AMQP方法名
+        :return:
+        '''
+        self.frames[name] += 1
+        if self.frame_latency:
+            time.sleep(self.frame_latency)
+
+    def bind(self, queue, exchange, routing_key):
+        bindings = self.bindings.setdefault(exchange, [])
+        if (queue, routing_key) not in bindings:
+            bindings.append((queue, routing_key))
+        self._routes.clear()
+
+    def route(self, exchange, routing_key):
+        '''根据交换机类型计算消息应该投递的队列，结果按(交换机, 路由键)缓存，绑定变化时清空
+        :param exchange: 交换机名
+        :param routing_key: 路由键
+        :return: 队列名列表
+        '''
+        key = (exchange, routing_key)
+        queues = self._routes.get(key)
+        if queues is None:
+            queues = self._routes[key] = self._route(exchange, routing_key)
+        return queues
+
+    def _route(self, exchange, routing_key):
+        if '' == exchange:
+            return [routing_key] if routing_key in self.queues else []
+        exchange_type = self.exchanges[exchange]
+        bindings = self.bindings.get(exchange, ())
+        if 'fanout' == exchange_type:
+            return [queue for queue, _ in bindings]
+        if 'topic' == exchange_type:
+            return [queue for queue, key in bindings if topic_match(key, routing_key)]
+        return [queue for queue, key in bindings if key == routing_key]
+
+    def publish(self, exchange, routing_key, properties, body):
+        '''把消息放入路由到的队列
+        队列设置了x-max-length且x-overflow为reject-publish时，队列满后拒绝消息
+        :return: 是否被所有队列接受，开启发布确认时决定回复Basic.Ack还是Basic.Nack
+        '''
+        accepted = True
+        for queue in self.route(exchange, routing_key):
+            messages = self.queues[queue]
+            arguments = self.arguments.get(queue)
+            if arguments and 'reject-publish' == arguments.get('x-overflow') and \
+                    len(messages) >= arguments.get('x-max-length', float('inf')):
+                accepted = False
+                continue
+            messages.append((properties, body))
+        self.notify()
+        return accepted
+
+    def stop(self, reply_code=320, reply_text="CONNECTION_FORCED - broker forced connection closure with reason 'shutdown'"):
+        '''模拟Broker重启：断开所有连接，start之前新的连接被拒绝；持久化的交换机、队列和消息保留
+        :return:
+        '''
+        self.running = False
+        for connection in list(self._connections):
+            connection._broker_close(reply_code, reply_text)
+
+    def start(self):
+        self.running = True
+
+    def block(self, reason='low on memory'):
+        '''模拟内存或磁盘告警：向所有连接发送Connection.Blocked，之后的发布在unblock之前一直等待
+        :param reason: Connection.Blocked中的原因
+        :return:
+        '''
+        self.blocked = reason
+        self._unblocked.clear()
+        for connection in list(self._connections):
+            connection._broker_blocked(reason)
+
+    def unblock(self):
+        '''告警解除，向所有连接发送Connection.Unblocked
+        :return:
+        '''
+        self.blocked = None
+        self._unblocked.set()
+        for connection in list(self._connections):
+            connection._broker_unblocked()
+
+    def register(self, connection):
+        self._connections.add(connection)
+
+    def notify(self):
+        '''有新消息时唤醒所有连接投递'''
+        for connection in list(self._connections):
+            connection._notify()
+
+    def select_connection(self, parameters=None, on_open_callback=None, on_open_error_callback=None,
+                          on_close_callback=None, stop_ioloop_on_close=True, custom_ioloop=None):
+        '''参数与pika.SelectConnection相同，可以代替它传给ExamplePublisher、ExampleConsumer
+        :return: MemorySelectConnection
+        '''
+        connection = MemorySelectConnection(self, on_open_callback, on_open_error_callback,
+                                            on_close_callback, stop_ioloop_on_close, custom_ioloop)
+        if parameters is not None:
+            connection.blocked_connection_timeout = parameters.blocked_connection_timeout
+        return connection
+
+
+class MemoryConnection(object):
+    # 对应pika.BlockingConnection
+    def __init__(self, broker, heartbeat=0, blocked_connection_timeout=None):
+        '''
+        :param broker: MemoryBroker
+        :param heartbeat: 心跳间隔（秒），超过两个心跳间隔没有处理帧（回调执行时间过长，或者连接一直空闲、
+                          没有调用process_data_events和信道方法）时Broker断开连接，0表示不检查
+        :param blocked_connection_timeout: 被流控阻塞超过这个时间（秒）后断开连接，None表示一直等待
+        '''
+        broker.attempts.append(time.monotonic())
+        if not broker.running:
+            raise exceptions.AMQPConnectionError('Connection refused')
+        self.broker = broker
+        self.heartbeat = heartbeat
+        self.is_open = True
+        self._serviced = time.monotonic()
+        self._channel_number = 0
+        self._channels = []
+        self._callbacks = deque()
+        self._wakeup = threading.Event()
+        self._timers = []
+        self._timer_ids = itertools.count()
+        self._closed_by_broker = None
+        self.blocked_connection_timeout = blocked_connection_timeout
+        self._blocked_callbacks = []
+        self._unblocked_callbacks = []
+        self._blocked_timer = None
+        broker.register(self)
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def add_on_connection_blocked_callback(self, callback_method):
+        '''收到Connection.Blocked时调用callback_method(method_frame)，在连接线程中执行'''
+        self._blocked_callbacks.append(callback_method)
+
+    def add_on_connection_unblocked_callback(self, callback_method):
+        '''收到Connection.Unblocked时调用callback_method(method_frame)，在连接线程中执行'''
+        self._unblocked_callbacks.append(callback_method)
+
+    def _broker_blocked(self, reason):
+        # 由其他线程调用，与pika一样只在处理事件时通知
+        self.add_callback_threadsafe(functools.partial(
+            self._on_blocked, frame.Method(0, spec.Connection.Blocked(reason))))
+
+    def _broker_unblocked(self):
+        self.add_callback_threadsafe(functools.partial(
+            self._on_unblocked, frame.Method(0, spec.Connection.Unblocked())))
+
+    def _on_blocked(self, method_frame):
+        if self.blocked_connection_timeout is not None and self._blocked_timer is None:
+            self._blocked_timer = self.add_timeout(self.blocked_connection_timeout,
+                                                   self._on_blocked_connection_timeout)
+        for callback in self._blocked_callbacks:
+            callback(method_frame)
+
+    def _on_unblocked(self, method_frame):
+        if self._blocked_timer is not None:
+            self.remove_timeout(self._blocked_timer)
+            self._blocked_timer = None
+        for callback in self._unblocked_callbacks:
+            callback(method_frame)
+
+    def _on_blocked_connection_timeout(self):
+        self._blocked_timer = None
+        self._drop(-2, 'Blocked connection timeout expired')
+
+    def channel(self, channel_number=None):
+        if self._closed_by_broker is not None:
+            self._drop(*self._closed_by_broker)
+        if not self.is_open:
+            raise exceptions.ConnectionClosed(320, 'Connection is closed')
+        self._service()
+        self.broker.rpc('channel.open')
+        self._channel_number += 1
+        channel = MemoryChannel(self, channel_number or self._channel_number)
+        self._channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback):
+        '''其他线程通过该方法把回调交给连接线程执行'''
+        self._callbacks.append(callback)
+        self._wakeup.set()
+
+    def add_timeout(self, deadline, callback_method):
+        '''deadline秒后在连接线程中执行callback_method
+        :return: 定时器，用于remove_timeout
+        '''
+        timer = [time.monotonic() + deadline, next(self._timer_ids), callback_method]
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    def remove_timeout(self, timeout_id):
+        timeout_id[2] = None
+
+    def process_data_events(self, time_limit=0):
+        '''执行其他线程提交的回调并投递消息，没有任何事件时最多等待time_limit秒
+        :param time_limit: None表示一直等到有事件发生
+        :return:
+        '''
+        if not self.is_open:
+            raise exceptions.ConnectionClosed(320, 'CONNECTION_FORCED')
+        if self._closed_by_broker is not None:
+            self._drop(*self._closed_by_broker)
+        self._service()
+        if not self._dispatch() and time_limit != 0:
+            if self._timers:
+                delay = max(0.0, self._timers[0][0] - time.monotonic())
+                time_limit = delay if time_limit is None else min(time_limit, delay)
+            self._wakeup.wait(time_limit)
+            self._wakeup.clear()
+            # 等待期间pika照常收发心跳
+            self._serviced = time.monotonic()
+            if self._closed_by_broker is not None:
+                self._drop(*self._closed_by_broker)
+            self._dispatch()
+
+    def _service(self):
+        '''连接线程处理帧时调用，距离上次处理超过两个心跳间隔时Broker已经断开了连接'''
+        now = time.monotonic()
+        if self.heartbeat and now - self._serviced > 2 * self.heartbeat:
+            self._drop(320, 'CONNECTION_FORCED - missed heartbeats from client')
+        self._serviced = now
+
+    def _notify(self):
+        self._wakeup.set()
+
+    def _broker_close(self, reply_code, reply_text):
+        # 由其他线程调用，下一次处理事件时在连接线程中断开
+        self._closed_by_broker = (reply_code, reply_text)
+        self._wakeup.set()
+
+    def _run_callback(self, callback, *args):
+        '''在连接线程中执行回调，回调期间无法收发心跳'''
+        self._serviced = time.monotonic()
+        callback(*args)
+        self._service()
+
+    def _drop(self, reply_code, reply_text):
+        '''模拟Broker强制断开连接'''
+        for channel in self._channels:
+            channel._requeue_unacked()
+            channel.is_open = False
+        self.is_open = False
+        raise exceptions.ConnectionClosed(reply_code, reply_text)
+
+    def _dispatch(self):
+        busy = False
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            callback = heapq.heappop(self._timers)[2]
+            if callback is not None:
+                self._run_callback(callback)
+                busy = True
+        while self._callbacks:
+            self._run_callback(self._callbacks.popleft())
+            busy = True
+        for channel in list(self._channels):
+            busy = channel._deliver() or busy
+        return busy
+
+    def close(self, reply_code=200, reply_text='Normal shutdown'):
+        self.broker.rpc('connection.close')
+        for channel in self._channels:
+            channel._requeue_unacked()
+        self.is_open = False
+
+
+class MemoryChannel(object):
+    # 对应pika.adapters.blocking_connection.BlockingChannel
+    def __init__(self, connection, channel_number):
+        self.connection = connection
+        self.broker = connection.broker
+        self.channel_number = channel_number
+        self.is_open = True
+        self._confirm = False
+        self._prefetch_count = 0
+        self._consumers = OrderedDict()
+        self._unacked = OrderedDict()
+        self._delivery_tag = 0
+        self._nowait = False
+
+    def __int__(self):
+        return self.channel_number
+
+    @property
+    def _impl(self):
+        return _ImplChannel(self)
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def _rpc(self, name):
+        # nowait的方法不等待回复，只记作一个帧
+        if self._nowait:
+            self.broker.frame(name)
+        else:
+            self.broker.rpc(name)
+
+    def _check_open(self):
+        if self.connection._closed_by_broker is not None:
+            # 连接已被Broker断开，下一次读写时发现
+            self.connection._drop(*self.connection._closed_by_broker)
+        if not self.is_open or not self.connection.is_open:
+            raise exceptions.ChannelClosed(504, 'CHANNEL_ERROR')
+        self.connection._service()
+
+    def _abort(self, reply_code, reply_text):
+        '''模拟Broker因协议错误关闭信道'''
+        self.is_open = False
+        self._requeue_unacked()
+        raise exceptions.ChannelClosed(reply_code, reply_text)
+
+    def close(self, reply_code=0, reply_text='Normal shutdown'):
+        self._check_open()
+        self._rpc('channel.close')
+        self._requeue_unacked()
+        self._forget()
+
+    def _forget(self):
+        # 关闭后不再参与投递，每条消息一个信道时已关闭的信道不会越积越多
+        self.is_open = False
+        if self in self.connection._channels:
+            self.connection._channels.remove(self)
+
+    def confirm_delivery(self):
+        self._check_open()
+        self._rpc('confirm.select')
+        self._confirm = True
+
+    def exchange_declare(self, exchange=None, exchange_type='direct',
+                         passive=False, durable=False, auto_delete=False,
+                         internal=False, arguments=None):
+        self._check_open()
+        self._rpc('exchange.declare')
+        if passive:
+            if exchange not in self.broker.exchanges:
+                self._abort(404, 'NOT_FOUND - no exchange %r' % exchange)
+        elif self.broker.exchanges.setdefault(exchange, exchange_type) != exchange_type:
+            self._abort(406, 'PRECONDITION_FAILED - inequivalent arg \'type\' for exchange %r' % exchange)
+        return frame.Method(self.channel_number, spec.Exchange.DeclareOk())
+
+    def queue_declare(self, queue='', passive=False, durable=False,
+                      exclusive=False, auto_delete=False, arguments=None):
+        self._check_open()
+        self._rpc('queue.declare')
+        if passive and queue not in self.broker.queues:
+            self._abort(404, 'NOT_FOUND - no queue %r' % queue)
+        messages = self.broker.queues.setdefault(queue, deque())
+        if arguments:
+            self.broker.arguments[queue] = arguments
+        consumers = sum(1 for connection in list(self.broker._connections)
+                        for channel in connection._channels
+                        for consumer in channel._consumers.values() if consumer[0] == queue)
+        return frame.Method(self.channel_number,
+                            spec.Queue.DeclareOk(queue, len(messages), consumers))
+
+    def queue_bind(self, queue, exchange, routing_key=None,
+                   arguments=None):
+        self._check_open()
+        self._rpc('queue.bind')
+        if exchange not in self.broker.exchanges:
+            self._abort(404, 'NOT_FOUND - no exchange %r' % exchange)
+        if queue not in self.broker.queues:
+            self._abort(404, 'NOT_FOUND - no queue %r' % queue)
+        self.broker.bind(queue, exchange, routing_key if routing_key is not None else queue)
+        return frame.Method(self.channel_number, spec.Queue.BindOk())
+
+    def _publish(self, exchange, routing_key, body, properties):
+        self._check_open()
+        if self.broker.blocked is not None:
+            # Broker不再读取被阻塞连接上的数据，socket缓冲区写满后发布一直等待
+            if not self.broker._unblocked.wait(self.connection.blocked_connection_timeout):
+                self.connection._drop(-2, 'Blocked connection timeout expired')
+        if exchange not in self.broker.exchanges:
+            self._abort(404, 'NOT_FOUND - no exchange %r' % exchange)
+        self.broker.frame('basic.publish')
+        return self.broker.publish(exchange, routing_key, properties, body)
+
+    def basic_publish(self, exchange, routing_key, body,
+                      properties=None, mandatory=False, immediate=False):
+        accepted = self._publish(exchange, routing_key, body, properties)
+        if self._confirm:
+            # 开启确认模式后，basic_publish需要等待Basic.Ack或Basic.Nack
+            self.broker.rpc('confirm.ack' if accepted else 'confirm.nack')
+            return accepted
+        return True
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, all_channels=False):
+        self._check_open()
+        self._rpc('basic.qos')
+        self._prefetch_count = prefetch_count
+
+    def basic_consume(self, consumer_callback, queue, no_ack=False,
+                      exclusive=False, consumer_tag=None, arguments=None):
+        self._check_open()
+        self._rpc('basic.consume')
+        if queue not in self.broker.queues:
+            self._abort(404, 'NOT_FOUND - no queue %r' % queue)
+        consumer_tag = consumer_tag or 'ctag%i.%i' % (self.channel_number,
+                                                      len(self._consumers) + 1)
+        self._consumers[consumer_tag] = (queue, consumer_callback, no_ack)
+        return consumer_tag
+
+    def basic_cancel(self, consumer_tag):
+        self._check_open()
+        self._rpc('basic.cancel')
+        self._consumers.pop(consumer_tag, None)
+
+    def start_consuming(self):
+        while self._consumers and self.is_open:
+            self.connection.process_data_events(time_limit=None)
+
+    def stop_consuming(self, consumer_tag=None):
+        for tag in [consumer_tag] if consumer_tag else list(self._consumers):
+            self.basic_cancel(tag)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._check_open()
+        self.broker.frame('basic.ack')
+        for tag in self._settle(delivery_tag, multiple):
+            self._unacked.pop(tag)
+
+    def basic_nack(self, delivery_tag=None, multiple=False, requeue=True):
+        self._check_open()
+        self.broker.frame('basic.nack')
+        for tag in reversed(self._settle(delivery_tag, multiple)):
+            queue, message = self._unacked.pop(tag)
+            if requeue:
+                self.broker.queues[queue].appendleft(message)
+        if requeue:
+            self.broker.notify()
+
+    def _settle(self, delivery_tag, multiple):
+        if not multiple:
+            if delivery_tag not in self._unacked:
+                self._abort(406, 'PRECONDITION_FAILED - unknown delivery tag %r' % delivery_tag)
+            return [delivery_tag]
+        tags = []
+        for tag in self._unacked:
+            if delivery_tag and tag > delivery_tag:
+                break
+            tags.append(tag)
+        return tags
+
+    def _requeue_unacked(self):
+        for queue, message in reversed(list(self._unacked.values())):
+            self.broker.queues[queue].appendleft(message)
+        if self._unacked:
+            self._unacked.clear()
+            self.broker.notify()
+
+    def _deliver(self):
+        '''按照prefetch_count给每个消费者投递一条消息
+        :return: 是否投递了消息
+        '''
+        delivered = False
+        for consumer_tag, (queue, callback, no_ack) in list(self._consumers.items()):
+            messages = self.broker.queues[queue]
+            if messages and self.is_open and consumer_tag in self._consumers:
+                if not no_ack and 0 < self._prefetch_count <= len(self._unacked):
+                    return delivered
+                try:
+                    properties, body = message = messages.popleft()
+                except IndexError:
+                    # 被其他线程中的消费者取走
+                    continue
+                self._delivery_tag += 1
+                if not no_ack:
+                    self._unacked[self._delivery_tag] = (queue, message)
+                method = spec.Basic.Deliver(consumer_tag, self._delivery_tag,
+                                            False, '', queue)
+                self.connection._run_callback(callback, self, method,
+                                              properties or spec.BasicProperties(), body)
+                delivered = True
+        return delivered
+
+
+class _ImplChannel(object):
+    # 对应BlockingChannel._impl：阻塞信道底层的异步信道，方法的第一个参数是回调，nowait时不等待回复
+    def __init__(self, channel):
+        self._channel = channel
+
+    def _call(self, callback, method, nowait, *args):
+        self._channel._nowait = nowait
+        try:
+            result = method(self._channel, *args)
+        finally:
+            self._channel._nowait = False
+        if callback is not None and not nowait:
+            callback(result)
+
+    def exchange_declare(self, callback=None, exchange=None, exchange_type='direct',
+                         passive=False, durable=False, auto_delete=False, internal=False,
+                         nowait=False, arguments=None):
+        self._call(callback, MemoryChannel.exchange_declare, nowait, exchange, exchange_type,
+                   passive, durable, auto_delete, internal, arguments)
+
+    def queue_declare(self, callback, queue='', passive=False, durable=False, exclusive=False,
+                      auto_delete=False, nowait=False, arguments=None):
+        self._call(callback, MemoryChannel.queue_declare, nowait, queue, passive, durable,
+                   exclusive, auto_delete, arguments)
+
+    def queue_bind(self, callback, queue, exchange, routing_key=None, nowait=False,
+                   arguments=None):
+        self._call(callback, MemoryChannel.queue_bind, nowait, queue, exchange, routing_key,
+                   arguments)
+
+
+class MemoryIOLoop(object):
+    # 对应pika的IOLoop：在调用start的线程中执行定时器和其他线程提交的回调
+    def __init__(self):
+        self._timers = []
+        self._timer_ids = itertools.count()
+        self._callbacks = deque()
+        self._wakeup = threading.Event()
+        self._running = False
+
+    def call_later(self, delay, callback):
+        timer = [time.monotonic() + delay, next(self._timer_ids), callback]
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    def remove_timeout(self, timer):
+        timer[2] = None
+
+    def add_callback_threadsafe(self, callback):
+        self._callbacks.append(callback)
+        self._wakeup.set()
+
+    def start(self):
+        self._running = True
+        while self._running:
+            self._poll()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def _poll(self):
+        while self._callbacks:
+            self._callbacks.popleft()()
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            callback = heapq.heappop(self._timers)[2]
+            if callback is not None:
+                callback()
+        if self._running and not self._callbacks:
+            timeout = max(0.0, self._timers[0][0] - time.monotonic()) if self._timers else None
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+
+class _AsyncioIOLoop(object):
+    # 把asyncio事件循环包装成MemoryIOLoop的接口
+    def __init__(self, loop):
+        self.loop = loop
+
+    def call_later(self, delay, callback):
+        return self.loop.call_later(delay, callback)
+
+    def remove_timeout(self, handle):
+        handle.cancel()
+
+    def add_callback_threadsafe(self, callback):
+        self.loop.call_soon_threadsafe(callback)
+
+    def start(self):
+        self.loop.run_forever()
+
+    def stop(self):
+        self.loop.stop()
+
+
+class MemorySelectConnection(object):
+    # 对应pika.SelectConnection，所有回调都在ioloop中执行
+    _closed_by_broker = None
+    blocked_connection_timeout = None
+
+    def __init__(self, broker, on_open_callback=None, on_open_error_callback=None,
+                 on_close_callback=None, stop_ioloop_on_close=True, custom_ioloop=None):
+        '''
+        :param broker: MemoryBroker
+        :param on_open_callback: 连接打开后调用，on_open_callback(connection)
+        :param on_open_error_callback: Broker停止时连接被拒绝，on_open_error_callback(connection, error)
+        :param on_close_callback: 连接关闭后调用，on_close_callback(connection, reply_code, reply_text)
+        :param stop_ioloop_on_close: 连接关闭后是否停止ioloop
+        :param custom_ioloop: MemoryIOLoop或asyncio事件循环，为空时新建MemoryIOLoop
+        '''
+        self.broker = broker
+        if custom_ioloop is None:
+            custom_ioloop = MemoryIOLoop()
+        elif hasattr(custom_ioloop, 'call_soon_threadsafe'):
+            custom_ioloop = _AsyncioIOLoop(custom_ioloop)
+        self.ioloop = custom_ioloop
+        self.is_open = False
+        self.is_closing = False
+        self.heartbeat = 0
+        self.stop_ioloop_on_close = stop_ioloop_on_close
+        self._on_open_error_callback = on_open_error_callback
+        self._channel_number = 0
+        self._channels = []
+        self._close_callbacks = [on_close_callback] if on_close_callback else []
+        self._blocked_callbacks = []
+        self._unblocked_callbacks = []
+        self._blocked_timer = None
+        # 被流控阻塞期间发布的消息，对应pika输出缓冲区中还没有发出的帧
+        self._held = []
+        self._dispatching = False
+        self._schedule(self._on_open, on_open_callback)
+
+    @property
+    def is_closed(self):
+        return not self.is_open and not self.is_closing
+
+    def _schedule(self, callback, *args):
+        '''在ioloop中尽快执行，可以在任何线程中调用'''
+        self.ioloop.add_callback_threadsafe(functools.partial(callback, *args))
+
+    def _on_open(self, on_open_callback):
+        self.broker.attempts.append(time.monotonic())
+        if not self.broker.running:
+            if self._on_open_error_callback is None:
+                raise exceptions.AMQPConnectionError('Connection refused')
+            self._on_open_error_callback(self, 'Connection refused')
+            return
+        self.broker.rpc('connection.open')
+        self.is_open = True
+        self.broker.register(self)
+        if on_open_callback is not None:
+            on_open_callback(self)
+
+    def add_on_close_callback(self, callback):
+        self._close_callbacks.append(callback)
+
+    def add_on_connection_blocked_callback(self, callback_method):
+        self._blocked_callbacks.append(callback_method)
+
+    def add_on_connection_unblocked_callback(self, callback_method):
+        self._unblocked_callbacks.append(callback_method)
+
+    def _broker_blocked(self, reason):
+        self._schedule(self._on_blocked, frame.Method(0, spec.Connection.Blocked(reason)))
+
+    def _broker_unblocked(self):
+        self._schedule(self._on_unblocked, frame.Method(0, spec.Connection.Unblocked()))
+
+    def _on_blocked(self, method_frame):
+        if not self.is_open:
+            return
+        if self.blocked_connection_timeout is not None and self._blocked_timer is None:
+            self._blocked_timer = self.add_timeout(self.blocked_connection_timeout,
+                                                   self._on_blocked_connection_timeout)
+        for callback in self._blocked_callbacks:
+            callback(method_frame)
+
+    def _on_unblocked(self, method_frame):
+        if not self.is_open:
+            return
+        if self._blocked_timer is not None:
+            self.remove_timeout(self._blocked_timer)
+            self._blocked_timer = None
+        # 先发出阻塞期间缓冲的消息，再通知应用
+        held, self._held = self._held, []
+        for publish in held:
+            if publish.func.__self__.is_open:
+                publish()
+        for callback in self._unblocked_callbacks:
+            callback(method_frame)
+
+    def _on_blocked_connection_timeout(self):
+        self._blocked_timer = None
+        self._held = []
+        self._terminate(-2, 'Blocked connection timeout expired')
+
+    def channel(self, on_open_callback, channel_number=None):
+        self.broker.rpc('channel.open')
+        self._channel_number += 1
+        channel = MemoryAsyncChannel(self, channel_number or self._channel_number)
+        self._channels.append(channel)
+        self._schedule(on_open_callback, channel)
+        return channel
+
+    def add_timeout(self, deadline, callback_method):
+        return self.ioloop.call_later(deadline, callback_method)
+
+    def remove_timeout(self, timeout_id):
+        self.ioloop.remove_timeout(timeout_id)
+
+    def add_callback_threadsafe(self, callback):
+        self.ioloop.add_callback_threadsafe(callback)
+
+    def _notify(self):
+        # 合并多次唤醒，每轮只投递一次
+        if not self._dispatching and self.is_open:
+            self._dispatching = True
+            self._schedule(self._dispatch)
+
+    def _dispatch(self):
+        self._dispatching = False
+        if not self.is_open:
+            return
+        busy = False
+        for channel in list(self._channels):
+            busy = channel._deliver() or busy
+        if busy:
+            self._notify()
+
+    def _run_callback(self, callback, *args):
+        callback(*args)
+
+    def close(self, reply_code=200, reply_text='Normal shutdown'):
+        if not self.is_open:
+            return
+        self.broker.rpc('connection.close')
+        self._terminate(reply_code, reply_text)
+
+    def _broker_close(self, reply_code, reply_text):
+        self._schedule(self._terminate, reply_code, reply_text)
+
+    def _terminate(self, reply_code, reply_text):
+        if not self.is_open:
+            return
+        for channel in list(self._channels):
+            if channel.is_open:
+                channel._on_close(reply_code, reply_text)
+        self.is_open = False
+        for callback in self._close_callbacks:
+            self._schedule(callback, self, reply_code, reply_text)
+        if self.stop_ioloop_on_close:
+            self._schedule(self.ioloop.stop)
+
+
+class MemoryAsyncChannel(MemoryChannel):
+    # 对应pika.channel.Channel：RPC的结果通过回调返回，Broker关闭信道时调用关闭回调而不是抛出异常
+    def __init__(self, connection, channel_number):
+        super(MemoryAsyncChannel, self).__init__(connection, channel_number)
+        self._close_callbacks = []
+        self._cancel_callbacks = []
+        self._on_confirm = None
+        self._publish_tag = 0
+
+    def add_on_close_callback(self, callback):
+        self._close_callbacks.append(callback)
+
+    def add_on_cancel_callback(self, callback):
+        self._cancel_callbacks.append(callback)
+
+    def _on_close(self, reply_code, reply_text):
+        self._requeue_unacked()
+        self._forget()
+        for callback in self._close_callbacks:
+            self.connection._schedule(callback, self, reply_code, reply_text)
+
+    def _call(self, callback, method, *args, nowait=False):
+        '''执行同步版本的方法，结果交给回调；Broker关闭信道时调用关闭回调'''
+        self._check_open()
+        self._nowait = nowait
+        try:
+            result = method(self, *args)
+        except exceptions.ChannelClosed as ex:
+            self._on_close(*ex.args)
+            return None
+        finally:
+            self._nowait = False
+        if callback is not None:
+            self.connection._schedule(callback, result)
+        return result
+
+    def close(self, reply_code=0, reply_text='Normal shutdown'):
+        super(MemoryAsyncChannel, self).close(reply_code, reply_text)
+        self._on_close(reply_code, reply_text)
+
+    def confirm_delivery(self, callback=None, nowait=False):
+        super(MemoryAsyncChannel, self).confirm_delivery()
+        self._on_confirm = callback
+
+    def exchange_declare(self, callback=None, exchange=None, exchange_type='direct',
+                         passive=False, durable=False, auto_delete=False, internal=False,
+                         nowait=False, arguments=None, type=None):
+        self._call(None if nowait else callback, MemoryChannel.exchange_declare, exchange,
+                   type or exchange_type, passive, durable, auto_delete, internal, arguments,
+                   nowait=nowait)
+
+    def queue_declare(self, callback, queue='', passive=False, durable=False, exclusive=False,
+                      auto_delete=False, nowait=False, arguments=None):
+        self._call(None if nowait else callback, MemoryChannel.queue_declare, queue,
+                   passive, durable, exclusive, auto_delete, arguments, nowait=nowait)
+
+    def queue_bind(self, callback, queue, exchange, routing_key=None, nowait=False,
+                   arguments=None):
+        self._call(None if nowait else callback, MemoryChannel.queue_bind, queue,
+                   exchange, routing_key, arguments, nowait=nowait)
+
+    def basic_qos(self, callback=None, prefetch_size=0, prefetch_count=0, all_channels=False):
+        self._call(None, MemoryChannel.basic_qos, prefetch_size, prefetch_count, all_channels)
+        if callback is not None:
+            self.connection._schedule(callback, frame.Method(self.channel_number, spec.Basic.QosOk()))
+        self.connection._notify()
+
+    def basic_consume(self, consumer_callback, queue='', no_ack=False, exclusive=False,
+                      consumer_tag=None, arguments=None):
+        consumer_tag = self._call(None, MemoryChannel.basic_consume, consumer_callback, queue,
+                                  no_ack, exclusive, consumer_tag, arguments)
+        self.connection._notify()
+        return consumer_tag
+
+    def basic_cancel(self, callback=None, consumer_tag='', nowait=False):
+        super(MemoryAsyncChannel, self).basic_cancel(consumer_tag)
+        if callback is not None and not nowait:
+            self.connection._schedule(callback, frame.Method(self.channel_number,
+                                                             spec.Basic.CancelOk(consumer_tag)))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None,
+                      mandatory=False, immediate=False):
+        self._check_open()
+        if self.broker.blocked is not None or self.connection._held:
+            # 帧留在输出缓冲区，解除阻塞后按顺序发出
+            self.connection._held.append(functools.partial(self.basic_publish, exchange, routing_key,
+                                                           body, properties))
+            return
+        try:
+            accepted = self._publish(exchange, routing_key, body, properties)
+        except exceptions.ChannelClosed as ex:
+            self._on_close(*ex.args)
+            return
+        if self._confirm:
+            self._publish_tag += 1
+            self.broker.frame('confirm.ack' if accepted else 'confirm.nack')
+            method = spec.Basic.Ack if accepted else spec.Basic.Nack
+            if self._on_confirm is not None:
+                self.connection._schedule(self._on_confirm,
+                                          frame.Method(self.channel_number,
+                                                       method(delivery_tag=self._publish_tag)))
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._call(None, MemoryChannel.basic_ack, delivery_tag, multiple)
+        self.connection._notify()
+
+    def basic_nack(self, delivery_tag=None, multiple=False, requeue=True):
+        self._call(None, MemoryChannel.basic_nack, delivery_tag, multiple, requeue)
+        self.connection._notify()
@@ -0,0 +1,96 @@
+'''自适应prefetch
+根据消息处理耗时估算处理能力，按照Little定律计算让消息在本地的停留时间接近目标值的prefetch_count
+'''
+
+import math
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptivePrefetch(object):
+    # record可以在工作线程中调用，update在连接线程中调用
+    def __init__(self, prefetch=1, min_prefetch=1, max_prefetch=100, target_time=1.0,
+                 workers=1, interval=1.0, alpha=0.2, clock=time.monotonic):
+        '''
+        :param prefetch: 初始prefetch_count
+        :param min_prefetch: prefetch_count下限
+        :param max_prefetch: prefetch_count上限
+        :param target_time: 消息从投递到确认的目标时间（秒）
+        :param workers: 同时处理消息的线程数
+        :param interval: 两次调整之间的最短时间（秒）
+        :param alpha: 处理耗时指数平均的权重
+        :param clock: 时钟函数，模拟测试时可以替换
+        '''
+        self.prefetch = prefetch
+        self.min_prefetch = min_prefetch
+        self.max_prefetch = max_prefetch
+        self.target_time = target_time
+        self.workers = workers
+        self.interval = interval
+        self.alpha = alpha
+        self.clock = clock
+        self.latency = None
+        self.ack_rate = 0.0
+        self.decisions = deque(maxlen=100)
+        self._acks = 0
+        self._last_update = clock()
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        '''记录一条消息的处理耗时
+        :param latency: 处理耗时（秒）
+        '''
+        with self._lock:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.alpha * (latency - self.latency)
+            self._acks += 1
+
+    def desired(self):
+        '''按Little定律计算prefetch：停留时间 = prefetch / 处理速度，处理速度 = workers / 处理耗时
+        :return: 限制在上下限之间、且不少于工作线程数的prefetch_count
+        '''
+        if not self.latency:
+            return self.prefetch
+        prefetch = math.ceil(self.target_time * self.workers / self.latency)
+        return max(self.min_prefetch, self.workers, min(self.max_prefetch, prefetch))
+
+    def update(self):
+        '''距离上次调整超过interval时重新计算prefetch
+        :return: 需要调整时返回新的prefetch_count，否则None
+        '''
+        now = self.clock()
+        elapsed = now - self._last_update
+        if elapsed < self.interval:
+            return None
+        with self._lock:
+            acks, self._acks = self._acks, 0
+        self._last_update = now
+        self.ack_rate = acks / elapsed
+        prefetch = self.desired()
+        # 变化小于10%时不调整，避免频繁发送Basic.Qos
+        if abs(prefetch - self.prefetch) < max(1, self.prefetch * 0.1):
+            return None
+        self.decisions.append({'time': now,
+                               'from': self.prefetch,
+                               'to': prefetch,
+                               'latency': self.latency,
+                               'ack_rate': self.ack_rate})
+        logger.info('prefetch_count调整: %i -> %i, 处理耗时: %.3fs, 确认速度: %.1f条/秒',
+                    self.prefetch, prefetch, self.latency, self.ack_rate)
+        self.prefetch = prefetch
+        return prefetch
+
+    def snapshot(self):
+        '''当前状态，用于监控
+        :return: dict
+        '''
+        return {'prefetch': self.prefetch,
+                'latency': self.latency,
+                'ack_rate': self.ack_rate,
+                'adjustments': len(self.decisions)}
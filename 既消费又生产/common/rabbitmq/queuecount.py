@@ -2,59 +2,171 @@
 # -*- coding: utf-8 -*-
 # @Time    : 18-1-10 下午1:37
 # @Author  : 哎哟卧槽
-# @Site    : 
+# @Site    :
 # @File    : queuecount.py
 # @Software: PyCharm
 
 
+import math
 import time
-import threading
 import logging
+import threading
+from collections import deque, namedtuple
+from pika.exceptions import ChannelClosed
 
-logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
 count_time = 5
 
+# 一次采样：采样时间、队列中的消息数、消费者数、累计消费数（没有消费计数时为None）
+Sample = namedtuple('Sample', ['time', 'messages', 'consumers', 'consumed'])
+
 
-class MessagesCount(threading.Thread):
+class QueueMonitor(object):
     """
-    MQ的心跳线程
+    队列深度监控
+    在连接线程中用connection.add_timeout定时采样，所有队列共用一个信道，
+    采样结果保存在滚动窗口中，可以在其他线程读取
     """
-    def __init__(self, connection):
+    def __init__(self, connection, queues=(), interval=count_time, window=60):
         """
         :param connection: RabbitMQ的连接对象
+        :param queues: 需要监控的队列名
+        :param interval: 采样间隔（秒）
+        :param window: 每个队列保留的采样数
         """
-        super(MessagesCount, self).__init__()
-        self.lock = threading.Lock()
         self.connection = connection
-        self.quit_flag = False
-        self.stop_flag = True
-        self.setDaemon(True)
-
-    def run(self):
-        logger.warning("消息总数线程准备完毕")
-        while not self.quit_flag:
-            time.sleep(count_time)
-            self.lock.acquire()
-            if self.stop_flag:
-                self.lock.release()
-                continue
+        self.interval = interval
+        self.window = window
+        self._channel = None
+        self._timer = None
+        self._series = {}
+        self._counters = {}
+        self._missing = set()
+        self._lock = threading.Lock()
+        for queue in queues:
+            self.watch(queue)
+
+    def watch(self, queue, consumed=None):
+        """添加监控的队列
+        :param queue: 队列名
+        :param consumed: 无参可调用对象，返回该队列累计消费的消息数，用于区分入队和出队速度，
+                         如lambda: sum(supervisor.processed)
+        :return:
+        """
+        with self._lock:
+            self._series.setdefault(queue, deque(maxlen=self.window))
+            if consumed is not None:
+                self._counters[queue] = consumed
+
+    def start(self):
+        """开始采样，需要在连接线程中调用（如start_consuming之前）
+        :return:
+        """
+        if self._timer is None:
+            self._timer = self.connection.add_timeout(0, self._poll)
+
+    def stop(self):
+        """停止采样并关闭信道，需要在连接线程中调用
+        :return:
+        """
+        if self._timer is not None:
+            self.connection.remove_timeout(self._timer)
+            self._timer = None
+        if self._channel is not None and self._channel.is_open:
+            self._channel.close()
+        self._channel = None
+
+    def _poll(self):
+        with self._lock:
+            queues = list(self._series)
+        for queue in queues:
+            if not self.connection.is_open:
+                return
+            if self._channel is None or not self._channel.is_open:
+                self._channel = self.connection.channel()
             try:
-                logger.warning(f"获取消息总数,间隔时间为:{count_time}s")
-                channel = self.connection.channel()
-                messages = channel.queue_declare(queue="task_root_queue",
-                                                 passive=True)
-                print(messages)
-            except Exception as ex:
-                self.lock.release()
-                raise RuntimeError("错误格式: %s" % (str(ex)))
-            self.lock.release()
-
-    def start_count(self):
-        self.lock.acquire()
-        if self.quit_flag:
-            self.lock.release()
-            return
-        self.stop_flag = False
-        self.lock.release()
\ No newline at end of file
+                result = self._channel.queue_declare(queue=queue, passive=True)
+            except ChannelClosed as ex:
+                # 队列不存在时Broker会关闭信道，下一个队列重新打开；同一个队列只输出一次警告
+                if queue not in self._missing:
+                    self._missing.add(queue)
+                    logger.warning('获取队列%s消息数失败: %s', queue, ex)
+                self._channel = None
+                continue
+            self._missing.discard(queue)
+            counter = self._counters.get(queue)
+            sample = Sample(time.monotonic(), result.method.message_count,
+                            result.method.consumer_count,
+                            counter() if counter is not None else None)
+            with self._lock:
+                self._series[queue].append(sample)
+        self._timer = self.connection.add_timeout(self.interval, self._poll)
+
+    def series(self, queue):
+        """
+        :param queue: 队列名
+        :return: 采样列表，按时间从早到晚
+        """
+        with self._lock:
+            return list(self._series.get(queue, ()))
+
+    def latest(self, queue):
+        """
+        :param queue: 队列名
+        :return: 最近一次采样，没有采样时为None
+        """
+        with self._lock:
+            series = self._series.get(queue)
+            return series[-1] if series else None
+
+    def rates(self, queue, span=None):
+        """根据滚动窗口计算速度
+        net为队列消息数的变化速度；有消费计数时egress为出队速度，ingress = net + egress
+        :param queue: 队列名
+        :param span: 只使用最近span秒内的采样，为空时使用整个窗口
+        :return: dict(messages, consumers, net, ingress, egress)，采样不足两次时为None
+        """
+        series = self.series(queue)
+        if span is not None and series:
+            series = [sample for sample in series if sample.time >= series[-1].time - span]
+        if len(series) < 2:
+            return None
+        first, last = series[0], series[-1]
+        elapsed = last.time - first.time
+        if elapsed <= 0:
+            return None
+        net = (last.messages - first.messages) / elapsed
+        egress = ingress = None
+        if first.consumed is not None and last.consumed is not None:
+            egress = (last.consumed - first.consumed) / elapsed
+            ingress = net + egress
+        return {'messages': last.messages,
+                'consumers': last.consumers,
+                'net': net,
+                'ingress': ingress,
+                'egress': egress}
+
+    def suggest_workers(self, queue, target_time=60.0, per_worker_rate=None,
+                        min_workers=1, max_workers=None):
+        """估算需要的工作进程数：处理新入队的消息，并在target_time秒内消化积压
+        :param queue: 队列名
+        :param target_time: 消化当前积压的目标时间（秒）
+        :param per_worker_rate: 单个工作进程的处理速度（条/秒），为空时用出队速度除以消费者数估算
+        :param min_workers: 工作进程数下限
+        :param max_workers: 工作进程数上限，为空时不限制
+        :return: 建议的工作进程数，数据不足时为None
+        """
+        rates = self.rates(queue)
+        if rates is None:
+            return None
+        if per_worker_rate is None:
+            if not rates['egress'] or not rates['consumers']:
+                return None
+            per_worker_rate = rates['egress'] / rates['consumers']
+        ingress = rates['ingress'] if rates['ingress'] is not None else max(rates['net'], 0.0)
+        demand = max(ingress, 0.0) + rates['messages'] / target_time
+        workers = max(min_workers, int(math.ceil(demand / per_worker_rate)))
+        if max_workers is not None:
+            workers = min(max_workers, workers)
+        return workers
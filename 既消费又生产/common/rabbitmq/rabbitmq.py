@@ -1,10 +1,35 @@
 '''RabbitMQ消息队列'''
 
+import json
+import time
 import pika
+import logging
+import functools
+import threading
 from abc import ABCMeta, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from pika import credentials
+from pika.exceptions import AMQPError, AMQPConnectionError
 from common.rabbitmq.rabbitmqheartbeat import RabbitMQHeartbeat
-from common.rabbitmq.queuecount import MessagesCount
+from common.rabbitmq.ackbatcher import AckBatcher
+from common.rabbitmq.codec import Codec, CodecError
+from common.rabbitmq.prefetch import AdaptivePrefetch
+from common.rabbitmq.queuecount import QueueMonitor
+from common.rabbitmq.topology import declared, declare_pipelined
+from common.rabbitmq.reconnect import ReconnectPolicy
+from common.rabbitmq.spill import SpillBuffer
+from common.rabbitmq.flowcontrol import flow_control
+from common.rabbitmq.dedup import DedupCache
+from common.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# pika只在process_data_events中分发Connection.Blocked/Unblocked，不等待确认的发布最多每隔这么久检查一次（秒）
+FLOW_CHECK_INTERVAL = 0.05
+# 回调抛出CodecError时handle的返回值，消息无法解码，拒绝且不重新入队
+_REJECT = object()
 
 
 class IMessageConnection(metaclass=ABCMeta):
@@ -16,6 +41,13 @@ class IMessageConnection(metaclass=ABCMeta):
         '''
         return
 
+    @abstractmethod
+    def release(self, connection):
+        '''归还get_connection获取的连接
+        :param connection: 连接实例
+        '''
+        return
+
 
 class IMessageCallBack(metaclass=ABCMeta):
     # 消息回调接口类，所有需要使用到消息回调的类都需要继承该类，并实现callback方法，否则无法完成消息回调
@@ -59,20 +91,161 @@ class ConnectionFactory(object):
         if 'RabbitMQConnection' == class_name:
             return RabbitMQConnection(connect_params)
 
+    @staticmethod
+    def close_all():
+        '''关闭所有连接池中的空闲连接
+        :return:None
+        '''
+        RabbitMQConnectionPool.close_all()
+
 
-class RabbitMQConnection(IMessageConnection):
-    def __new__(cls, connect_params):
-        if not hasattr(cls, '_inst'):
-            cls._inst = super(RabbitMQConnection, cls).__new__(cls)
-        return cls._inst
+class ConnectionPoolTimeout(AMQPConnectionError):
+
+    def __str__(self):
+        return '等待可用连接超时！'
+
+
+class PublishBlockedTimeout(AMQPError):
+
+    def __str__(self):
+        return '连接被Broker流控阻塞，等待解除超时！'
+
+
+class RabbitMQConnectionPool(object):
+    # 连接池：按连接参数划分，连接被独占借出，归还后复用；借出时做健康检查，失效的连接被丢弃并在需要时重新建立
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, connect, min_size=0, max_size=10):
+        '''
+        :param connect: 建立新连接的函数
+        :param min_size: 预先建立的连接数
+        :param max_size: 最多同时存在的连接数
+        '''
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self._idle = deque()
+        self._size = 0
+        self._cond = threading.Condition()
+
+    @classmethod
+    def get_pool(cls, connect_params, connect):
+        '''获取connect_params对应的连接池，不存在时创建并预热
+        :param connect_params: 连接参数，pool_min_size、pool_max_size控制连接池大小
+        :param connect: 建立新连接的函数
+        :return: RabbitMQConnectionPool
+        '''
+        key = json.dumps(connect_params, sort_keys=True)
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                pool = cls._pools[key] = cls(connect,
+                                             min_size=connect_params.get('pool_min_size', 0),
+                                             max_size=connect_params.get('pool_max_size', 10))
+                pool.prewarm()
+        return pool
+
+    @classmethod
+    def close_all(cls):
+        with cls._pools_lock:
+            pools = list(cls._pools.values())
+            cls._pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def prewarm(self):
+        '''并发建立min_size个连接，握手耗时不再叠加
+        :return:None
+        '''
+        with self._cond:
+            missing = self.min_size - self._size
+            self._size += max(missing, 0)
+        if missing <= 0:
+            return
+        with ThreadPoolExecutor(max_workers=missing) as executor:
+            futures = [executor.submit(self._connect) for _ in range(missing)]
+        for future in futures:
+            with self._cond:
+                if future.exception() is None:
+                    self._idle.append(future.result())
+                else:
+                    self._size -= 1
+                self._cond.notify()
+
+    @staticmethod
+    def _healthy(connection):
+        '''健康检查：连接打开并且能正常处理事件'''
+        if not connection.is_open:
+            return False
+        try:
+            connection.process_data_events()
+        except AMQPError:
+            return False
+        return connection.is_open
+
+    def checkout(self, timeout=None):
+        '''借出一个连接，没有空闲连接且已达到max_size时等待归还
+        :param timeout: 等待时间（秒），None表示一直等待
+        :return: 连接
+        '''
+        with self._cond:
+            while True:
+                while self._idle:
+                    connection = self._idle.pop()
+                    if self._healthy(connection):
+                        return connection
+                    self._size -= 1
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                if not self._cond.wait(timeout):
+                    raise ConnectionPoolTimeout()
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def checkin(self, connection):
+        '''归还连接，已关闭的连接直接丢弃
+        :param connection: checkout借出的连接
+        :return:None
+        '''
+        with self._cond:
+            if connection.is_open:
+                self._idle.append(connection)
+            else:
+                self._size -= 1
+            self._cond.notify()
+
+    def close(self):
+        '''关闭所有空闲连接
+        :return:None
+        '''
+        with self._cond:
+            while self._idle:
+                connection = self._idle.pop()
+                self._size -= 1
+                if connection.is_open:
+                    connection.close()
 
+
+class RabbitMQConnection(IMessageConnection):
     def __init__(self, connect_params):
         self.params = connect_params
-        self.connection = None
+        self.pool = None
 
     def get_connection(self):
-        self.connection = self.connect()
-        return self.connection
+        '''从连接池借出连接，用完后调用release归还'''
+        if self.pool is None:
+            self.pool = RabbitMQConnectionPool.get_pool(self.params, self.connect)
+        return self.pool.checkout()
+
+    def release(self, connection):
+        self.pool.checkin(connection)
 
     def _credentials(self, username, password):
         '''返回一个plain credentials对象
@@ -82,7 +255,10 @@ class RabbitMQConnection(IMessageConnection):
         '''
         return credentials.PlainCredentials(username, password)
 
-    def connect(self):
+    def parameters(self):
+        '''根据配置生成pika的连接参数
+        :return:pika.ConnectionParameters
+        '''
         username = self.params.get('username')
         password = self.params.get('password')
         if '' == username:
@@ -104,11 +280,21 @@ class RabbitMQConnection(IMessageConnection):
                                                    retry_delay=self.params.get('retry_delay'),
                                                    socket_timeout=self.params.get('socket_timeout'),
                                                    locale=self.params.get('locale'),
-                                                   backpressure_detection=self.params.get('backpressure_detection')
+                                                   backpressure_detection=self.params.get('backpressure_detection'),
+                                                   blocked_connection_timeout=self.params.get('blocked_connection_timeout')
                                                    )
+        return connect_params
 
-        if not self.connection:
-            return pika.BlockingConnection(connect_params)
+    def connect(self):
+        '''建立一个新的连接，一般通过连接池调用
+        :return:pika.BlockingConnection，连接参数transport为memory时返回进程内Broker的MemoryConnection
+        '''
+        if 'memory' == self.params.get('transport'):
+            from common.rabbitmq.memory import MemoryConnection, get_broker
+            return MemoryConnection(get_broker(self.params.get('memory_broker', 'default')),
+                                    heartbeat=self.params.get('heartbeat_interval') or 0,
+                                    blocked_connection_timeout=self.params.get('blocked_connection_timeout'))
+        return pika.BlockingConnection(self.parameters())
 
 
 class MessageHandlerFactory(object):
@@ -123,67 +309,513 @@ class MessageHandlerFactory(object):
         '''
         if 'RabbitMQ' == class_name:
             return RabbitMQMessageHandler(connect_params, message_params)
+        if 'AsyncRabbitMQ' == class_name:
+            # 延迟导入，asyncrabbitmq依赖本模块的接口类
+            from common.rabbitmq.asyncrabbitmq import AsyncRabbitMQMessageHandler
+            return AsyncRabbitMQMessageHandler(connect_params, message_params)
+
+
+class ChannelPool(object):
+    # 信道池：在同一个连接上复用长期打开的信道，避免每条消息都要Channel.Open/Channel.Close
+    def __init__(self, connection, size=1, confirm_delivery=False):
+        '''
+        :param connection: RabbitMQ的连接对象
+        :param size: 最多保留的空闲信道数
+        :param confirm_delivery: 新信道是否开启发布确认
+        '''
+        self.connection = connection
+        self.size = size
+        self.confirm_delivery = confirm_delivery
+        self._idle = deque()
+
+    def _open(self):
+        channel = self.connection.channel()
+        if self.confirm_delivery:
+            channel.confirm_delivery()
+        return channel
+
+    def acquire(self):
+        '''取出一个可用的信道，已被关闭的信道直接丢弃，需要时再重新打开
+        :return: 信道
+        '''
+        while self._idle:
+            channel = self._idle.pop()
+            if channel.is_open:
+                return channel
+        return self._open()
+
+    def release(self, channel):
+        '''归还信道，超出size的信道会被关闭
+        :param channel: acquire取出的信道
+        :return:
+        '''
+        if not channel.is_open:
+            return
+        if len(self._idle) < self.size:
+            self._idle.append(channel)
+        else:
+            channel.close()
+
+    @contextmanager
+    def channel(self):
+        channel = self.acquire()
+        try:
+            yield channel
+        finally:
+            self.release(channel)
+
+    def close(self):
+        '''关闭池内所有信道
+        :return:
+        '''
+        while self._idle:
+            channel = self._idle.pop()
+            if channel.is_open:
+                channel.close()
 
 
 class RabbitMQMessageHandler(IMessageHandler):
     # RabbitMQ消息处理程序实现
-    def __init__(self, connect_params, message_params):
+    # 阻塞连接不是线程安全的：publish_message、drain_spill可以在多个工作线程中调用，在锁内串行执行；
+    # 消费的handler的连接由连接线程使用，回调中要通过另一个handler（另一个连接）发布；
+    # 只发布的handler第一次发布后由后台线程定时处理帧收发心跳，连接仍被断开时从连接池换一个连接重发
+    def __init__(self, connect_params, message_params, connection=None):
         '''初始化函数，需要传入消费的配置参数
         :param connect_params:消费的配置参数
         :param message_params:None
+        :param connection:已经建立好的连接，为空时根据connect_params创建
         '''
         self.params = message_params
+        self.codec = Codec.from_params(message_params)
         self.channel = None
-        self.connection = ConnectionFactory.get_instance('RabbitMQConnection', connect_params).get_connection()
+        self.consumer_channel = None
+        self.adaptive_prefetch = None
+        self.queue_monitor = None
+        exchange_labels = {'exchange': self.params.get('exchange')}
+        queue_labels = {'queue': self.params.get('task_queue')}
+        self._published = REGISTRY.counter('rabbitmq_published_total', '发布的消息数', exchange_labels)
+        self._publish_nacks = REGISTRY.counter('rabbitmq_publish_nacks_total',
+                                               'Broker拒绝的消息数', exchange_labels)
+        self._publish_seconds = REGISTRY.histogram('rabbitmq_publish_seconds',
+                                                   '发布耗时（秒）', exchange_labels)
+        self._handler_seconds = REGISTRY.histogram('rabbitmq_handler_seconds',
+                                                   '消息处理耗时（秒）', queue_labels)
+        self._acks = REGISTRY.counter('rabbitmq_acks_total', '确认的消息数', queue_labels)
+        self._nacks = REGISTRY.counter('rabbitmq_nacks_total', '拒绝的消息数', queue_labels)
+        self._requeued = REGISTRY.counter('rabbitmq_requeued_total', '重新入队的消息数', queue_labels)
+        self._inflight = REGISTRY.gauge('rabbitmq_inflight_messages', '处理中的消息数', queue_labels)
+        # 处理成功过的消息再次投递时直接确认
+        self.dedup = None
+        if self.params.get('dedup'):
+            self.dedup = DedupCache.from_params(self.params.get('dedup'), queue_labels)
+        # Broker不可用时待发布的消息写入spill，连接恢复后按顺序重新发布
+        self.spill = None
+        spill_params = self.params.get('spill')
+        if spill_params:
+            self.spill = SpillBuffer(spill_params.get('path', './spill'),
+                                     capacity=spill_params.get('capacity', 10000),
+                                     segment_size=spill_params.get('segment_size', 16 * 1024 * 1024),
+                                     rate=spill_params.get('rate'),
+                                     burst=spill_params.get('burst', 0.1),
+                                     fsync=spill_params.get('fsync', False))
+            self._spill_gauge = REGISTRY.gauge('rabbitmq_spill_messages', '等待重新发布的消息数', exchange_labels)
+            self._spill_length = self.spill.__len__
+            self._spill_gauge.set_function(self._spill_length)
+        self.reconnect_policy = ReconnectPolicy()
+        # 串行化工作线程中的发布，drain_spill在publish_message中调用，使用可重入锁
+        self._publish_lock = threading.RLock()
+        # 只发布的连接由后台线程定时处理帧，收发心跳
+        self._heartbeat = (connect_params or {}).get('heartbeat_interval') or 0
+        self._keepalive = None
+        self._keepalive_stop = threading.Event()
+        self._retry_at = None
+        self._flow_labels = exchange_labels
+        self._flow_checked = 0.0
+        # 开启发布确认时每次发布都要等待一次往返，检查一次流控的开销可以忽略
+        self._flow_interval = 0 if self.params.get('confirm_delivery') else FLOW_CHECK_INTERVAL
+        self.connector = None
+        if connection is None:
+            self.connector = ConnectionFactory.get_instance('RabbitMQConnection', connect_params)
+            connection = self.connector.get_connection()
+        self.connection = connection
+        self.flow = flow_control(connection, exchange_labels)
+        self.channel_pool = None
+        if 'pool' == self.params.get('publish_mode'):
+            self.channel_pool = ChannelPool(self.connection,
+                                            size=self.params.get('channel_pool_size', 1),
+                                            confirm_delivery=self.params.get('confirm_delivery', False))
 
     def start_consuming(self, callback):
         '''启动消费，消息的类型根据初始化传入的配置参数来决定启动哪种消费模式
         :param callback:回调函数
         :return:None
         '''
-        heartbeat = RabbitMQHeartbeat(self.connection)
-        heartbeat.start()
-        heartbeat.start_heartbeat()
+        # 消费时由连接线程处理帧
+        self._stop_keepalive()
         self.on_bind()
         self._consuming_queues(callback)
 
+    def stop_consuming(self):
+        '''停止消费，可以在其他线程或信号处理函数中调用
+        正在处理的消息完成后start_consuming返回，尚未投递给回调的消息会被退回队列
+        :return:None
+        '''
+        if self.consumer_channel is not None:
+            self.connection.add_callback_threadsafe(self.consumer_channel.stop_consuming)
+
+    def monitor_queues(self, queues=None, interval=5.0, window=60):
+        '''监控队列深度，采样在连接线程中进行，需要在start_consuming之前调用
+        :param queues: 队列名列表，为空时监控task_queue和publish_data_queue
+        :param interval: 采样间隔（秒）
+        :param window: 每个队列保留的采样数
+        :return: QueueMonitor
+        '''
+        if queues is None:
+            queues = [self.params.get('task_queue')] + list(self.params.get('publish_data_queue') or ())
+        self.queue_monitor = QueueMonitor(self.connection, queues, interval, window)
+        self.queue_monitor.start()
+        return self.queue_monitor
+
     def publish_message(self, data):
         '''
         发布消息，消息的类型根据初始化传入的配置参数来决定发送那种消息
-        :param callback:回调函数的实例
-        :return:None
+        可以在多个线程中调用，同一时间只有一个线程使用连接；不能在消费这个handler的回调中调用
+        :param data:bytes或str原样发送，其他对象用codec编码
+        :return:开启发布确认时返回Broker是否确认，否则为True；
+                配置了spill时，Broker不可用、连接被流控阻塞或者还有积压的消息时写入spill，返回None
+        '''
+        with self._publish_lock:
+            if self.consumer_channel is None:
+                self._start_keepalive()
+            if self.spill is None:
+                if not self.connection.is_open and self.connector is not None:
+                    self._reopen()
+                try:
+                    # 连接被流控阻塞时调用方在这里等待，而不是阻塞在写满的socket上
+                    self._wait_unblocked()
+                    return self._publish_queues(data)
+                except AMQPConnectionError as ex:
+                    if self.connector is None:
+                        raise
+                    # 连接已被Broker断开（如漏掉心跳），从连接池换一个连接重发一次
+                    logger.warning('发布失败: %r，重新连接后重发', ex)
+                    self._reopen()
+                    self._wait_unblocked()
+                    return self._publish_queues(data)
+            content_type = content_encoding = None
+            if not isinstance(data, (bytes, str)):
+                data, content_type, content_encoding = self.codec.encode(data)
+            try:
+                if len(self.spill):
+                    self.drain_spill()
+                # 先发布积压的消息，新消息排在后面，保持发布顺序
+                if len(self.spill) or not self._available() or self._blocked():
+                    self.spill.put(data, content_type, content_encoding)
+                    return None
+                return self._publish_queues(data, content_type, content_encoding)
+            except AMQPError as ex:
+                self._lost_connection(ex)
+                self.spill.put(data, content_type, content_encoding)
+                return None
+
+    def drain_spill(self, limit=None):
+        '''按spill的rate重新发布积压的消息，连接不可用时不发送
+        未开启confirm_delivery时basic_publish不等待Broker确认，连接断开前已发送的消息可能丢失
+        :param limit:最多发布的消息数，为空时由rate决定
+        :return:发布成功的消息数
         '''
-        self._publish_queues(data)
+        with self._publish_lock:
+            if self.spill is None or not len(self.spill) or not self._available():
+                return 0
+            try:
+                if self._blocked():
+                    return 0
+            except AMQPError as ex:
+                self._lost_connection(ex)
+                return 0
+            budget = self.spill.budget() if limit is None else limit
+            sent = 0
+            while sent < budget and not self.flow.blocked:
+                record = self.spill.pop()
+                if record is None:
+                    break
+                try:
+                    result = self._publish_queues(*record)
+                except AMQPError as ex:
+                    self.spill.unget([record])
+                    self._lost_connection(ex)
+                    break
+                if result is False:
+                    # Broker拒绝（如队列已满），放回去稍后重试
+                    self.spill.unget([record])
+                    break
+                sent += 1
+            return sent
+
+    def _start_keepalive(self):
+        # 只发布的连接只有在publish_message时才处理帧，两次发布间隔超过两个心跳间隔会被Broker断开
+        if self._keepalive is not None or not self._heartbeat:
+            return
+        self._keepalive_stop.clear()
+        self._keepalive = threading.Thread(target=self._keep_alive, name='rabbitmq-keepalive', daemon=True)
+        self._keepalive.start()
+
+    def _keep_alive(self):
+        # 每半个心跳间隔在发布锁内处理一次帧，与发布串行执行
+        while not self._keepalive_stop.wait(self._heartbeat / 2.0):
+            with self._publish_lock:
+                if self._keepalive_stop.is_set() or self.consumer_channel is not None \
+                        or not self.connection.is_open:
+                    continue
+                try:
+                    self.connection.process_data_events(0)
+                except AMQPError as ex:
+                    logger.warning('发布连接处理帧失败: %r，下次发布时重新连接', ex)
+
+    def _stop_keepalive(self):
+        if self._keepalive is None:
+            return
+        self._keepalive_stop.set()
+        self._keepalive.join()
+        self._keepalive = None
+
+    def _blocked(self):
+        '''发布前检查连接是否被流控阻塞
+        消费时start_consuming会分发连接事件，这里不再调用process_data_events，避免在回调中重入
+        :return: bool
+        '''
+        now = time.monotonic()
+        if self.consumer_channel is None and now - self._flow_checked >= self._flow_interval:
+            self._flow_checked = now
+            self.connection.process_data_events(0)
+        return self.flow.blocked
+
+    def _wait_unblocked(self):
+        '''等待连接解除阻塞，超过blocked_publish_timeout秒抛出PublishBlockedTimeout，为空时一直等待
+        :return:
+        '''
+        if not self._blocked():
+            return
+        timeout = self.params.get('blocked_publish_timeout')
+        deadline = None if timeout is None else time.monotonic() + timeout
+        logger.warning('连接被流控阻塞（%s），发布等待解除', self.flow.reason)
+        while self.flow.blocked:
+            remaining = 1.0 if deadline is None else min(1.0, deadline - time.monotonic())
+            if remaining <= 0:
+                raise PublishBlockedTimeout()
+            if self.consumer_channel is None:
+                self.connection.process_data_events(remaining)
+            else:
+                self.flow.wait(remaining)
+
+    def _lost_connection(self, ex):
+        # 发布失败，按退避时间等待后再重建连接
+        delay = self.reconnect_policy.next_delay()
+        self._retry_at = time.monotonic() + delay
+        logger.warning('发布失败: %r，%.1f秒后重连，消息写入spill（%i条）', ex, delay, len(self.spill))
+
+    def _available(self):
+        # 连接是否可用于发布，到了重连时间时重建连接
+        if self._retry_at is None:
+            return True
+        if time.monotonic() < self._retry_at:
+            return False
+        try:
+            self._reopen()
+        except AMQPError as ex:
+            self._lost_connection(ex)
+            return False
+        self._retry_at = None
+        self.reconnect_policy.reset()
+        logger.info('连接已恢复，重新发布spill中的%i条消息', len(self.spill))
+        return True
+
+    def _reopen(self):
+        # 从连接池取一个新连接替换断开的连接，外部传入的连接只能等它恢复
+        if self.connector is None:
+            if not self.connection.is_open:
+                raise AMQPConnectionError('Connection is closed')
+            return
+        connection = self.connector.get_connection()
+        self.connector.release(self.connection)
+        self.connection = connection
+        self.flow = flow_control(connection, self._flow_labels)
+        # 旧连接上的信道已经不可用
+        self.channel = None
+        if self.channel_pool is not None:
+            self.channel_pool = ChannelPool(self.connection,
+                                            size=self.params.get('channel_pool_size', 1),
+                                            confirm_delivery=self.params.get('confirm_delivery', False))
 
-    def _publish_queues(self, data):
+    def _publish_queues(self, data, content_type=None, content_encoding=None):
         # 竞争消费者模式： 发布
-        channel = self._get_channel()
+        if self.channel_pool is not None:
+            with self.channel_pool.channel() as channel:
+                return self._basic_publish(channel, data, content_type, content_encoding)
+        channel = self.connection.channel()
+        try:
+            return self._basic_publish(channel, data, content_type, content_encoding)
+        finally:
+            if channel.is_open:
+                channel.close()
+
+    def _basic_publish(self, channel, data, content_type=None, content_encoding=None):
         routing_key = self.params.get('routing_key')
         delivery_mode = self.params.get("delivery_mode")
-        self.channel.basic_publish(exchange=self.params.get("exchange"),
-                                   routing_key=routing_key,
-                                   body=data,
-                                   properties=pika.BasicProperties(
-                                       delivery_mode=delivery_mode)
-                                   )
-        channel.close()
+        # 已经序列化好的消息原样发送
+        if not isinstance(data, (bytes, str)):
+            data, content_type, content_encoding = self.codec.encode(data)
+        started = time.perf_counter()
+        result = channel.basic_publish(exchange=self.params.get("exchange"),
+                                       routing_key=routing_key,
+                                       body=data,
+                                       properties=pika.BasicProperties(
+                                           delivery_mode=delivery_mode,
+                                           content_type=content_type,
+                                           content_encoding=content_encoding)
+                                       )
+        # 开启发布确认时basic_publish会等待Broker确认，耗时包含确认时间
+        self._publish_seconds.observe(time.perf_counter() - started)
+        if result is False:
+            self._publish_nacks.inc()
+        else:
+            self._published.inc()
+        return result
+
+    def decode(self, properties, body):
+        '''按消息属性解码消息体
+        :param properties: pika.BasicProperties
+        :param body: 消息体
+        :return: 反序列化后的对象，无法解码时抛出CodecError
+        '''
+        return self.codec.decode_message(properties, body)
 
     def _consuming_queues(self, callback_obj=None):
         # 竞争消费模式
-        channel = self._get_channel()
+        if self.consumer_channel is not None and self.consumer_channel.is_open:
+            self.consumer_channel.close()
+        channel = self.consumer_channel = self.connection.channel()
         queue_name = self.params.get('task_queue')
         durable = self.params.get('durable')
         prefetch_count = self.params.get('prefetch_count')
-        channel.queue_declare(queue=queue_name, durable=durable)
+        # task_queue同时是publish_data_queue时，on_bind已经声明过
+        declare_pipelined(channel, declared(self.connection), queues=[(queue_name, durable)])
+
+        # 回调在工作线程中执行，连接线程继续处理心跳，回调中不能操作ch
+        heartbeat = RabbitMQHeartbeat(self.connection, workers=prefetch_count or 1)
+        batcher = None
+        if self.params.get('ack_batch_size'):
+            # 批量确认，处理失败的消息会被basic_nack
+            batcher = AckBatcher(channel, self.connection.add_timeout, self.connection.remove_timeout,
+                                 max_batch=self.params.get('ack_batch_size'),
+                                 max_delay=self.params.get('ack_batch_delay_ms', 50) / 1000.0,
+                                 requeue=self.params.get('ack_batch_requeue', True))
+
+        def on_done(ch, delivery_tag, success):
+            self._inflight.dec()
+            if success is _REJECT:
+                # 重新投递也无法解码，队列配置了死信交换机时转入死信队列
+                self._nacks.inc()
+                if batcher is not None:
+                    batcher.nack(delivery_tag, requeue=False)
+                elif ch.is_open:
+                    ch.basic_nack(delivery_tag=delivery_tag, requeue=False)
+            elif batcher is not None:
+                if success:
+                    self._acks.inc()
+                    batcher.ack(delivery_tag)
+                else:
+                    self._nacks.inc()
+                    if batcher.requeue:
+                        self._requeued.inc()
+                    batcher.nack(delivery_tag)
+            elif success:
+                if ch.is_open:
+                    self._acks.inc()
+                    ch.basic_ack(delivery_tag=delivery_tag)
+            else:
+                # 处理失败（包括回调抛出异常）的消息退回队列，不能一直不确认占着prefetch
+                self._nacks.inc()
+                if ch.is_open:
+                    self._requeued.inc()
+                    ch.basic_nack(delivery_tag=delivery_tag, requeue=True)
+
+        adaptive = timer = None
+        gauges = ()
+        adaptive_params = self.params.get('adaptive_prefetch')
+        if adaptive_params:
+            # prefetch_count作为工作线程数，实际的prefetch_count在min和max之间调整
+            adaptive = self.adaptive_prefetch = AdaptivePrefetch(
+                prefetch=prefetch_count or 1,
+                min_prefetch=adaptive_params.get('min', 1),
+                max_prefetch=adaptive_params.get('max', 100),
+                target_time=adaptive_params.get('target_ms', 1000) / 1000.0,
+                workers=prefetch_count or 1,
+                interval=adaptive_params.get('interval_ms', 1000) / 1000.0)
+            gauges = [(REGISTRY.gauge('rabbitmq_prefetch_count', '当前的prefetch_count', {'queue': queue_name}),
+                       lambda: adaptive.prefetch),
+                      (REGISTRY.gauge('rabbitmq_prefetch_latency_seconds', '自适应prefetch估算的处理耗时（秒）',
+                                      {'queue': queue_name}), lambda: adaptive.latency or 0.0)]
+            for gauge, function in gauges:
+                gauge.set_function(function)
+
+        def adjust_prefetch():
+            nonlocal timer
+            prefetch = adaptive.update()
+            if prefetch is not None and channel.is_open:
+                channel.basic_qos(prefetch_count=prefetch)
+            timer = self.connection.add_timeout(adaptive.interval, adjust_prefetch)
+
+        dedup = self.dedup
+
+        def handle(ch, method, properties, body):
+            key = None
+            if dedup is not None:
+                key = dedup.key(properties, body)
+                if dedup.seen(key):
+                    return True
+            started = time.perf_counter()
+            try:
+                success = callback_obj.callback(ch, method, properties, body)
+            except CodecError as e:
+                logger.error('消息无法解码，拒绝: %s', e)
+                return _REJECT
+            finally:
+                elapsed = time.perf_counter() - started
+                self._handler_seconds.observe(elapsed)
+                if adaptive is not None:
+                    adaptive.record(elapsed)
+            # 只记录处理成功的消息，失败的消息重新投递时仍然执行回调
+            if success and key is not None:
+                dedup.add(key)
+            return success
 
         def callback(ch, method, properties, body):
             if isinstance(callback_obj, IMessageCallBack):
-                if callback_obj.callback(ch, method, properties, body):
-                    ch.basic_ack(delivery_tag=method.delivery_tag)
+                if batcher is not None:
+                    batcher.delivered(method.delivery_tag)
+                self._inflight.inc()
+                heartbeat.submit(handle, (ch, method, properties, body),
+                                 functools.partial(on_done, ch, method.delivery_tag))
 
         channel.basic_qos(prefetch_count=prefetch_count)
         channel.basic_consume(callback, queue=queue_name)
-        channel.start_consuming()
+        if adaptive is not None:
+            timer = self.connection.add_timeout(adaptive.interval, adjust_prefetch)
+        try:
+            channel.start_consuming()
+        finally:
+            if timer is not None:
+                self.connection.remove_timeout(timer)
+            # 停止消费后指标不再引用AdaptivePrefetch
+            for gauge, function in gauges:
+                gauge.clear_function(function)
+            # 等待处理中的消息完成，并发送它们的确认
+            heartbeat.stop()
+            if self.connection.is_open:
+                self.connection.process_data_events()
+                if batcher is not None:
+                    batcher.flush(force=True)
 
     def setup_exchange(self):
         """申明交换机
@@ -202,22 +834,38 @@ class RabbitMQMessageHandler(IMessageHandler):
                                        durable=self.params.get("durable"))
 
     def on_bind(self):
-        """绑定交换机与队列
+        """申明交换机、队列并绑定
+        所有声明以nowait连续发出，只等待一次往返；同一个连接上已经声明过的拓扑不再重复声明
+        声明使用信道池中的信道，没有信道池时使用临时信道，声明完关闭
         :return:
         """
-        self._get_channel()
-        self.setup_exchange()
-        self.setup_queue()
-        for queue_name in self.params.get("publish_data_queue"):
-            self.channel.queue_bind(queue=queue_name,
-                                    exchange=self.params.get("exchange"),
-                                    routing_key=self.params.get("routing_key"))
+        if self.channel_pool is not None:
+            with self.channel_pool.channel() as channel:
+                self._declare(channel)
+            return
+        channel = self.connection.channel()
+        try:
+            self._declare(channel)
+        finally:
+            if channel.is_open:
+                channel.close()
+
+    def _declare(self, channel):
+        exchange = self.params.get("exchange")
+        durable = self.params.get("durable")
+        queues = self.params.get("publish_data_queue")
+        declare_pipelined(channel, declared(self.connection),
+                          exchanges=[(exchange, self.params.get("exchange_type"), durable)],
+                          queues=[(queue_name, durable) for queue_name in queues],
+                          bindings=[(queue_name, exchange, self.params.get("routing_key"))
+                                    for queue_name in queues])
 
     def _get_channel(self):
         """
-        获取通道
+        获取通道，之前获取的通道会被关闭
         :return:
         """
+        self.close_channel()
         self.channel = self.connection.channel()
         return self.channel
 
@@ -225,10 +873,30 @@ class RabbitMQMessageHandler(IMessageHandler):
         """关闭信道
         :return:
         """
-        self.channel.close()
+        if self.channel is not None and self.channel.is_open:
+            self.channel.close()
+        self.channel = None
 
     def close(self):
-        """关闭连接
+        """关闭信道，连接归还连接池
         :return:
         """
-        self.connection.close()
+        self._stop_keepalive()
+        with self._publish_lock:
+            if self.spill is not None:
+                # 尽量发布积压的消息，剩下的留在磁盘上，下次启动时重新加载
+                self.drain_spill(len(self.spill))
+                self.spill.close()
+                self._spill_gauge.clear_function(self._spill_length)
+            if self.channel_pool is not None:
+                self.channel_pool.close()
+        if self.queue_monitor is not None and self.connection.is_open:
+            self.queue_monitor.stop()
+        if self.consumer_channel is not None and self.consumer_channel.is_open:
+            self.consumer_channel.close()
+        if self.connection.is_open:
+            self.close_channel()
+        if self.connector is not None:
+            self.connector.release(self.connection)
+        else:
+            self.connection.close()
@@ -2,55 +2,57 @@
 # -*- coding: utf-8 -*-
 # @Time    : 18-1-6 下午2:31
 # @Author  : 哎哟卧槽
-# @Site    : rabbitMQ心跳线程
+# @Site    : rabbitMQ心跳保持
 # @File    : rabbitmqheartbeat.py
 # @Software: PyCharm
-import sys
-import time
-import threading
+import functools
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from pika.exceptions import AMQPConnectionError
 
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
-heartbeat = 50
 
-
-class RabbitMQHeartbeat(threading.Thread):
+class RabbitMQHeartbeat(object):
     """
-    MQ的心跳线程
+    MQ的心跳保持
+    pika的连接不是线程安全的，不能在其他线程中调用process_data_events。
+    这里把耗时的消息处理放到工作线程中执行，连接线程一直处理帧，心跳由pika自己收发；
+    工作线程不操作连接，处理结果通过add_callback_threadsafe交回连接线程
     """
-    def __init__(self, connection):
+    def __init__(self, connection, workers=1):
         """
         :param connection: RabbitMQ的连接对象
+        :param workers: 工作线程数，一般等于prefetch_count
         """
-        super(RabbitMQHeartbeat, self).__init__()
-        self.lock = threading.Lock()
         self.connection = connection
-        self.quit_flag = False
-        self.stop_flag = True
-        self.setDaemon(True)
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='rabbitmq-worker')
+
+    def submit(self, func, args, done):
+        """在工作线程中执行func(*args)，完成后在连接线程中调用done(result)
+        :param func: 耗时的处理函数，不能操作连接和信道
+        :param args: func的参数
+        :param done: 连接线程中的回调，func抛出异常时result为False
+        :return:
+        """
+        self.executor.submit(self._run, func, args, done)
 
-    def run(self):
-        logger.warning("心跳线程准备完毕")
-        while not self.quit_flag:
-            time.sleep(heartbeat)
-            self.lock.acquire()
-            if self.stop_flag:
-                self.lock.release()
-                continue
-            try:
-                logger.warning(f"发送心跳,间隔时间为:{heartbeat}s")
-                self.connection.process_data_events()
-            except Exception as ex:
-                self.lock.release()
-                raise RuntimeError("错误格式: %s" % (str(ex)))
-            self.lock.release()
+    def _run(self, func, args, done):
+        try:
+            result = func(*args)
+        except Exception:
+            logger.exception("消息处理失败")
+            result = False
+        try:
+            self.connection.add_callback_threadsafe(functools.partial(done, result))
+        except AMQPConnectionError:
+            logger.warning("连接已关闭，处理结果被丢弃，消息将被重新投递")
 
-    def start_heartbeat(self):
-        self.lock.acquire()
-        if self.quit_flag:
-            self.lock.release()
-            return
-        self.stop_flag = False
-        self.lock.release()
\ No newline at end of file
+    def stop(self, wait=True):
+        """停止工作线程
+        :param wait: 是否等待处理中的消息完成
+        :return:
+        """
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,40 @@
+'''重连策略
+指数退避加全抖动：第n次重连等待random(0, min(maximum, initial * multiplier ** n))秒，
+Broker重启后大量消费者的重连时间被打散，不会在同一时刻一起涌入
+'''
+
+import random
+
+
+class ReconnectPolicy(object):
+    # 每个连接一个实例，只在连接线程中使用
+    def __init__(self, initial=1.0, maximum=60.0, multiplier=2.0, jitter=True, random=random.random):
+        '''
+        :param initial: 第一次重连的最大等待时间（秒）
+        :param maximum: 等待时间的上限（秒）
+        :param multiplier: 每次失败后上限的增长倍数
+        :param jitter: 是否在0到上限之间随机取值，关闭后总是等待上限
+        :param random: 返回[0, 1)之间随机数的函数
+        '''
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.random = random
+        self.attempts = 0
+
+    def next_delay(self):
+        '''连接断开或连接失败后调用，返回下一次重连前的等待时间
+        :return: 秒
+        '''
+        ceiling = min(self.maximum, self.initial * self.multiplier ** self.attempts)
+        self.attempts += 1
+        if self.jitter:
+            return self.random() * ceiling
+        return ceiling
+
+    def reset(self):
+        '''连接恢复正常（开始消费或发布）后调用，下一次断开重新从initial开始退避
+        :return:
+        '''
+        self.attempts = 0
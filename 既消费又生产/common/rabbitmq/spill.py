@@ -0,0 +1,252 @@
+'''发布缓冲
+Broker不可用或者触发流控时，待发布的消息先放入内存环形缓冲，缓冲满后追加写入磁盘上内存映射的段文件；
+连接恢复后按原来的顺序取出重新发布。内存中的消息总是比磁盘上的早，磁盘上还有消息时新消息也写入磁盘，顺序因此不会被打乱
+'''
+
+import os
+import mmap
+import glob
+import time
+import struct
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# 记录格式：4字节长度 + 2字节content_type长度 + 2字节content_encoding长度 + content_type + content_encoding + body
+_LENGTH = struct.Struct('>I')
+_HEADER = struct.Struct('>HH')
+
+
+def _pack(body, content_type, content_encoding):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    content_type = (content_type or '').encode('ascii')
+    content_encoding = (content_encoding or '').encode('ascii')
+    return b''.join((_HEADER.pack(len(content_type), len(content_encoding)),
+                     content_type, content_encoding, body))
+
+
+def _unpack(data):
+    type_length, encoding_length = _HEADER.unpack_from(data)
+    offset = _HEADER.size
+    content_type = data[offset:offset + type_length].decode('ascii') or None
+    offset += type_length
+    content_encoding = data[offset:offset + encoding_length].decode('ascii') or None
+    offset += encoding_length
+    return data[offset:], content_type, content_encoding
+
+
+class _Segment(object):
+    # 一个预分配大小的段文件，追加写入，顺序读取；长度为0的记录表示文件结尾
+    def __init__(self, path, size):
+        self.path = path
+        self.file = open(path, 'a+b')
+        self.file.seek(0, os.SEEK_END)
+        if self.file.tell() < size:
+            self.file.truncate(size)
+        self.size = max(size, self.file.tell())
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+        self.read_pos = 0
+        self.write_pos = 0
+        self.count = 0
+        # 进程重启后，从头扫描出已经写入的记录
+        while self.write_pos + _LENGTH.size <= self.size:
+            length = _LENGTH.unpack_from(self.map, self.write_pos)[0]
+            if not length or self.write_pos + _LENGTH.size + length > self.size:
+                break
+            self.write_pos += _LENGTH.size + length
+            self.count += 1
+
+    def append(self, data):
+        '''
+        :return: 段文件剩余空间不足时返回False
+        '''
+        end = self.write_pos + _LENGTH.size + len(data)
+        if end > self.size:
+            return False
+        self.map[self.write_pos + _LENGTH.size:end] = data
+        if end + _LENGTH.size <= self.size:
+            # 段文件被复用时，后面可能还有旧的记录
+            _LENGTH.pack_into(self.map, end, 0)
+        # 最后写入长度，写到一半时进程退出不会留下不完整的记录
+        _LENGTH.pack_into(self.map, self.write_pos, len(data))
+        self.write_pos = end
+        self.count += 1
+        return True
+
+    def read(self):
+        if self.read_pos >= self.write_pos:
+            return None
+        length = _LENGTH.unpack_from(self.map, self.read_pos)[0]
+        start = self.read_pos + _LENGTH.size
+        self.read_pos = start + length
+        self.count -= 1
+        return bytes(self.map[start:self.read_pos])
+
+    def close(self, remove=False):
+        self.map.close()
+        self.file.close()
+        if remove:
+            os.remove(self.path)
+
+    def rewrite(self, fsync=False):
+        '''关闭段文件，只保留还没有读出的记录：写入临时文件后替换原文件，重新加载时不会再读出已经读过的记录
+        :param fsync: 替换前是否刷盘
+        :return:
+        '''
+        data = bytes(self.map[self.read_pos:self.write_pos])
+        self.close()
+        temp = self.path + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(data)
+            f.write(_LENGTH.pack(0))
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.replace(temp, self.path)
+
+
+class SpillBuffer(object):
+    # 线程安全，可以在多个发布线程中共用
+    def __init__(self, path, capacity=10000, segment_size=16 * 1024 * 1024, rate=None, burst=0.1,
+                 fsync=False):
+        '''
+        :param path: 段文件目录，目录中已有的段文件会被重新加载（至少发送一次，进程退出前未确认的消息会重发）
+        :param capacity: 内存中最多缓冲的消息数，超出后写入磁盘
+        :param segment_size: 每个段文件的大小（字节）
+        :param rate: 连接恢复后每秒最多重新发布的消息数，None表示不限速
+        :param burst: 限速时最多积累多少秒的配额，Broker停止期间积累的配额不会在恢复时一次用完
+        :param fsync: 每条消息写入磁盘后是否立即刷盘
+        '''
+        self.path = path
+        self.capacity = capacity
+        self.segment_size = segment_size
+        self.rate = rate
+        self.burst = burst
+        self.fsync = fsync
+        self._memory = deque()
+        self._segments = deque()
+        self._disk = 0
+        # 段文件按编号排序，关闭时内存中的消息写入编号更小的段文件，所以不从0开始
+        self._number = 1000000
+        self._tokens = 0.0
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        for segment_path in sorted(glob.glob(os.path.join(path, '*.seg'))):
+            segment = _Segment(segment_path, segment_size)
+            self._number = int(os.path.basename(segment_path).split('.')[0]) + 1
+            if segment.count:
+                self._segments.append(segment)
+                self._disk += segment.count
+            else:
+                segment.close(remove=True)
+        if self._disk:
+            logger.warning('从%s恢复%i条未发布的消息', path, self._disk)
+
+    def __len__(self):
+        return len(self._memory) + self._disk
+
+    @property
+    def spilled(self):
+        '''磁盘上的消息数'''
+        return self._disk
+
+    def put(self, body, content_type=None, content_encoding=None):
+        '''缓冲一条消息
+        :param body: 消息体，str按utf-8编码
+        :param content_type: 消息属性content_type
+        :param content_encoding: 消息属性content_encoding
+        :return:
+        '''
+        with self._lock:
+            if not self._disk and len(self._memory) < self.capacity:
+                self._memory.append((body, content_type, content_encoding))
+                return
+            data = _pack(body, content_type, content_encoding)
+            if not self._segments or not self._segments[-1].append(data):
+                segment = self._new_segment(len(data))
+                segment.append(data)
+            if self.fsync:
+                self._segments[-1].map.flush()
+            self._disk += 1
+
+    def _new_segment(self, length, number=None):
+        if number is None:
+            number = self._number
+            self._number += 1
+        path = os.path.join(self.path, '%08i.seg' % number)
+        segment = _Segment(path, max(self.segment_size, _LENGTH.size * 2 + length))
+        self._segments.append(segment)
+        return segment
+
+    def pop(self):
+        '''取出最早的一条消息
+        :return: (body, content_type, content_encoding)，没有消息时返回None
+        '''
+        with self._lock:
+            if self._memory:
+                return self._memory.popleft()
+            while self._segments:
+                segment = self._segments[0]
+                data = segment.read()
+                if data is not None:
+                    self._disk -= 1
+                    return _unpack(data)
+                if len(self._segments) == 1:
+                    # 最后一个段文件读完后从头复用
+                    segment.read_pos = segment.write_pos = 0
+                    _LENGTH.pack_into(segment.map, 0, 0)
+                    return None
+                self._segments.popleft().close(remove=True)
+            return None
+
+    def unget(self, records):
+        '''把取出后没有发送成功的消息放回最前面，records按原来的顺序排列
+        :param records: [(body, content_type, content_encoding)]
+        :return:
+        '''
+        with self._lock:
+            self._memory.extendleft(reversed(records))
+
+    def budget(self):
+        '''按rate计算当前可以重新发布的消息数，最多积累burst秒
+        :return: int
+        '''
+        if self.rate is None:
+            return len(self)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(max(1.0, self.rate * self.burst),
+                               self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            budget = int(self._tokens)
+            self._tokens -= budget
+            return budget
+
+    def close(self):
+        '''关闭段文件，未发送的消息（包括内存中的）留在磁盘上，下次用同一目录创建时重新加载；
+        读了一部分的段文件只保留未读的记录。没有调用close就退出时，已经读出的记录会被重发
+        :return:
+        '''
+        with self._lock:
+            if self._memory:
+                # 内存中的消息比磁盘上的早，写入编号更小的段文件
+                records = [_pack(*record) for record in self._memory]
+                number = int(os.path.basename(self._segments[0].path).split('.')[0]) - 1 \
+                    if self._segments else None
+                segment = self._new_segment(sum(_LENGTH.size + len(data) for data in records), number)
+                for data in records:
+                    segment.append(data)
+                logger.warning('关闭时把内存中的%i条消息写入%s', len(records), segment.path)
+                self._memory.clear()
+            while self._segments:
+                segment = self._segments.popleft()
+                if segment.count and segment.read_pos:
+                    # 读了一部分的段文件，已经取出的消息不能在下次加载时重发
+                    segment.rewrite(self.fsync)
+                    continue
+                segment.map.flush()
+                segment.close(remove=not segment.count)
@@ -0,0 +1,136 @@
+'''拓扑缓存
+记录首次连接时声明的交换机、队列和绑定，重连后在新信道上恢复。
+同一信道上的AMQP方法按顺序处理，所以声明全部以nowait发送，最后用一个被动声明作为屏障，
+整个恢复过程只等待一次往返，而不是每个声明等待一次；阻塞信道上的声明用declare_pipelined，按连接记录已声明的拓扑
+'''
+
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_declared = weakref.WeakKeyDictionary()
+_declared_lock = threading.Lock()
+
+
+def declared(connection):
+    '''连接上已经声明过的拓扑，连接被回收后一起释放；重连得到的新连接会重新声明
+    :param connection: pika.BlockingConnection
+    :return: set
+    '''
+    with _declared_lock:
+        return _declared.setdefault(connection, set())
+
+
+def declare_pipelined(channel, declared, exchanges=(), queues=(), bindings=()):
+    '''在阻塞信道上声明拓扑：跳过declared中已有的，其余通过底层信道以nowait连续发出，
+    最后用一个阻塞的被动声明等待Broker处理完全部声明；任何一个声明失败时在这里抛出ChannelClosed
+    :param channel: pika.adapters.blocking_connection.BlockingChannel
+    :param declared: declared(connection)返回的集合，成功后加入本次声明的拓扑
+    :param exchanges: [(交换机名, 类型, durable)]
+    :param queues: [(队列名, durable)]
+    :param bindings: [(队列名, 交换机名, 路由键)]
+    :return: 发出的声明数
+    '''
+    pending = [('exchange',) + tuple(item) for item in exchanges] + \
+              [('queue',) + tuple(item) for item in queues] + \
+              [('bind',) + tuple(item) for item in bindings]
+    pending = [key for key in OrderedDict.fromkeys(pending) if key not in declared]
+    if not pending:
+        return 0
+    impl = channel._impl
+    barrier = None
+    for key in pending:
+        if 'exchange' == key[0]:
+            impl.exchange_declare(exchange=key[1], exchange_type=key[2], durable=key[3], nowait=True)
+        elif 'queue' == key[0]:
+            impl.queue_declare(None, queue=key[1], durable=key[2], nowait=True)
+            barrier = key[1]
+        else:
+            impl.queue_bind(None, queue=key[1], exchange=key[2], routing_key=key[3], nowait=True)
+            barrier = barrier or key[1]
+    if barrier is not None:
+        channel.queue_declare(queue=barrier, passive=True)
+    else:
+        channel.exchange_declare(exchange=pending[-1][1], passive=True)
+    declared.update(pending)
+    return len(pending)
+
+
+class TopologyCache(object):
+    # 只在连接线程中使用
+    def __init__(self, passive=False):
+        '''
+        :param passive: 为True时重连后不重新声明，只对队列做被动声明，适用于持久化的拓扑；
+                        队列不存在时信道被关闭（404），调用方应调用invalidate，下一次连接做完整声明
+        '''
+        self.passive = passive
+        self.exchanges = OrderedDict()
+        self.queues = OrderedDict()
+        self.bindings = []
+        self.complete = False
+
+    def exchange(self, exchange, exchange_type='direct', **kwargs):
+        '''记录交换机声明
+        :param exchange: 交换机名
+        :param exchange_type: 交换机类型
+        :param kwargs: exchange_declare的其他参数（durable、auto_delete、arguments等）
+        :return:
+        '''
+        self.exchanges[exchange] = dict(kwargs, exchange_type=exchange_type)
+
+    def queue(self, queue, **kwargs):
+        '''记录队列声明
+        :param queue: 队列名
+        :param kwargs: queue_declare的其他参数
+        :return:
+        '''
+        self.queues[queue] = kwargs
+
+    def bind(self, queue, exchange, routing_key=None):
+        '''记录绑定
+        :return:
+        '''
+        if (queue, exchange, routing_key) not in self.bindings:
+            self.bindings.append((queue, exchange, routing_key))
+
+    def mark_complete(self):
+        '''首次声明全部完成后调用，之后的连接可以直接恢复
+        :return:
+        '''
+        self.complete = True
+
+    def invalidate(self):
+        '''拓扑可能已经不存在（如被动声明失败），下一次连接按原来的流程逐个声明
+        :return:
+        '''
+        self.complete = False
+
+    def redeclare(self, channel, callback):
+        '''在新信道上恢复拓扑，完成后调用callback(method_frame)
+        :param channel: pika.channel.Channel
+        :param callback: 屏障的回复到达时调用，此时之前的声明都已被Broker处理
+        :return:
+        '''
+        if not self.passive:
+            for exchange, kwargs in self.exchanges.items():
+                channel.exchange_declare(None, exchange, nowait=True, **kwargs)
+            for queue, kwargs in self.queues.items():
+                channel.queue_declare(None, queue, nowait=True, **kwargs)
+            for queue, exchange, routing_key in self.bindings:
+                channel.queue_bind(None, queue, exchange, routing_key, nowait=True)
+        logger.info('恢复拓扑: %i个交换机，%i个队列，%i个绑定%s', len(self.exchanges),
+                    len(self.queues), len(self.bindings), '（被动检查）' if self.passive else '')
+        queues = list(self.queues)
+        if self.passive:
+            # 被动检查每个队列，只等待最后一个的回复
+            for queue in queues[:-1]:
+                channel.queue_declare(None, queue, passive=True, nowait=True)
+        if queues:
+            channel.queue_declare(callback, queues[-1], passive=True)
+        elif self.exchanges:
+            channel.exchange_declare(callback, list(self.exchanges)[-1], passive=True)
+        else:
+            callback(None)
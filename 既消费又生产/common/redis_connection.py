@@ -1,6 +1,12 @@
 
+import itertools
 import redis
 
+# 每个SADD最多包含的成员数，单个命令过大会长时间阻塞Redis
+CHUNK_SIZE = 1000
+# 一次pipeline最多发送的SADD数
+PIPELINE_DEPTH = 16
+
 
 class RedisClient(object):
 
@@ -13,25 +19,64 @@ class RedisClient(object):
             if password else redis.StrictRedis(host=host, port=port, db=db,
                                                decode_responses=True, **kwargs)
 
-    def pusub(self, key, message):
+    def pusub(self, key, message, chunk_size=CHUNK_SIZE):
         """将用户信息SADD进REIDS进行去重
+        多个成员用一个SADD发送，超过chunk_size时分块，用pipeline一次往返发送多块
         :param key: Key
-        :param message: 信息
-        :return:
+        :param message: 信息，str为单个成员，dict取所有值，list或生成器等可迭代对象逐个取出
+        :param chunk_size: 每个SADD最多包含的成员数
+        :return: 新加入集合的成员数，为0时说明全部重复
         """
         try:
-            # 将用户ID SADD 进redis使用sadd方法可以比表用户id重复
-            if isinstance(message, list):
-                for user_id in message:
-                    self.r_con.sadd(key, user_id)
-            elif isinstance(message, str):
-                self.r_con.sadd(key, message)
-            elif isinstance(message, dict):
-                for k, v in message.items():
-                    self.r_con.sadd(key, v)
+            if isinstance(message, (str, bytes, int, float)):
+                return self.r_con.sadd(key, message)
+            if isinstance(message, dict):
+                message = message.values()
+            return self.sadd_many(key, message, chunk_size)
         except Exception as e:
             print(e.args)
-            raise e.args
+            raise
+
+    def sadd_many(self, key, members, chunk_size=CHUNK_SIZE):
+        """分块SADD，不会把生成器一次性展开；只有一块时直接发送，否则每PIPELINE_DEPTH块用pipeline发送一次
+        :param key: Key
+        :param members: 可迭代的成员
+        :param chunk_size: 每个SADD最多包含的成员数
+        :return: 新加入集合的成员数
+        """
+        members = iter(members)
+        added = 0
+        pipe = None
+        while True:
+            chunk = list(itertools.islice(members, chunk_size))
+            if not chunk:
+                break
+            if pipe is None:
+                if len(chunk) < chunk_size:
+                    # 只有一块，不需要pipeline
+                    return added + self.r_con.sadd(key, *chunk)
+                pipe = self.r_con.pipeline(transaction=False)
+            pipe.sadd(key, *chunk)
+            if len(pipe) >= PIPELINE_DEPTH:
+                added += sum(pipe.execute())
+        if pipe is not None and len(pipe):
+            added += sum(pipe.execute())
+        return added
+
+    def set_once(self, key, ttl):
+        """SET NX EX：key不存在时写入，ttl秒后过期
+        :param key: Key
+        :param ttl: 过期时间（秒）
+        :return: 是否是第一次写入
+        """
+        return bool(self.r_con.set(key, 1, ex=ttl, nx=True))
+
+    def exists(self, key):
+        """key是否存在
+        :param key: Key
+        :return: bool
+        """
+        return bool(self.r_con.exists(key))
 
     def sdiff(self, key):
         """返回key列表所有数据
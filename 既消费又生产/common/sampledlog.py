@@ -0,0 +1,76 @@
+'''采样日志
+每条消息都会经过的路径上不逐条输出日志：sample按事件每N次输出一次，count只计数、按时间间隔输出汇总；
+日志级别未开启时直接返回，不格式化任何内容
+'''
+
+import time
+import logging
+import threading
+
+
+class SampledLogger(object):
+    # 线程安全，多个工作线程可以共用一个实例；计数在锁内更新，日志在锁外输出
+    def __init__(self, logger, every=1000, interval=10.0, level=logging.INFO, clock=time.monotonic):
+        '''
+        :param logger: logging.Logger
+        :param every: sample每隔多少次输出一次，第一次总是输出
+        :param interval: count汇总的输出间隔（秒）
+        :param level: 日志级别
+        :param clock: 时钟函数
+        '''
+        self.logger = logger
+        self.every = every
+        self.interval = interval
+        self.level = level
+        self.clock = clock
+        self._samples = {}
+        self._counts = {}
+        self._since = clock()
+        self._lock = threading.Lock()
+
+    def sample(self, event, msg, *args):
+        '''事件第1、every+1、2*every+1...次发生时输出，参数在输出时才格式化
+        :param event: 事件名，写入LogRecord的event字段
+        :param msg: 日志格式
+        :param args: 日志参数
+        :return:
+        '''
+        if not self.logger.isEnabledFor(self.level):
+            return
+        with self._lock:
+            seen = self._samples.get(event, 0)
+            self._samples[event] = seen + 1
+        if seen % self.every == 0:
+            self.logger.log(self.level, msg, *args,
+                            extra={'event': event, 'occurrence': seen + 1})
+
+    def count(self, event, amount=1):
+        '''累计事件次数，距离上次汇总超过interval时输出各事件的次数和速度
+        :param event: 事件名
+        :param amount: 次数
+        :return:
+        '''
+        if not self.logger.isEnabledFor(self.level):
+            return
+        with self._lock:
+            self._counts[event] = self._counts.get(event, 0) + amount
+            due = self.clock() - self._since >= self.interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        '''输出并清空汇总
+        :return:
+        '''
+        with self._lock:
+            now = self.clock()
+            elapsed = max(now - self._since, 1e-9)
+            counts, self._counts = self._counts, {}
+            self._since = now
+        if not counts or not self.logger.isEnabledFor(self.level):
+            return
+        summary = ' '.join('%s=%i' % (event, total) for event, total in sorted(counts.items()))
+        rates = ' '.join('%s_rate=%.1f/s' % (event, total / elapsed)
+                         for event, total in sorted(counts.items()))
+        self.logger.log(self.level, '%.1fs汇总: %s %s', elapsed, summary, rates,
+                        extra={'event': 'summary', 'counts': counts, 'elapsed': elapsed})
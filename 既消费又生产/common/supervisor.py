@@ -0,0 +1,160 @@
+'''多进程消费者管理
+每个工作进程拥有自己的连接和消息处理实例，崩溃后按指数退避重启，收到SIGTERM后优雅退出
+'''
+
+import os
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(factory, index, processed):
+    '''工作进程入口
+    :param factory: 无参可调用对象，返回实现了start/drain/stop/callback的任务处理实例（如TaskHandler）
+    :param index: 工作进程编号
+    :param processed: 各工作进程已处理消息数的共享数组
+    :return:None
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    target = factory()
+    callback = target.callback
+    # 回调在多个工作线程中执行，共享数组上的+=不是原子操作
+    lock = threading.Lock()
+
+    def counted(*args):
+        result = callback(*args)
+        with lock:
+            processed[index] += 1
+        return result
+
+    target.callback = counted
+    signal.signal(signal.SIGTERM, lambda signum, frame: target.drain())
+    target.start()
+    target.stop()
+
+
+class WorkerSupervisor(object):
+    # 工作进程管理器
+    def __init__(self, factory, workers, backoff=1.0, max_backoff=60.0,
+                 stable_time=30.0, report_interval=10.0, drain_timeout=30.0):
+        '''
+        :param factory: 在工作进程中调用，返回任务处理实例
+        :param workers: 工作进程数
+        :param backoff: 第一次重启前的等待时间（秒），之后每次翻倍
+        :param max_backoff: 重启等待时间上限（秒）
+        :param stable_time: 进程运行超过该时间后重置退避
+        :param report_interval: 输出吞吐量的间隔（秒）
+        :param drain_timeout: 停止时等待工作进程退出的时间，超时后强制结束
+        '''
+        self.factory = factory
+        self.workers = workers
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stable_time = stable_time
+        self.report_interval = report_interval
+        self.drain_timeout = drain_timeout
+        self._context = multiprocessing.get_context('fork')
+        self.processed = self._context.RawArray('Q', workers)
+        self._processes = [None] * workers
+        self._started_at = [0.0] * workers
+        self._failures = [0] * workers
+        self._restart_at = [None] * workers
+        self._last_counts = [0] * workers
+        self._last_report = None
+        self._stopping = False
+
+    def _spawn(self, index):
+        process = self._context.Process(target=_worker_main,
+                                        args=(self.factory, index, self.processed),
+                                        name='worker-%i' % index)
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        self._restart_at[index] = None
+        logger.warning('工作进程%i启动, pid: %s', index, process.pid)
+
+    def start(self):
+        '''启动所有工作进程
+        :return:None
+        '''
+        self._last_report = time.monotonic()
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def poll(self):
+        '''检查工作进程状态，退出的进程按退避时间重启
+        :return:None
+        '''
+        now = time.monotonic()
+        for index, process in enumerate(self._processes):
+            if self._stopping:
+                return
+            if self._restart_at[index] is not None:
+                if now >= self._restart_at[index]:
+                    self._spawn(index)
+                continue
+            if process.is_alive():
+                continue
+            process.join()
+            if now - self._started_at[index] >= self.stable_time:
+                self._failures[index] = 0
+            delay = min(self.max_backoff, self.backoff * 2 ** self._failures[index])
+            self._failures[index] += 1
+            self._restart_at[index] = now + delay
+            logger.error('工作进程%i退出, 退出码: %s, %.1f秒后重启',
+                         index, process.exitcode, delay)
+
+    def report(self):
+        '''统计各工作进程自上次统计以来的吞吐量
+        :return: 每个工作进程的消息处理速度列表（条/秒）
+        '''
+        now = time.monotonic()
+        elapsed = max(now - self._last_report, 1e-9)
+        counts = list(self.processed)
+        rates = [(count - last) / elapsed for count, last in zip(counts, self._last_counts)]
+        self._last_counts = counts
+        self._last_report = now
+        logger.warning('吞吐量: 合计%.1f条/秒, 各进程: %s', sum(rates),
+                       ', '.join('%i:%.1f' % (i, rate) for i, rate in enumerate(rates)))
+        return rates
+
+    def stop(self):
+        '''向工作进程发送SIGTERM，等待处理中的消息完成，超时后强制结束
+        :return:None
+        '''
+        self._stopping = True
+        processes = [p for p in self._processes if p is not None and p.is_alive()]
+        for process in processes:
+            os.kill(process.pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.drain_timeout
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.error('工作进程%s未能在%.1f秒内退出，强制结束', process.name, self.drain_timeout)
+                process.kill()
+                process.join()
+
+    def _on_signal(self, signum, frame):
+        self._stopping = True
+
+    def run(self):
+        '''阻塞运行，直到收到SIGTERM或SIGINT
+        :return:None
+        '''
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        self.start()
+        try:
+            while not self._stopping:
+                time.sleep(0.5)
+                self.poll()
+                if time.monotonic() - self._last_report >= self.report_interval:
+                    self.report()
+        finally:
+            self.stop()
+        logger.warning('所有工作进程已退出')
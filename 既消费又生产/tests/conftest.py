@@ -0,0 +1,22 @@
+import os
+import sys
+import itertools
+import pytest
+
+# 代码中按common.…导入，以既消费又生产为根目录
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.rabbitmq import memory
+from common.rabbitmq.rabbitmq import RabbitMQConnectionPool
+
+_names = itertools.count()
+
+
+@pytest.fixture
+def broker_name():
+    # 每个测试使用单独的内存Broker和连接池
+    name = 'test-%i' % next(_names)
+    memory.get_broker(name)
+    yield name
+    RabbitMQConnectionPool.close_all()
+    memory._brokers.pop(name, None)
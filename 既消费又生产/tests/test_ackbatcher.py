@@ -0,0 +1,84 @@
+import pytest
+from common.rabbitmq.ackbatcher import AckBatcher
+from common.rabbitmq.memory import MemoryBroker, MemoryConnection
+
+
+@pytest.fixture
+def delivered():
+    # 向信道投递5条消息，返回(连接, 信道, delivery_tag列表)
+    broker = MemoryBroker()
+    connection = MemoryConnection(broker)
+    channel = connection.channel()
+    channel.queue_declare(queue='task_queue')
+    broker.queues['task_queue'].extend((None, b'%i' % number) for number in range(5))
+    tags = []
+    channel.basic_qos(prefetch_count=10)
+    channel.basic_consume(lambda ch, method, properties, body: tags.append(method.delivery_tag), queue='task_queue')
+    # 每次分发事件给消费者投递一条
+    for _ in range(5):
+        connection.process_data_events(0)
+    assert 5 == len(tags)
+    yield connection, channel, tags
+    connection.close()
+
+
+def make_batcher(connection, channel, tags, **kwargs):
+    batcher = AckBatcher(channel, connection.add_timeout, connection.remove_timeout, **kwargs)
+    for tag in tags:
+        batcher.delivered(tag)
+    return batcher
+
+
+def test_acks_contiguous_prefix(delivered):
+    connection, channel, tags = delivered
+    batcher = make_batcher(connection, channel, tags, max_batch=3, max_delay=60)
+    batcher.ack(tags[1])
+    batcher.ack(tags[2])
+    assert 0 == batcher.frames
+    # 最早的消息完成后，前三条用一次basic_ack(multiple=True)确认
+    batcher.ack(tags[0])
+    assert 1 == batcher.frames
+    assert tags[3:] == list(channel._unacked)
+    # 排在处理中消息之后的不确认
+    batcher.ack(tags[4])
+    batcher.flush()
+    assert tags[3:] == list(channel._unacked)
+    batcher.ack(tags[3])
+    batcher.flush()
+    assert 2 == batcher.frames
+    assert not channel._unacked
+
+
+def test_force_flush_acks_completed_after_pending(delivered):
+    connection, channel, tags = delivered
+    batcher = make_batcher(connection, channel, tags, max_batch=10, max_delay=60)
+    batcher.ack(tags[2])
+    batcher.ack(tags[4])
+    batcher.flush(force=True)
+    assert 2 == batcher.frames
+    assert [tags[0], tags[1], tags[3]] == list(channel._unacked)
+
+
+def test_timer_flushes(delivered):
+    connection, channel, tags = delivered
+    batcher = make_batcher(connection, channel, tags, max_batch=10, max_delay=0)
+    batcher.ack(tags[0])
+    batcher.ack(tags[1])
+    connection.process_data_events(0)
+    assert tags[2:] == list(channel._unacked)
+
+
+@pytest.mark.parametrize('requeue', [True, False])
+def test_nack(delivered, requeue):
+    connection, channel, tags = delivered
+    batcher = make_batcher(connection, channel, tags, max_batch=2, max_delay=60, requeue=requeue)
+    batcher.nack(tags[0])
+    assert tags[1:] == list(channel._unacked)
+    assert (1 if requeue else 0) == len(channel.broker.queues['task_queue'])
+    # 拒绝的消息不会挡住后面的确认，也不会被basic_ack(multiple=True)一起确认
+    batcher.ack(tags[1])
+    batcher.ack(tags[2])
+    assert tags[3:] == list(channel._unacked)
+    batcher.nack(tags[4], requeue=False)
+    assert (1 if requeue else 0) == len(channel.broker.queues['task_queue'])
+    assert [tags[3]] == list(channel._unacked)
@@ -0,0 +1,58 @@
+import sys
+import types
+import importlib
+import pytest
+from benchmark import cleaning as cleaners
+from common.cleaning import joinable, sub_joined
+
+
+@pytest.fixture
+def public2(monkeypatch):
+    # DLQYSpider2.cleaner不在仓库中，用基准中按同样约定实现的清洗器代替
+    package = types.ModuleType('DLQYSpider2')
+    module = types.ModuleType('DLQYSpider2.cleaner')
+    module.clean_objects = cleaners.clean_objects
+    for name in cleaners.clean_objects:
+        setattr(module, name, getattr(cleaners, name))
+    package.cleaner = module
+    monkeypatch.setitem(sys.modules, 'DLQYSpider2', package)
+    monkeypatch.setitem(sys.modules, 'DLQYSpider2.cleaner', module)
+    monkeypatch.delitem(sys.modules, 'common.public2', raising=False)
+    yield importlib.import_module('common.public2')
+    sys.modules.pop('common.public2', None)
+
+
+@pytest.mark.parametrize('pattern', [r'^\s+', r'\s+$', r'\Aa', r'a\Z', r'\bb', r'\Bb', r'(?<=a)b', r'(?<!a)b',
+                                     r'a(?=b)', r'a(?!b)', r'x|^a'])
+def test_joinable_rejects_assertions(pattern):
+    assert not joinable(pattern)
+
+
+@pytest.mark.parametrize('pattern', [r'\s+', r'[^>]+', r'<[^>]+>', r'[$^]', r'[]^]', r'\^\$', r'\\', r'(?:a|b)',
+                                     r'(?P<name>a)', r'[\b]'])
+def test_joinable_accepts_plain(pattern):
+    assert joinable(pattern)
+
+
+@pytest.mark.parametrize('pattern', [r'^\s+', r'\s+$', r'\s+', r'\bb', r'(?<!a)b', r'x*'])
+def test_sub_joined_matches_re_sub(pattern):
+    import re
+    values = ['  a', '  b  ', 'c  ', '', 'ab b']
+    assert [re.sub(pattern, '', value) for value in values] == sub_joined(pattern, '', values)
+
+
+RULES = [
+    ('max_num', 20),
+    ('name', {'cleaner': [{'join': {'sep': ''}}, {'re_sub': {'pattern': r'^\s+', 'repl': ''}},
+                          {'re_sub': {'pattern': r'\s+$', 'repl': ''}}]}),
+    ('tel', {'cleaner': [{'join': {'sep': ','}}, {'re_sub': {'pattern': r'^电话,?', 'repl': ''}},
+                         {'re_sub': {'pattern': r'\b0571-', 'repl': ''}}]}),
+    ('desc', {'cleaner': [{'join': {'sep': ''}}, {'re_sub': {'pattern': r'<[^>]+>', 'repl': ''}},
+                          {'replace': {'old': '主营业务：', 'new': ''}}, {'strip': {}}, {'truncate': {'length': 20}}]}),
+]
+
+
+@pytest.mark.parametrize('rules', [RULES, cleaners.CLEAN_ITEMS])
+def test_clean_items_batch_matches_clean_item(public2, rules):
+    expected = [public2.clean_item(items, rules) for items in cleaners.generate(200)]
+    assert expected == public2.clean_items_batch(list(cleaners.generate(200)), rules)
@@ -0,0 +1,82 @@
+import pytest
+from pika import spec
+from common.rabbitmq import codec as codec_module
+from common.rabbitmq.codec import Codec, CodecError, JSON
+from common.rabbitmq.rabbitmq import MessageHandlerFactory, IMessageCallBack
+from common.rabbitmq.memory import get_broker
+
+TASK = {'url': 'http://www.example.com/', 'title': '标题', 'pages': list(range(100))}
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_encode_decode(compression):
+    codec = Codec(compression=compression, threshold=16)
+    body, content_type, content_encoding = codec.encode(TASK)
+    assert JSON == content_type
+    assert compression == content_encoding
+    assert TASK == codec.decode(body, content_type, content_encoding)
+    assert TASK == codec.decode(memoryview(body), content_type, content_encoding)
+
+
+def test_small_body_not_compressed():
+    body, _, content_encoding = Codec(compression='zlib', threshold=1024).encode({'a': 1})
+    assert content_encoding is None
+    assert {'a': 1} == Codec().decode(body)
+
+
+@pytest.mark.parametrize('content_encoding', ['utf-8', 'UTF8', 'identity', 'binary'])
+def test_charset_or_unknown_encoding_is_identity(content_encoding):
+    assert {'a': '中文'} == Codec().decode('{"a":"中文"}'.encode('utf-8'), JSON, content_encoding)
+
+
+def test_charset_encoding_decodes_text():
+    assert {'a': '中文'} == Codec().decode('{"a":"中文"}'.encode('gbk'), JSON, 'gbk')
+
+
+def test_missing_compressor_library(monkeypatch):
+    monkeypatch.delitem(codec_module.COMPRESSORS, 'lz4', raising=False)
+    with pytest.raises(CodecError):
+        Codec().decode(b'\x04"M\x18', JSON, 'lz4')
+
+
+@pytest.mark.parametrize('body, content_type, content_encoding', [
+    (b'{"a":', JSON, None),
+    (b'not zlib', JSON, 'zlib'),
+    (b'{"a":1}', 'text/plain', None),
+])
+def test_undecodable(body, content_type, content_encoding):
+    with pytest.raises(CodecError):
+        Codec().decode(body, content_type, content_encoding)
+
+
+class Collector(IMessageCallBack):
+    # 解码消息，收到count条后停止消费
+    def __init__(self, handler, count):
+        self.handler = handler
+        self.count = count
+        self.tasks = []
+
+    def callback(self, ch, method, properties, body):
+        self.tasks.append(self.handler.decode(properties, body))
+        if len(self.tasks) >= self.count:
+            self.handler.stop_consuming()
+        return True
+
+
+@pytest.mark.parametrize('ack_batch_size', [None, 10])
+def test_undecodable_message_rejected(broker_name, ack_batch_size):
+    params = {'exchange': 'test_exchange', 'exchange_type': 'direct', 'routing_key': 'task_queue',
+              'task_queue': 'task_queue', 'publish_data_queue': ['task_queue'], 'durable': True,
+              'prefetch_count': 1, 'ack_batch_size': ack_batch_size}
+    handler = MessageHandlerFactory.get_instance('RabbitMQ', {'transport': 'memory', 'memory_broker': broker_name},
+                                                 params)
+    handler.on_bind()
+    queue = get_broker(broker_name).queues['task_queue']
+    queue.append((spec.BasicProperties(content_type=JSON, content_encoding='zlib'), b'broken'))
+    queue.append((spec.BasicProperties(content_type=JSON, content_encoding='utf-8'), b'{"a":1}'))
+    collector = Collector(handler, 1)
+    handler.start_consuming(collector)
+    handler.close()
+    assert [{'a': 1}] == collector.tasks
+    # 无法解码的消息被拒绝，不会在信道关闭后重新入队
+    assert 0 == len(queue)
@@ -0,0 +1,97 @@
+import io
+import pytest
+from lxml import etree
+from common.extractor import Extractor, parse
+
+PAGES = [
+    # 备选XPath在前，优先的XPath在后
+    '<html><head><title>Fallback</title></head><body><h1>Primary</h1></body></html>',
+    '<html><head><title>Only title</title></head><body><p>text</p></body></html>',
+    '<html><body><h1>Primary</h1><ul>%s</ul><div class="pager"><a href="/2.html">next</a></div></body></html>'
+    % ''.join('<li>item %i</li>' % number for number in range(2000)),
+    '<?xml version="1.0" encoding="utf-8"?><root><title>中文</title><h1>标题</h1></root>',
+    '',
+]
+RULES = {
+    'title': ['//h1/text()', '//title/text()'],
+    'next': ['//div[@class="pager"]/a/@href'],
+    'count': ['count(//li)'],
+    'missing': ['//table/text()', '//form/text()'],
+    'fixed': 20,
+}
+
+
+@pytest.mark.parametrize('page', PAGES)
+@pytest.mark.parametrize('chunk_size', [16, 4096, 1024 * 1024])
+def test_extract_stream_matches_extract(page, chunk_size):
+    extractor = Extractor(RULES)
+    expected = extractor.extract(parse(page.encode('utf-8')))
+    assert expected == extractor.extract_stream(page.encode('utf-8'), chunk_size=chunk_size)
+    assert expected == extractor.extract_stream(io.BytesIO(page.encode('utf-8')), chunk_size=chunk_size)
+    assert expected == extractor.extract_stream(page, chunk_size=chunk_size, clear=False)
+
+
+def test_extract_stream_keeps_priority():
+    extractor = Extractor({'title': ['//h1/text()', '//title/text()']})
+    page = PAGES[0].encode('utf-8')
+    assert {'title': ['Primary']} == extractor.extract(etree.HTML(page))
+    assert {'title': ['Primary']} == extractor.extract_stream(page, chunk_size=4096)
+
+
+XHTML = ('<?xml version="1.0" encoding="utf-8"?>\n'
+         '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN" '
+         '"http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">\n'
+         '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>标题</title></head>'
+         '<body><div class="t">hello%s</div></body></html>')
+
+
+@pytest.mark.parametrize('page', [XHTML % '', XHTML % '<br>', XHTML.replace('<!DOCTYPE', '<!--').replace('.dtd">', '.dtd-->') % ''])
+@pytest.mark.parametrize('encode', [False, True])
+def test_xhtml_parsed_as_html(page, encode):
+    from common.public import create_tree
+    source = page.encode('utf-8') if encode else page
+    tree = create_tree(source)
+    assert tree is not None
+    assert ['hello'] == tree.xpath('//div[@class="t"]/text()')
+    extractor = Extractor({'text': ['//div[@class="t"]/text()'], 'title': ['//title/text()']})
+    assert {'text': ['hello'], 'title': ['标题']} == extractor.extract_stream(source, chunk_size=64)
+
+
+@pytest.mark.parametrize('encode', [False, True])
+def test_xml_parsed_as_xml(encode):
+    from common.public import create_tree
+    page = '<?xml version="1.0" encoding="utf-8"?><rss><channel><item><link>/1.html</link></item></channel></rss>'
+    tree = create_tree(page.encode('utf-8') if encode else page)
+    assert 'rss' == tree.getroot().tag
+    assert ['/1.html'] == tree.xpath('//item/link/text()')
+
+
+def test_malformed_xml_falls_back_to_html():
+    page = '<?xml version="1.0"?><feed><entry>one<br></entry></feed>'
+    assert ['one'] == parse(page.encode('utf-8')).xpath('//entry/text()')
+
+
+@pytest.mark.parametrize('rules', [
+    {'cell': ['//tr[td[2]]/td[1]/text()']},
+    {'cell': ['//tr/td[2]/text()']},
+    {'cell': ['//tr/td[last()]/text()']},
+    {'cell': ['//td[text()="first"]/following-sibling::td/text()']},
+    {'cell': ['//h2/following-sibling::p/text()']},
+    {'cell': ['count(//td)']},
+])
+@pytest.mark.parametrize('chunk_size', [16, 32, 4096])
+def test_extract_stream_positional_rules(rules, chunk_size):
+    page = ('<html><body><table><tr><td>first</td>%s<td>second</td></tr></table><h2>x</h2>%s<p>after</p>'
+            '</body></html>' % (' ' * 100, ' ' * 100)).encode('utf-8')
+    extractor = Extractor(rules)
+    assert extractor.extract(parse(page)) == extractor.extract_stream(page, chunk_size=chunk_size)
+
+
+def test_clearable():
+    from common.extractor import clearable
+    assert clearable(['//div[@class="a"]/text()', '//h1[contains(., "x")]'])
+    assert clearable('//a/@href')
+    assert clearable(20)
+    for xpath in ('(//li)[1]', '//li[ 2 ]', '//li[position()<3]', '//li[last()]', '//h2/preceding::p',
+                  '//h2/following-sibling::p', 'count(//li)', 'sum(//li/@n)'):
+        assert not clearable(['//title/text()', xpath])
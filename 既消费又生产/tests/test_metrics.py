@@ -0,0 +1,55 @@
+import gc
+import weakref
+import threading
+from common.metrics import Registry
+
+
+def run_threads(function, count=4):
+    threads = [threading.Thread(target=function) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_dead_thread_cells_folded():
+    registry = Registry()
+    counter = registry.counter('test_total')
+    histogram = registry.histogram('test_seconds', buckets=(0.1, 1.0))
+    for _ in range(10):
+        # 每轮都是新线程，模拟重建的线程池
+        run_threads(lambda: (counter.inc(2), histogram.observe(0.5)))
+    counter.inc()
+    assert 81 == counter.value
+    # 已经退出的线程的单元被合并，只剩当前线程的
+    assert 1 == len(counter._cells)
+    samples = {(name, labels): value for name, labels, value in histogram.samples()}
+    assert 40 == samples[('test_seconds_count', '')]
+    assert 0 == samples[('test_seconds_bucket', '{le="0.1"}')]
+    assert 40 == samples[('test_seconds_bucket', '{le="1.0"}')]
+    assert 20.0 == samples[('test_seconds_sum', '')]
+    assert len(histogram._cells) <= 1
+
+
+def test_gauge_clear_function():
+    registry = Registry()
+    gauge = registry.gauge('test_gauge', labels={'queue': 'task_queue'})
+
+    class Owner(object):
+        size = 3
+
+    owner = Owner()
+    function = lambda: owner.size
+    gauge.set_function(function)
+    assert 3 == registry.gauge('test_gauge', labels={'queue': 'task_queue'}).value
+    # 已经被替换的函数不影响当前绑定
+    replacement = lambda: 5
+    gauge.set_function(replacement)
+    gauge.clear_function(function)
+    assert 5 == gauge.value
+    gauge.clear_function(replacement)
+    assert 0 == gauge.value
+    reference = weakref.ref(owner)
+    del owner, function
+    gc.collect()
+    assert reference() is None
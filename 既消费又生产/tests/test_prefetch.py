@@ -0,0 +1,101 @@
+import random
+from common.rabbitmq.prefetch import AdaptivePrefetch
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_prefetch(**kwargs):
+    clock = Clock()
+    params = dict(prefetch=10, min_prefetch=1, max_prefetch=100, target_time=1.0, workers=2, interval=1.0,
+                  alpha=1.0, clock=clock)
+    params.update(kwargs)
+    return AdaptivePrefetch(**params), clock
+
+
+def test_waits_for_interval():
+    prefetch, clock = make_prefetch()
+    prefetch.record(0.5)
+    clock.now = 0.5
+    assert prefetch.update() is None
+    clock.now = 1.0
+    # 1秒 * 2个线程 / 0.5秒 = 4
+    assert 4 == prefetch.update()
+    assert 4 == prefetch.prefetch
+
+
+def test_small_changes_ignored():
+    # 变化小于10%（至少1）时不调整
+    prefetch, clock = make_prefetch(prefetch=40)
+    prefetch.record(2.0 / 42)
+    clock.now = 1.0
+    assert prefetch.update() is None
+    assert 40 == prefetch.prefetch
+    prefetch.record(2.0 / 45)
+    clock.now = 2.0
+    assert 45 == prefetch.update()
+    # 两边来回的小波动不再触发调整
+    for latency in (2.0 / 44, 2.0 / 46, 2.0 / 45):
+        prefetch.record(latency)
+        clock.now += 1.0
+        assert prefetch.update() is None
+    assert 1 == len(prefetch.decisions)
+
+
+def test_bounds():
+    prefetch, clock = make_prefetch(min_prefetch=3, max_prefetch=20, workers=4)
+    prefetch.record(0.001)
+    clock.now = 1.0
+    assert 20 == prefetch.update()
+    prefetch.record(100.0)
+    clock.now = 2.0
+    # 不少于工作线程数
+    assert 4 == prefetch.update()
+
+
+def test_ack_rate():
+    prefetch, clock = make_prefetch()
+    for _ in range(30):
+        prefetch.record(0.1)
+    clock.now = 2.0
+    prefetch.update()
+    assert 15.0 == prefetch.ack_rate
+    assert 20 == prefetch.snapshot()['prefetch']
+
+
+def simulate(prefetch, clock, latency, seconds, rng):
+    '''按当前prefetch模拟处理seconds秒，每秒调用一次update
+    :return: 每秒的prefetch_count
+    '''
+    chosen = []
+    for _ in range(seconds):
+        # 每秒最多处理workers / 处理耗时条，也不会超过prefetch允许的未确认条数
+        handled = max(1, int(min(prefetch.prefetch, prefetch.workers / latency)))
+        for _ in range(handled):
+            prefetch.record(latency * rng.uniform(0.95, 1.05))
+        clock.now += 1.0
+        prefetch.update()
+        chosen.append(prefetch.prefetch)
+    return chosen
+
+
+def test_follows_handler_latency():
+    rng = random.Random(1)
+    prefetch, clock = make_prefetch(prefetch=1, max_prefetch=200, workers=4, alpha=0.2)
+    # 处理耗时变化后prefetch收敛到 目标时间 * 线程数 / 处理耗时（限制在上下限之间），稳定后不再调整
+    for latency, expected in ((0.1, 40), (0.9, 5), (0.05, 80), (0.01, 200), (0.3, 14)):
+        start = len(prefetch.decisions)
+        chosen = simulate(prefetch, clock, latency, 20, rng)
+        adjustments = len(prefetch.decisions)
+        # 每次调整都朝着新的目标值，不来回振荡
+        steps = [decision['to'] - decision['from'] for decision in list(prefetch.decisions)[start:]]
+        assert steps and (all(step > 0 for step in steps) or all(step < 0 for step in steps)), (latency, steps)
+        stable = simulate(prefetch, clock, latency, 10, rng)
+        assert abs(chosen[-1] - expected) <= max(1, expected * 0.1), (latency, chosen)
+        assert all(value == chosen[-1] for value in stable), (latency, stable)
+        assert adjustments == len(prefetch.decisions)
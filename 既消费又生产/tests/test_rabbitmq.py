@@ -0,0 +1,201 @@
+import time
+import threading
+import pytest
+from common.rabbitmq.rabbitmq import (MessageHandlerFactory, RabbitMQConnectionPool, ChannelPool,
+                                      IMessageCallBack)
+from common.rabbitmq.memory import MemoryBroker, MemoryConnection, get_broker
+
+MESSAGE_PARAMS = {
+    "exchange": "test_exchange",
+    "exchange_type": "direct",
+    "routing_key": "data_queue",
+    "task_queue": "task_queue",
+    "publish_data_queue": ["data_queue"],
+    "durable": True,
+    "delivery_mode": 2,
+}
+
+
+def connect_params(broker_name, **kwargs):
+    return dict({'transport': 'memory', 'memory_broker': broker_name}, **kwargs)
+
+
+def test_handler_close_releases_channels(broker_name):
+    for publish_mode in (None, 'pool'):
+        params = dict(MESSAGE_PARAMS, publish_mode=publish_mode)
+        counts = []
+        for number in range(5):
+            handler = MessageHandlerFactory.get_instance('RabbitMQ', connect_params(broker_name, pool_max_size=1),
+                                                         params)
+            handler.on_bind()
+            handler.publish_message({'number': number})
+            connection = handler.connection
+            handler.close()
+            counts.append(len(connection._channels))
+        assert [0] * 5 == counts
+    assert 10 == len(get_broker(broker_name).queues['data_queue'])
+
+
+def test_connection_pool_reuses_released_connection(broker_name):
+    params = connect_params(broker_name, pool_max_size=1)
+    first = MessageHandlerFactory.get_instance('RabbitMQ', params, MESSAGE_PARAMS)
+    connection = first.connection
+    first.close()
+    second = MessageHandlerFactory.get_instance('RabbitMQ', params, MESSAGE_PARAMS)
+    assert second.connection is connection
+    second.close()
+
+
+def test_connection_pool_drops_closed_connection():
+    created = []
+
+    def connect():
+        created.append(MemoryConnection(MemoryBroker()))
+        return created[-1]
+
+    pool = RabbitMQConnectionPool(connect, max_size=1)
+    connection = pool.checkout()
+    connection.close()
+    pool.checkin(connection)
+    assert pool.checkout() is not connection
+    assert 2 == len(created)
+
+
+def test_channel_pool_release():
+    connection = MemoryConnection(MemoryBroker())
+    pool = ChannelPool(connection, size=1)
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    # 超出size的信道被关闭
+    pool.release(second)
+    assert second.is_closed and first.is_open
+    assert pool.acquire() is first
+    pool.release(first)
+    # 已关闭的信道不再借出
+    first.close()
+    third = pool.acquire()
+    assert third is not first
+    pool.release(third)
+    pool.close()
+    assert [] == [channel for channel in connection._channels if channel.is_open]
+
+
+def test_publish_from_worker_threads(broker_name, tmp_path, monkeypatch):
+    from common.rabbitmq.memory import MemoryChannel
+    # 记录同时在连接上发布的线程数
+    active = []
+    overlaps = []
+    basic_publish = MemoryChannel.basic_publish
+
+    def checked_publish(self, *args, **kwargs):
+        active.append(None)
+        overlaps.append(len(active))
+        time.sleep(0.0001)
+        try:
+            return basic_publish(self, *args, **kwargs)
+        finally:
+            active.pop()
+
+    monkeypatch.setattr(MemoryChannel, 'basic_publish', checked_publish)
+    params = dict(MESSAGE_PARAMS, publish_mode='pool', spill={'path': str(tmp_path / 'spill')})
+    handler = MessageHandlerFactory.get_instance('RabbitMQ', connect_params(broker_name), params)
+    handler.on_bind()
+
+    def publish(worker):
+        for number in range(100):
+            handler.publish_message({'worker': worker, 'number': number})
+
+    threads = [threading.Thread(target=publish, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    handler.close()
+    assert 1 == max(overlaps)
+    bodies = [handler.codec.decode(body) for _, body in get_broker(broker_name).queues['data_queue']]
+    assert 800 == len(bodies)
+    for worker in range(8):
+        assert list(range(100)) == [body['number'] for body in bodies if body['worker'] == worker]
+
+
+class Flaky(IMessageCallBack):
+    # 前failures次处理失败（返回False或者抛出异常），之后成功，成功count次后停止消费
+    def __init__(self, handler, failures, count, raises):
+        self.handler = handler
+        self.failures = failures
+        self.count = count
+        self.raises = raises
+        self.calls = 0
+        self.succeeded = []
+
+    def callback(self, ch, method, properties, body):
+        self.calls += 1
+        if self.calls <= self.failures:
+            if self.raises:
+                raise RuntimeError('处理失败')
+            return False
+        self.succeeded.append(body)
+        if len(self.succeeded) >= self.count:
+            self.handler.stop_consuming()
+        return True
+
+
+@pytest.mark.parametrize('raises', [False, True])
+def test_failed_message_requeued_without_batcher(broker_name, raises):
+    params = dict(MESSAGE_PARAMS, routing_key='task_queue', publish_data_queue=['task_queue'], prefetch_count=1)
+    handler = MessageHandlerFactory.get_instance('RabbitMQ', connect_params(broker_name), params)
+    handler.on_bind()
+    handler.publish_message(b'1')
+    handler.publish_message(b'2')
+    flaky = Flaky(handler, 2, 2, raises)
+    # 消息一直不确认时消费会停住，超时后停止，让断言失败而不是卡住
+    watchdog = threading.Timer(5.0, handler.stop_consuming)
+    watchdog.start()
+    try:
+        handler.start_consuming(flaky)
+    finally:
+        watchdog.cancel()
+    handler.close()
+    assert 4 == flaky.calls
+    assert [b'1', b'2'] == sorted(flaky.succeeded)
+    assert 0 == len(get_broker(broker_name).queues['task_queue'])
+
+
+def test_memory_broker_drops_idle_connection():
+    from pika.exceptions import ConnectionClosed
+    connection = MemoryConnection(MemoryBroker(), heartbeat=0.02)
+    connection.channel().close()
+    time.sleep(0.1)
+    with pytest.raises(ConnectionClosed):
+        connection.channel()
+    assert connection.is_closed
+
+
+def test_publisher_connection_kept_alive(broker_name):
+    handler = MessageHandlerFactory.get_instance('RabbitMQ', connect_params(broker_name, heartbeat_interval=0.02),
+                                                 MESSAGE_PARAMS)
+    handler.on_bind()
+    handler.publish_message(b'1')
+    connection = handler.connection
+    # 两次发布之间的间隔（如耗时长的回调）超过两个心跳间隔
+    time.sleep(0.2)
+    assert connection.is_open
+    handler.publish_message(b'2')
+    assert handler.connection is connection
+    handler.close()
+    assert handler._keepalive is None
+    assert [b'1', b'2'] == [body for _, body in get_broker(broker_name).queues['data_queue']]
+
+
+@pytest.mark.parametrize('publish_mode', [None, 'pool'])
+def test_publish_reconnects_after_connection_dropped(broker_name, publish_mode):
+    handler = MessageHandlerFactory.get_instance('RabbitMQ', connect_params(broker_name),
+                                                 dict(MESSAGE_PARAMS, publish_mode=publish_mode))
+    handler.on_bind()
+    handler.publish_message(b'1')
+    dropped = handler.connection
+    dropped._broker_close(320, 'CONNECTION_FORCED - missed heartbeats from client')
+    handler.publish_message(b'2')
+    assert handler.connection is not dropped
+    handler.close()
+    assert [b'1', b'2'] == [body for _, body in get_broker(broker_name).queues['data_queue']]
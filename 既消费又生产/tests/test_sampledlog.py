@@ -0,0 +1,65 @@
+import sys
+import logging
+import threading
+from common.sampledlog import SampledLogger
+
+
+class Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_logger(name):
+    handler = Records()
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.handlers = [handler]
+    return logger, handler
+
+
+def run_threads(function, count=8):
+    threads = [threading.Thread(target=function) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_shared_between_threads():
+    # 让线程在读写计数之间频繁切换，没有锁时会丢失计数
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        logger, handler = make_logger('test_sampledlog.shared')
+        log = SampledLogger(logger, every=100, interval=3600)
+
+        def work():
+            for _ in range(20000):
+                log.count('task')
+                log.sample('seen', 'seen')
+
+        run_threads(work)
+        log.flush()
+    finally:
+        sys.setswitchinterval(interval)
+    summary = [record for record in handler.records if 'summary' == record.event]
+    assert [{'task': 160000}] == [record.counts for record in summary]
+    # 日志在锁外输出，顺序不固定
+    sampled = sorted(record.occurrence for record in handler.records if 'seen' == record.event)
+    assert list(range(1, 160000, 100)) == sampled
+
+
+def test_flush_interval():
+    now = [0.0]
+    logger, handler = make_logger('test_sampledlog.interval')
+    log = SampledLogger(logger, interval=10, clock=lambda: now[0])
+    log.count('task', 5)
+    now[0] = 10.0
+    log.count('task')
+    log.count('task')
+    assert [{'task': 6}] == [record.counts for record in handler.records]
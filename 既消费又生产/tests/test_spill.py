@@ -0,0 +1,103 @@
+import pytest
+from common.rabbitmq.spill import SpillBuffer
+from common.rabbitmq.reconnect import ReconnectPolicy
+from common.rabbitmq.rabbitmq import MessageHandlerFactory
+from common.rabbitmq.memory import get_broker
+from common.metrics import REGISTRY
+
+
+def drain(spill):
+    records = []
+    while True:
+        record = spill.pop()
+        if record is None:
+            return records
+        records.append(record)
+
+
+def test_order_across_memory_and_disk(tmp_path):
+    spill = SpillBuffer(str(tmp_path), capacity=3, segment_size=64)
+    for number in range(20):
+        spill.put(b'%i' % number, 'application/json', 'zlib' if number % 2 else None)
+    assert 20 == len(spill)
+    assert 17 == spill.spilled
+    records = drain(spill)
+    assert [b'%i' % number for number in range(20)] == [bytes(body) for body, _, _ in records]
+    assert ['zlib' if number % 2 else None for number in range(20)] == [encoding for _, _, encoding in records]
+    spill.close()
+
+
+def test_unget_keeps_order(tmp_path):
+    spill = SpillBuffer(str(tmp_path), capacity=2)
+    for number in range(5):
+        spill.put(b'%i' % number)
+    first, second = spill.pop(), spill.pop()
+    spill.unget([first, second])
+    assert [b'%i' % number for number in range(5)] == [bytes(body) for body, _, _ in drain(spill)]
+    spill.close()
+
+
+def test_recovered_after_close(tmp_path):
+    spill = SpillBuffer(str(tmp_path), capacity=5, segment_size=64)
+    for number in range(20):
+        spill.put('消息%i' % number, 'application/json')
+    # 取完内存中的5条后继续从磁盘上读到第二个段文件的中间，剩下的（包括放回内存的）关闭时留在磁盘上
+    records = [spill.pop() for _ in range(8)]
+    spill.unget(records[-2:])
+    spill.close()
+    reopened = SpillBuffer(str(tmp_path), capacity=5, segment_size=64)
+    assert 14 == len(reopened)
+    reopened.put('消息20')
+    assert ['消息%i' % number for number in range(6, 21)] == [bytes(body).decode('utf-8')
+                                                            for body, _, _ in drain(reopened)]
+    reopened.close()
+    assert 0 == len(SpillBuffer(str(tmp_path)))
+
+
+@pytest.mark.parametrize('segment_size', [64, 4096])
+def test_partially_read_segment_not_replayed(tmp_path, segment_size):
+    spill = SpillBuffer(str(tmp_path), capacity=0, segment_size=segment_size)
+    for number in range(10):
+        spill.put(b'%i' % number)
+    assert 10 == spill.spilled
+    # 从磁盘上的段文件中取出6条
+    assert [b'%i' % number for number in range(6)] == [bytes(spill.pop()[0]) for _ in range(6)]
+    spill.close()
+    reopened = SpillBuffer(str(tmp_path), capacity=0, segment_size=segment_size)
+    assert 4 == len(reopened)
+    reopened.put(b'10')
+    assert [b'%i' % number for number in range(6, 11)] == [bytes(body) for body, _, _ in drain(reopened)]
+    reopened.close()
+
+
+def test_handler_spills_while_broker_down(broker_name, tmp_path):
+    params = {"exchange": "test_exchange", "exchange_type": "direct", "routing_key": "data_queue",
+              "task_queue": "task_queue", "publish_data_queue": ["data_queue"], "durable": True,
+              "delivery_mode": 2, "spill": {"path": str(tmp_path), "capacity": 3, "segment_size": 256}}
+    connect_params = {'transport': 'memory', 'memory_broker': broker_name}
+    broker = get_broker(broker_name)
+
+    def create():
+        handler = MessageHandlerFactory.get_instance('RabbitMQ', connect_params, params)
+        handler.reconnect_policy = ReconnectPolicy(initial=0.0, jitter=False)
+        return handler
+
+    handler = create()
+    handler.on_bind()
+    for number in range(5):
+        assert handler.publish_message({'number': number}) is not None
+    broker.stop()
+    for number in range(5, 15):
+        assert handler.publish_message({'number': number}) is None
+    # Broker不可用时关闭，积压的消息留在磁盘上
+    handler.close()
+    broker.start()
+    handler = create()
+    assert 10 == len(handler.spill)
+    handler.publish_message({'number': 15})
+    assert 0 == len(handler.spill)
+    handler.close()
+    # 关闭后指标不再引用handler的spill
+    assert REGISTRY.gauge('rabbitmq_spill_messages', labels={'exchange': 'test_exchange'})._function is None
+    numbers = [handler.codec.decode(body)['number'] for _, body in broker.queues['data_queue']]
+    assert list(range(16)) == numbers